@@ -0,0 +1,175 @@
+"""ASGI-вход приложения:
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5000 --workers 4
+    GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker gunicorn -c gunicorn.conf.py asgi:app
+
+По умолчанию здесь включается ANSWER_MODE=async: вопросы из /chat и
+/support отвечаются в цикле событий (см. pipeline.py), и ожидание
+Википедии/LLM не держит ни процесс, ни поток. Сами Flask-маршруты
+синхронные и короткие (вопрос ставится в очередь, страница отдаётся
+сразу), поэтому WSGIBridge выполняет их в пуле из ASGI_THREADS потоков
+и держит между потоком и клиентом не больше ASGI_BUFFER кусков ответа.
+Стандартный asgiref.wsgi.WsgiToAsgi не годится: он гонит все запросы
+через один поток.
+"""
+import asyncio
+import io
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault("ANSWER_MODE", "async")
+
+import main  # noqa: E402
+
+
+def _environ(scope, body):
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": "HTTP/" + scope.get("http_version", "1.1"),
+        "REMOTE_ADDR": client[0],
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin-1").upper().replace("-", "_")
+        key = name if name in ("CONTENT_TYPE", "CONTENT_LENGTH") else "HTTP_" + name
+        value = value.decode("latin-1")
+        if key in environ:
+            value = environ[key] + ("; " if key == "HTTP_COOKIE" else ",") + value
+        environ[key] = value
+    return environ
+
+
+class WSGIBridge:
+    """WSGI-приложение за ASGI-сервером: каждый запрос — в пуле потоков,
+    тело ответа (в том числе поток SSE) уходит клиенту по мере готовности.
+    Между потоком и клиентом лежит не больше buffer кусков: если клиент
+    читает медленно, поток ждёт, а не копит ответ в памяти."""
+
+    def __init__(self, wsgi_app, threads=32, buffer=16):
+        self.wsgi_app = wsgi_app
+        self.buffer = buffer
+        self.executor = ThreadPoolExecutor(threads, thread_name_prefix="asgi-wsgi")
+
+    async def __call__(self, scope, receive, send):
+        body = bytearray()
+        more = True
+        while more:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            body += message.get("body", b"")
+            more = message.get("more_body", False)
+
+        loop = asyncio.get_running_loop()
+        out = asyncio.Queue()
+        credits = threading.Semaphore(self.buffer)   # свободные места в out
+        gone = threading.Event()   # клиент ушёл: генератор ответа можно бросить
+
+        def put(*item):
+            credits.acquire()
+            loop.call_soon_threadsafe(out.put_nowait, item)
+
+        def run():
+            state = {"status": None, "sent": False}
+
+            def write(data):
+                if not state["sent"]:
+                    state["sent"] = True
+                    put("start", *state["status"])
+                if data:
+                    put("body", data)
+
+            def start_response(status, headers, exc_info=None):
+                # PEP 3333: после отправки заголовков ошибку уже не заменить
+                # ответом 500 — исключение поднимается обратно в приложение
+                if exc_info:
+                    try:
+                        if state["sent"]:
+                            raise exc_info[1].with_traceback(exc_info[2])
+                    finally:
+                        exc_info = None
+                elif state["status"] is not None:
+                    raise AssertionError("start_response() called twice")
+                state["status"] = (status, headers)
+                return write
+
+            try:
+                result = self.wsgi_app(_environ(scope, bytes(body)), start_response)
+                try:
+                    for chunk in result:
+                        write(chunk)
+                        if gone.is_set():
+                            break
+                    write(b"")
+                finally:
+                    if hasattr(result, "close"):
+                        result.close()
+            except Exception as e:
+                print("asgi bridge error:", e)
+                if not state["sent"]:
+                    state["status"] = ("500 INTERNAL SERVER ERROR", [("Content-Type", "text/plain")])
+                    write(b"Internal Server Error")
+            finally:
+                put("end")
+
+        async def watch():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+            gone.set()
+
+        worker = loop.run_in_executor(self.executor, run)
+        watcher = asyncio.ensure_future(watch())
+        try:
+            while True:
+                kind, *rest = await out.get()
+                credits.release()
+                if kind == "start":
+                    status, headers = rest
+                    await send({"type": "http.response.start", "status": int(status.split()[0]),
+                                "headers": [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers]})
+                elif kind == "body":
+                    await send({"type": "http.response.body", "body": rest[0], "more_body": True})
+                else:
+                    await send({"type": "http.response.body", "body": b"", "more_body": False})
+                    break
+        finally:
+            gone.set()
+            # Клиент больше не читает: поток не должен ждать места в очереди
+            credits.release(self.buffer + 4)
+            watcher.cancel()
+            await worker
+
+
+_flask = WSGIBridge(main.app, threads=int(os.getenv("ASGI_THREADS", "32")),
+                    buffer=int(os.getenv("ASGI_BUFFER", "16")))
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "http":
+        await _flask(scope, receive, send)
+    elif scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                # Как post_worker_init в gunicorn.conf.py: индексы и кэш до первого запроса
+                await asyncio.to_thread(main.warmup)
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await asyncio.to_thread(main.answers.shutdown)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
@@ -0,0 +1,78 @@
+"""Пароли и быстрый путь входа.
+
+Пароли хранятся как соль + PBKDF2-SHA256 (формат werkzeug
+"pbkdf2:sha256:<итерации>$<соль>$<хэш>"). Число итераций задаётся
+PASSWORD_HASH_ITERATIONS: больше — дороже перебор по утёкшей базе, но и
+каждый вход. Старые записи в открытом виде ещё принимаются и
+перехэшируются при первом успешном входе (needs_rehash).
+
+hashlib.pbkdf2_hmac отпускает GIL, так что проверка не держит остальные
+потоки воркера. AuthCache запоминает результат проверки на ttl секунд,
+а одновременные одинаковые попытки (двойной клик, повтор формы) ждут
+одну проверку через SingleFlight. Ключ кэша — HMAC от логина и пароля на
+секрете приложения, сами пароли в памяти не остаются; в значении лежит
+хэш из БД, поэтому смена пароля сразу делает запись недействительной.
+"""
+import hashlib
+import hmac
+from collections import namedtuple
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from cache import MISS, LRUCache
+from singleflight import SingleFlight
+
+_HASHED = ("pbkdf2:", "scrypt:")
+
+
+def hash_password(password, iterations):
+    return generate_password_hash(password, method=f"pbkdf2:sha256:{iterations}", salt_length=16)
+
+
+def check_password(stored, password):
+    if not stored:
+        return False
+    if stored.startswith(_HASHED):
+        return check_password_hash(stored, password)
+    return hmac.compare_digest(stored.encode(), password.encode())  # запись до хэширования
+
+
+def needs_rehash(stored, iterations):
+    """Пароль в открытом виде или с другим числом итераций."""
+    return not stored.startswith(f"pbkdf2:sha256:{iterations}$")
+
+
+class AuthCache:
+    def __init__(self, secret, ttl=300, maxsize=10000):
+        self.secret = secret.encode() if isinstance(secret, str) else secret
+        self._cache = LRUCache(maxsize=maxsize, ttl=ttl)
+        self._flight = SingleFlight()
+
+    def _key(self, login, password):
+        msg = login.encode() + b"\0" + password.encode()
+        return hmac.new(self.secret, msg, hashlib.sha256).hexdigest()
+
+    def verify(self, login, password, stored):
+        """Совпадает ли пароль с хэшем stored из БД (неудачи тоже кэшируются)."""
+        key = self._key(login, password)
+        hit = self._cache.get(key)
+        if hit is not MISS and hit[0] == stored:
+            return hit[1]
+        ok, _shared = self._flight.do((key, stored), check_password, stored, password)
+        self._cache.set(key, (stored, ok))
+        return ok
+
+    def forget(self, login, password):
+        self._cache.delete(self._key(login, password))
+
+    def stats(self):
+        return self._cache.stats()
+
+
+class SessionUser(namedtuple("SessionUser", "id login is_admin tariff")):
+    """То, что страницам нужно от текущего пользователя; живёт в кэше процесса
+    вместо строки ORM, привязанной к сессии БД."""
+
+    @classmethod
+    def of(cls, user):
+        return cls(user.id, user.login, bool(user.is_admin), user.tariff)
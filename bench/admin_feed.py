@@ -0,0 +1,119 @@
+"""Админка: ответ на заявку формой с перезагрузкой страницы против JSON и ленты.
+
+Запуск из корня репозитория:
+    python bench/admin_feed.py [--rows 1000,100000] [--clicks 200]
+
+Для каждого размера таблицы support (временная база) меряется «клик»
+оператора двумя способами: старый — POST /admin с формой и GET /admin
+после редиректа, новый — POST /admin/support/<id>/answer (JSON).
+Выводятся время, байты ответа и SQL-запросы на клик. Затем открывается
+/admin/feed и меряется, через сколько ответ, записанный другим
+клиентом, приходит в ленту, и сколько стоит один опрос max(rev).
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+ADMIN = {"login": "Artem2013", "password": "Art2013Ar"}
+
+
+def pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+def main_():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", default="1000,100000", help="размеры таблицы support через запятую")
+    ap.add_argument("--clicks", type=int, default=200)
+    args = ap.parse_args()
+    tmp = tempfile.mkdtemp(prefix="neiro-feed-")
+    os.environ.update({"SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp}/feed.sqlite3", "WRITE_BEHIND": "0",
+                       "FEED_POLL_INTERVAL": "0.5"})
+    import main
+    from sqlalchemy import event
+
+    main.init_db()
+    queries = [0]
+    with main.app.app_context():
+        event.listen(main.db.engine, "before_cursor_execute", lambda *a: queries.__setitem__(0, queries[0] + 1))
+    client = main.app.test_client()
+    client.post("/login", data=ADMIN)
+
+    def click(fn, *args):
+        queries[0] = 0
+        t0 = time.perf_counter()
+        size = fn(*args)
+        return time.perf_counter() - t0, size, queries[0]
+
+    def old(sid):
+        r = client.post("/admin", data={"support_id": sid, "answer": f"ответ {time.time()}"}, follow_redirects=True)
+        return len(r.data)
+
+    def new(sid):
+        r = client.post(f"/admin/support/{sid}/answer", data={"answer": f"ответ {time.time()}"})
+        return len(r.data)
+
+    def reader(got, sent, ready):
+        with main.app.test_client() as c:
+            c.post("/login", data=ADMIN)
+            resp = c.get("/admin/feed", buffered=False)
+            ready.set()
+            for chunk in resp.response:
+                chunk = chunk.decode() if isinstance(chunk, bytes) else chunk
+                for line in chunk.splitlines():
+                    if line.startswith("data:") and '"answer": "feed ' in line:
+                        tag = line.split('"answer": "feed ', 1)[1].split('"', 1)[0]
+                        got.append(time.perf_counter() - sent[tag])
+                if len(got) >= 50:
+                    resp.close()
+                    return
+
+    print(f"{'rows':>8} {'way':<6} {'p50,ms':>7} {'p99,ms':>7} {'bytes':>8} {'queries':>8}")
+    have = 0
+    for rows in map(int, args.rows.split(",")):
+        with main.app.app_context():
+            db = main.db
+            for start in range(have, rows, 50000):
+                db.session.execute(db.insert(main.Support), [
+                    {"user_id": 1, "text": f"Вопрос оператору номер {i}", "is_tariff": i % 3 == 0}
+                    for i in range(start, min(rows, start + 50000))])
+                db.session.commit()
+            have = max(have, rows)
+        for name, fn in (("form", old), ("json", new)):
+            results = [click(fn, 1 + (i * 7919) % rows) for i in range(args.clicks)]
+            lat = [r[0] for r in results]
+            print(f"{rows:>8} {name:<6} {pct(lat, .5) * 1000:>7.2f} {pct(lat, .99) * 1000:>7.2f} "
+                  f"{results[-1][1]:>8} {results[-1][2]:>8}")
+
+        # Лента: другой клиент отвечает, этот ждёт событие
+        got, sent = [], {}
+        ready = threading.Event()
+        t = threading.Thread(target=reader, args=(got, sent, ready), daemon=True)
+        t.start()
+        ready.wait()
+        time.sleep(0.2)
+        for i in range(50):
+            sent[f"{rows}-{i}"] = time.perf_counter()
+            client.post(f"/admin/support/{1 + i}/answer", data={"answer": f"feed {rows}-{i}"})
+            time.sleep(0.02)
+        t.join(10)
+        with main.app.app_context(), main.db.engine.connect() as conn:
+            t0 = time.perf_counter()
+            for _ in range(1000):
+                main.feed_latest(conn, main.Support.__table__)
+            poll = (time.perf_counter() - t0) / 1000
+        print(f"{rows:>8} лента: доставка p50 {pct(got, .5) * 1000:.1f} мс, p99 {pct(got, .99) * 1000:.1f} мс "
+              f"({len(got)}/50); опрос max(rev) {poll * 1e6:.0f} мкс")
+    main.support_feed.close()
+    main.answers.shutdown()
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,124 @@
+"""Сколько вопросов воркер держит в полёте: ANSWER_MODE=threads против async.
+
+Запуск из корня репозитория:
+    python bench/answer_modes.py [--questions 300] [--wiki-latency 0.5]
+        [--modes threads:8,threads:32,async:8]
+
+Каждый режим запускается в отдельном процессе (как один воркер gunicorn)
+на временной базе; Википедия — локальный фейковый сервер с задержкой
+--wiki-latency, который считает одновременные запросы. Процесс ставит
+--questions уникальных вопросов через ask_async() и ждёт все ответы.
+Для режима выводятся: пик одновременных запросов к Википедии (вопросов
+в полёте), время до последнего ответа, пик потоков и пиковый RSS
+процесса — то есть сколько вопросов в полёте даёт каждый мегабайт.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class FakeWiki(BaseHTTPRequestHandler):
+    latency = 0.5
+    active = peak = 0
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        with FakeWiki.lock:
+            FakeWiki.active += 1
+            FakeWiki.peak = max(FakeWiki.peak, FakeWiki.active)
+        try:
+            time.sleep(self.latency)
+            body = json.dumps({"extract": "Это тестовая статья из фейковой Википедии. Второе."}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with FakeWiki.lock:
+                FakeWiki.active -= 1
+
+
+class Server(ThreadingHTTPServer):
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+def child(n):
+    """Один «воркер»: n вопросов через ask_async, печатает JSON с замерами."""
+    import resource
+
+    sys.path.insert(0, ROOT)
+    import main
+    main.init_db()
+    with main.app.app_context():
+        user = main.User.query.filter_by(login="Artem2013").first()
+        conv = main.get_conversation(user, "chat")
+        peak_threads = threading.active_count()
+        t0 = time.perf_counter()
+        for i in range(n):
+            # Случайные слова: иначе ответ на соседний вопрос найдётся нечётким поиском
+            main.ask_async(conv, f"{uuid.uuid4().hex} {uuid.uuid4().hex}")
+        while main.answers.pending():
+            peak_threads = max(peak_threads, threading.active_count())
+            time.sleep(0.01)
+        wall = time.perf_counter() - t0
+        done = main.Message.query.filter(main.Message.role == "ai", main.Message.text.isnot(None)).count()
+    main.answers.shutdown()
+    print(json.dumps({"wall": wall, "answered": done, "threads": peak_threads,
+                      "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+
+
+def run_mode(mode, workers, args, base):
+    tmp = tempfile.mkdtemp(prefix="neiro-modes-")
+    env = dict(os.environ, ANSWER_MODE=mode, ANSWER_WORKERS=str(workers), ANSWER_QUEUE=str(args.questions),
+               SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp}/modes.sqlite3", WIKIPEDIA_URL=base,
+               DEEPINFRA_API_KEY="", QUOTA="0", METRICS="0")
+    FakeWiki.peak = 0
+    out = subprocess.run([sys.executable, __file__, "--child", str(args.questions)], env=env, cwd=ROOT,
+                         capture_output=True, text=True, check=True)
+    result = json.loads(out.stdout.strip().splitlines()[-1])
+    result["in_flight"] = FakeWiki.peak
+    return result
+
+
+def main_():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--questions", type=int, default=300)
+    ap.add_argument("--wiki-latency", type=float, default=0.5)
+    ap.add_argument("--modes", default="threads:8,threads:32,async:8",
+                    help="режим:ANSWER_WORKERS через запятую")
+    ap.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+    if args.child:
+        child(args.child)
+        return
+
+    FakeWiki.latency = args.wiki_latency
+    server = Server(("127.0.0.1", 0), FakeWiki)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+
+    print(f"{args.questions} вопросов, задержка Википедии {args.wiki_latency * 1000:.0f} мс")
+    print(f"{'mode':<12} {'in-flight':>9} {'wall,s':>7} {'ans/s':>7} {'threads':>8} {'RSS,MB':>7} {'in-flight/MB':>13}")
+    for spec in args.modes.split(","):
+        mode, workers = spec.split(":")
+        r = run_mode(mode, int(workers), args, base)
+        print(f"{spec:<12} {r['in_flight']:>9} {r['wall']:>7.2f} {r['answered'] / r['wall']:>7.1f} "
+              f"{r['threads']:>8} {r['rss_mb']:>7.1f} {r['in_flight'] / r['rss_mb']:>13.2f}")
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,161 @@
+"""Контекст разговора для LLM: размер промпта и задержка от длины разговора.
+
+Запуск из корня репозитория:
+    python bench/context.py [--turns 80] [--budget 2048] [--modes none,full,budget]
+
+Режимы: none — LLM видит только вопрос (CONTEXT_TOKENS=0, как раньше);
+full — вся история без ограничений; budget — dialog.py с бюджетом
+--budget токенов и кратким содержанием. В каждом режиме один
+разговор из --turns вопросов задаётся через _resolve_answer(), как это
+делает фоновый конвейер; Википедия всегда отвечает 404, так что
+отвечает LLM.
+
+LLM — локальный фейковый сервер: prefill стоит --prefill мс на
+некэшированный токен, генерация — --decode мс, а кэш префиксов считает
+общее начало с уже виденными промптами (по целым сообщениям). В ответе
+он отдаёт usage.prompt_tokens и cached_tokens, как настоящий провайдер,
+а промпт длиннее окна модели (8192 токена) отклоняет с 400.
+Между вопросами бенчмарк ждёт фоновую свёртку (пользователь думает над
+следующим вопросом). Выводятся токены промпта, из них кэшированные, и
+время ответа на выбранных номерах вопроса.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from dialog import count_tokens  # noqa: E402
+
+WORDS = ("кошка", "собака", "погода", "город", "история", "планета", "музыка", "программа", "задача",
+         "ответ", "вопрос", "деньги", "работа", "школа", "книга", "машина", "дорога", "море", "лес", "река")
+
+
+class FakeLLM(BaseHTTPRequestHandler):
+    prefill = 0.0002
+    decode = 0.3
+    window = 8192   # окно контекста Llama-3-8B
+    seen = []       # промпты (кортежи сообщений), которые уже «в кэше»
+    last = None     # usage последнего ответа на вопрос
+    summaries = prompt_total = cached_total = rejected = 0
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def _json(self, status, data):
+        body = json.dumps(data, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):  # Википедия
+        self._json(404, {"title": "Not found."})
+
+    def do_POST(self):
+        req = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        msgs = tuple((m["role"], m["content"]) for m in req["messages"])
+        sizes = [count_tokens(c) + 4 for _r, c in msgs]   # +4 — служебные токены сообщения
+        with FakeLLM.lock:
+            common = 0
+            for prev in FakeLLM.seen:
+                n = 0
+                while n < min(len(prev), len(msgs)) and prev[n] == msgs[n]:
+                    n += 1
+                common = max(common, n)
+            FakeLLM.seen = (FakeLLM.seen + [msgs])[-64:]
+        usage = {"prompt_tokens": sum(sizes), "prompt_tokens_details": {"cached_tokens": sum(sizes[:common])}}
+        FakeLLM.prompt_total += usage["prompt_tokens"]
+        FakeLLM.cached_total += usage["prompt_tokens_details"]["cached_tokens"]
+        if usage["prompt_tokens"] > self.window:
+            FakeLLM.rejected += 1
+            FakeLLM.last = usage
+            self._json(400, {"error": "context length exceeded"})
+            return
+        time.sleep(self.prefill * (usage["prompt_tokens"] - usage["prompt_tokens_details"]["cached_tokens"])
+                   + self.decode)
+        if msgs[0][1].startswith("Ты ведёшь краткое содержание"):
+            FakeLLM.summaries += 1
+            text = "Пользователь спрашивал " + " ".join(random.choices(WORDS, k=80)) + "."
+        else:
+            FakeLLM.last = usage
+            text = "Ответ: " + " ".join(random.choices(WORDS, k=60)) + "."
+        self._json(200, {"choices": [{"message": {"content": text}}], "usage": usage})
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+
+def main_():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--turns", type=int, default=80)
+    ap.add_argument("--budget", type=int, default=2048)
+    ap.add_argument("--modes", default="none,full,budget")
+    ap.add_argument("--prefill", type=float, default=0.2, help="мс на некэшированный токен промпта")
+    ap.add_argument("--decode", type=float, default=300, help="мс на генерацию ответа")
+    args = ap.parse_args()
+    FakeLLM.prefill, FakeLLM.decode = args.prefill / 1000, args.decode / 1000
+    random.seed(1)
+
+    server = Server(("127.0.0.1", 0), FakeLLM)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    tmp = tempfile.mkdtemp(prefix="neiro-context-")
+    os.environ.update({
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp}/context.sqlite3",
+        "WIKIPEDIA_URL": base,
+        "DEEPINFRA_URL": base,
+        "DEEPINFRA_API_KEY": "fake",
+        "QUOTA": "0",
+        "FUZZY_THRESHOLD": "0",
+    })
+    import main
+    main.init_db()
+
+    marks = sorted({t for t in (1, 5, 10, 20, 40, 80, 160, args.turns) if t <= args.turns})
+    budgets = {"none": 0, "full": 10 ** 9, "budget": args.budget}
+    print(f"{args.turns} вопросов; prefill {args.prefill} мс/токен, генерация {args.decode:.0f} мс, "
+          f"бюджет {args.budget} токенов")
+    print(f"{'mode':<7} {'turn':>5} {'prompt':>7} {'cached':>7} {'latency,ms':>11}")
+    with main.app.app_context():
+        for mode in args.modes.split(","):
+            main.dialogs.budget = budgets[mode]
+            user = main.User(login=f"bench-{mode}", password="-", tariff="premium")
+            main.db.session.add(user)
+            main.db.session.commit()
+            conv = main.get_conversation(user, "chat")
+            before = (FakeLLM.summaries, FakeLLM.prompt_total, FakeLLM.cached_total, FakeLLM.rejected)
+            total = []
+            for turn in range(1, args.turns + 1):
+                # Уникальный вопрос без знакомых слов: иначе ответ найдётся в базе знаний
+                text = f"объясни {random.getrandbits(64):x} и чем он отличается от {random.getrandbits(64):x}"
+                ai = main.add_question(conv, text)
+                t0 = time.perf_counter()
+                main._resolve_answer(ai.id, text, tariff="premium")
+                lat = time.perf_counter() - t0
+                total.append(lat)
+                while main.dialogs.stats()["pending"]:
+                    time.sleep(0.01)
+                if turn in marks:
+                    u = FakeLLM.last
+                    print(f"{mode:<7} {turn:>5} {u['prompt_tokens']:>7} "
+                          f"{u['prompt_tokens_details']['cached_tokens']:>7} {lat * 1000:>11.0f}")
+            summaries, prompt, cached, rejected = (now - was for now, was in zip(
+                (FakeLLM.summaries, FakeLLM.prompt_total, FakeLLM.cached_total, FakeLLM.rejected), before))
+            print(f"{mode:<7} {'всего':>5} среднее {sum(total) / len(total) * 1000:.0f} мс; токенов промпта {prompt} "
+                  f"(из кэша {cached}), свёрток {summaries}, отказов по окну {rejected}")
+    main.answers.shutdown()
+
+
+if __name__ == "__main__":
+    main_()
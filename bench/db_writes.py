@@ -0,0 +1,106 @@
+"""Нагрузочный тест записи в SQLite из нескольких процессов.
+
+Запуск из корня репозитория:
+    python bench/db_writes.py [--procs 8] [--rows 500]
+
+Каждый процесс имитирует воркер gunicorn, который сохраняет новые фразы
+Knowledge, и параллельно читает таблицу, как делает sync_phrases().
+Сравниваются два режима:
+  baseline — настройки SQLite по умолчанию, commit на каждую строку
+             (как было в smart_answer_learn);
+  tuned    — configure_sqlite() (WAL, busy_timeout, ...) + WriteBehind.
+"""
+import argparse
+import multiprocessing as mp
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import Column, Integer, MetaData, String, Table, Text, create_engine, insert, select  # noqa: E402
+from sqlalchemy.exc import OperationalError  # noqa: E402
+
+from storage import WriteBehind, configure_sqlite, engine_options  # noqa: E402
+
+metadata = MetaData()
+knowledge = Table(
+    "knowledge", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("phrase", String(256), nullable=False, unique=True),
+    Column("answer", Text, nullable=False),
+)
+
+
+def make_engine(path, mode):
+    uri = f"sqlite:///{path}"
+    if mode == "baseline":
+        return create_engine(uri)
+    engine = create_engine(uri, **engine_options(uri))
+    configure_sqlite(engine)
+    return engine
+
+
+def worker(path, mode, proc, rows, out):
+    engine = make_engine(path, mode)
+    locked = 0
+    t0 = time.perf_counter()
+    wb = WriteBehind(engine, batch_size=100, interval=0.05) if mode == "tuned" else None
+    last_id = 0
+    for i in range(rows):
+        row = {"phrase": f"вопрос {proc}-{i}", "answer": "ответ " * 20}
+        if wb is not None:
+            wb.put(knowledge, row)
+        else:
+            try:
+                with engine.begin() as conn:
+                    conn.execute(insert(knowledge), row)
+            except OperationalError:
+                locked += 1
+        if i % 10 == 0:
+            try:
+                with engine.connect() as conn:
+                    ids = conn.execute(select(knowledge.c.id).where(knowledge.c.id > last_id)).scalars().all()
+                    last_id = max(ids, default=last_id)
+            except OperationalError:
+                locked += 1
+    if wb is not None:
+        wb.flush()
+        locked += wb.errors
+    out.put((time.perf_counter() - t0, locked))
+
+
+def run(mode, procs, rows):
+    path = os.path.join(tempfile.mkdtemp(prefix="neiro-db-"), "bench.sqlite3")
+    metadata.create_all(make_engine(path, mode))
+    out = mp.Queue()
+    ps = [mp.Process(target=worker, args=(path, mode, p, rows, out)) for p in range(procs)]
+    t0 = time.perf_counter()
+    for p in ps:
+        p.start()
+    results = [out.get() for _ in ps]
+    for p in ps:
+        p.join()
+    wall = time.perf_counter() - t0
+    with make_engine(path, mode).connect() as conn:
+        stored = len(conn.execute(select(knowledge.c.id)).all())
+    errors = sum(r[1] for r in results)
+    return stored / wall, errors, stored
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--procs", type=int, default=8)
+    ap.add_argument("--rows", type=int, default=500)
+    args = ap.parse_args()
+    total = args.procs * args.rows
+    print(f"{args.procs} процессов x {args.rows} вставок")
+    print(f"{'mode':<9} {'rows/s':>9} {'lock errors':>12} {'stored':>9}")
+    for mode in ("baseline", "tuned"):
+        rps, errors, stored = run(mode, args.procs, args.rows)
+        print(f"{mode:<9} {rps:>9.0f} {errors:>12} {stored:>6}/{total}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""Поиск во внешних сервисах: LOOKUP_POLICY serial против parallel и hedged.
+
+Запуск из корня репозитория:
+    python bench/hedge.py [--lookups 300] [--clients 8] [--wiki-hit-ratio 0.5]
+        [--wiki-latency 0.15] [--wiki-tail 0.1] [--llm-latency 0.6]
+
+Википедия и LLM — локальные фейковые серверы. Задержка Википедии —
+--wiki-latency, но доля --wiki-tail запросов отвечает в 10 раз дольше;
+найдётся ли статья и сколько ждать, зависит только от текста вопроса,
+поэтому все политики получают одинаковый набор. Для каждой политики
+search_wikipedia() вызывается на одних и тех же уникальных вопросах из
+--clients потоков; выводятся p50/p95/p99 всех поисков и отдельно
+промахов Википедии, а также сколько вызовов LLM это стоило.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+class Fake(BaseHTTPRequestHandler):
+    wiki_latency = 0.15
+    wiki_tail = 0.1
+    wiki_hit_ratio = 0.5
+    llm_latency = 0.6
+    llm_calls = 0
+    wiki_hits = set()   # вопросы, у которых «есть статья»
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def _json(self, status, data):
+        body = json.dumps(data, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        h = int(hashlib.md5(self.path.encode()).hexdigest(), 16)
+        slow = (h % 1000) / 1000 < self.wiki_tail
+        time.sleep(self.wiki_latency * (10 if slow else 1))
+        if (h // 1000 % 1000) / 1000 < self.wiki_hit_ratio:
+            Fake.wiki_hits.add(unquote(self.path).rsplit("/", 1)[1].replace("_", " "))
+            self._json(200, {"extract": "Это тестовая статья из фейковой Википедии. Второе предложение."})
+        else:
+            self._json(404, {"title": "Not found."})
+
+    def do_POST(self):
+        with Fake.lock:
+            Fake.llm_calls += 1
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(self.llm_latency)
+        self._json(200, {"choices": [{"message": {"content": "Ответ фейковой модели."}}]})
+
+
+class Server(ThreadingHTTPServer):
+    request_queue_size = 256
+    daemon_threads = True
+
+
+def pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+def main_():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--lookups", type=int, default=300)
+    ap.add_argument("--clients", type=int, default=8)
+    ap.add_argument("--wiki-hit-ratio", type=float, default=0.5)
+    ap.add_argument("--wiki-latency", type=float, default=0.15)
+    ap.add_argument("--wiki-tail", type=float, default=0.1)
+    ap.add_argument("--llm-latency", type=float, default=0.6)
+    ap.add_argument("--hedge-delay", type=float, default=0.3)
+    ap.add_argument("--deadline", type=float, default=1.0)
+    args = ap.parse_args()
+
+    Fake.wiki_latency, Fake.wiki_tail = args.wiki_latency, args.wiki_tail
+    Fake.wiki_hit_ratio, Fake.llm_latency = args.wiki_hit_ratio, args.llm_latency
+    server = Server(("127.0.0.1", 0), Fake)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    tmp = tempfile.mkdtemp(prefix="neiro-hedge-")
+    os.environ.update({
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp}/hedge.sqlite3",
+        "WIKIPEDIA_URL": base,
+        "DEEPINFRA_URL": base,
+        "DEEPINFRA_API_KEY": "fake",
+        "WIKIPEDIA_TIMEOUT": "5",
+        "LLM_CONCURRENCY": str(args.clients),
+        "LOOKUP_HEDGE_DELAY": str(args.hedge_delay),
+        "LOOKUP_DEADLINE": str(args.deadline),
+    })
+    import main
+    main.init_db()
+    queries = [f"вопрос для гонки {i}" for i in range(args.lookups)]
+
+    def one(query):
+        with main.app.app_context():
+            t0 = time.perf_counter()
+            main.search_wikipedia(query, "premium")
+            return time.perf_counter() - t0
+
+    print(f"{args.lookups} поисков, {args.clients} потоков; Википедия {args.wiki_latency * 1000:.0f} мс "
+          f"(хвост {args.wiki_tail:.0%} x10), статья есть у {args.wiki_hit_ratio:.0%}, LLM {args.llm_latency * 1000:.0f} мс")
+    print(f"{'policy':<9} {'p50,ms':>7} {'p95,ms':>7} {'p99,ms':>7} {'miss p50':>9} {'miss p99':>9} "
+          f"{'LLM calls':>10} {'cancelled':>10}")
+    for policy in ("serial", "parallel", "hedged"):
+        main.LOOKUP_POLICY = policy
+        main.answer_cache.local.clear()
+        calls_before, cancelled_before = Fake.llm_calls, main.llm_dispatch.cancelled
+        with ThreadPoolExecutor(args.clients) as pool:
+            results = list(pool.map(one, queries))
+        # дождаться запросов, чей результат уже не нужен, чтобы они не мешали следующей политике
+        time.sleep(max(args.llm_latency, args.wiki_latency * 10) + 0.2)
+        lat = results
+        miss = [t for q, t in zip(queries, results) if q not in Fake.wiki_hits]
+        print(f"{policy:<9} {pct(lat, .5) * 1000:>7.0f} {pct(lat, .95) * 1000:>7.0f} {pct(lat, .99) * 1000:>7.0f} "
+              f"{pct(miss, .5) * 1000:>9.0f} {pct(miss, .99) * 1000:>9.0f} "
+              f"{Fake.llm_calls - calls_before:>10} {main.llm_dispatch.cancelled - cancelled_before:>10}")
+    main.answers.shutdown()
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,136 @@
+"""Диспетчер LLM против прямых вызовов на фейковом OpenAI-совместимом сервере.
+
+Запуск из корня репозитория:
+    python bench/llm_dispatch.py [--requests 400] [--clients 64] [--capacity 8] [--latency 0.1]
+
+Фейковый сервер держит не больше --capacity запросов одновременно,
+остальным отвечает 429 (как провайдер с лимитом), и повторяет каждый
+десятый промпт, чтобы было что склеивать. Второй прогон — авария:
+сервер отвечает 503, и видно, как быстро выключатель перестаёт
+отправлять запросы.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llm_dispatch import CircuitBreaker, LLMDispatcher  # noqa: E402
+from upstream import UpstreamClient  # noqa: E402
+
+
+class FakeLLM(BaseHTTPRequestHandler):
+    capacity = 8
+    latency = 0.1
+    outage = False
+    active = 0
+    hits = {"ok": 0, "429": 0, "503": 0}
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status, data, headers=()):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        for k, v in headers:
+            self.send_header(k, v)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        prompt = json.loads(self.rfile.read(int(self.headers["Content-Length"])))["messages"][-1]["content"]
+        cls = FakeLLM
+        if cls.outage:
+            with cls.lock:
+                cls.hits["503"] += 1
+            return self._reply(503, {"error": "down"})
+        with cls.lock:
+            busy = cls.active >= cls.capacity
+            if busy:
+                cls.hits["429"] += 1
+            else:
+                cls.active += 1
+        if busy:
+            return self._reply(429, {"error": "rate limit"}, [("Retry-After", "1")])
+        try:
+            time.sleep(cls.latency)
+            with cls.lock:
+                cls.hits["ok"] += 1
+            self._reply(200, {"choices": [{"message": {"content": "ответ: " + prompt}}]})
+        finally:
+            with cls.lock:
+                cls.active -= 1
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+
+def make_call(client):
+    def call(prompt, system_prompt, history=()):
+        resp = client.post("/v1/openai/chat/completions", json={
+            "model": "fake", "messages": [{"role": "system", "content": system_prompt},
+                                          {"role": "user", "content": prompt}]})
+        if resp.status_code != 200:
+            ra = resp.headers.get("Retry-After", "")
+            return resp.status_code, None, float(ra) if ra.isdigit() else None
+        return 200, resp.json()["choices"][0]["message"]["content"], None
+    return call
+
+
+def run(mode, ask, args):
+    FakeLLM.hits = {"ok": 0, "429": 0, "503": 0}
+    prompts = [f"вопрос {i % (args.requests * 9 // 10)}" for i in range(args.requests)]
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(args.clients) as pool:
+        answers = list(pool.map(ask, prompts))
+    wall = time.perf_counter() - t0
+    ok = sum(1 for a in answers if a)
+    print(f"{mode:<22} {ok / len(prompts):>7.1%} {wall:>7.2f} {FakeLLM.hits['ok']:>6} "
+          f"{FakeLLM.hits['429']:>6} {FakeLLM.hits['503']:>6}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--requests", type=int, default=400)
+    ap.add_argument("--clients", type=int, default=64)
+    ap.add_argument("--capacity", type=int, default=8)
+    ap.add_argument("--latency", type=float, default=0.1)
+    args = ap.parse_args()
+    FakeLLM.capacity, FakeLLM.latency = args.capacity, args.latency
+    server = Server(("127.0.0.1", 0), FakeLLM)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = UpstreamClient("fake", f"http://127.0.0.1:{server.server_address[1]}", timeout=10,
+                            pool_size=args.clients)
+    call = make_call(client)
+
+    def direct(prompt):
+        try:
+            return call(prompt, "sys")[1]
+        except Exception:
+            return None
+
+    print(f"{'mode':<22} {'ok':>7} {'wall,s':>7} {'200':>6} {'429':>6} {'503':>6}")
+    run("direct", direct, args)
+    dispatcher = LLMDispatcher(call, max_concurrency=args.capacity * 2, backoff=0.2, max_backoff=2)
+    run("dispatcher", lambda p: dispatcher.ask(p, "sys"), args)
+    print(f"  limit {dispatcher.limit:.1f}, coalesced {dispatcher.coalesced}, throttled {dispatcher.throttled}")
+
+    FakeLLM.outage = True
+    run("direct, outage", direct, args)
+    dispatcher = LLMDispatcher(call, max_concurrency=args.capacity, breaker=CircuitBreaker(5, 30))
+    run("dispatcher, outage", lambda p: dispatcher.ask(p, "sys"), args)
+    print(f"  breaker {dispatcher.breaker.state}, skipped {dispatcher.skipped}")
+
+
+if __name__ == "__main__":
+    main()
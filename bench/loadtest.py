@@ -0,0 +1,251 @@
+"""Нагрузочный тест приложения целиком: несколько клиентов по HTTP.
+
+Запуск из корня репозитория:
+    python bench/loadtest.py [--clients 16] [--duration 20] [--users 1000]
+        [--knowledge 10000] [--support 5000] [--wiki-latency 0.05]
+        [--llm-latency 0.3] [--out bench-results.json]
+
+Приложение поднимается в этом же процессе на временной базе SQLite
+(многопоточный сервер werkzeug на свободном порту). Википедия и DeepInfra
+заменены локальными фейковыми серверами с заданной задержкой, так что
+тест не ходит в сеть и повторяем. Клиенты логинятся своими
+пользователями и в случайном порядке дёргают /chat (GET и POST),
+/support, /admin и снова /login; по каждому маршруту выводятся req/s и p50/p95/p99,
+а всё вместе с параметрами прогона пишется в JSON для сравнения
+между прогонами.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+ADMIN = {"login": "Artem2013", "password": "Art2013Ar"}
+# маршрут: (метод, путь, вес, нужен ли админ)
+ROUTES = {
+    "GET /chat": ("GET", "/chat", 4, False),
+    "POST /chat": ("POST", "/chat", 4, False),
+    "POST /support": ("POST", "/support", 1, False),
+    "GET /admin": ("GET", "/admin", 1, True),
+    "POST /login": ("POST", "/login", 1, False),
+}
+
+
+class FakeUpstream(BaseHTTPRequestHandler):
+    """Википедия (/api/rest_v1/page/summary/...) и LLM (/v1/openai/chat/completions)."""
+    wiki_latency = 0.0
+    llm_latency = 0.0
+    wiki_hit_ratio = 0.5
+    calls = {"wiki": 0, "llm": 0}
+
+    def log_message(self, *args):
+        pass
+
+    def _json(self, status, data):
+        body = json.dumps(data, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        FakeUpstream.calls["wiki"] += 1
+        time.sleep(self.wiki_latency)
+        if random.random() < self.wiki_hit_ratio:
+            self._json(200, {"extract": "Это тестовая статья из фейковой Википедии. Второе предложение."})
+        else:
+            self._json(404, {"title": "Not found."})
+
+    def do_POST(self):
+        FakeUpstream.calls["llm"] += 1
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(self.llm_latency)
+        self._json(200, {"choices": [{"message": {"content": "Ответ фейковой модели."}}]})
+
+
+def start_server(server):
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def boot_app(args):
+    """Настраивает окружение, импортирует main и поднимает его на свободном порту."""
+    FakeUpstream.wiki_latency = args.wiki_latency
+    FakeUpstream.llm_latency = args.llm_latency
+    FakeUpstream.wiki_hit_ratio = args.wiki_hit_ratio
+    fake = start_server(ThreadingHTTPServer(("127.0.0.1", 0), FakeUpstream))
+    tmp = tempfile.mkdtemp(prefix="neiro-load-")
+    os.environ.update({
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp}/load.sqlite3",
+        "WIKIPEDIA_URL": fake,
+        "DEEPINFRA_URL": fake,
+        "DEEPINFRA_API_KEY": "fake",
+        "QUOTA": "0",  # меряем приложение, а не лимиты тарифов
+    })
+    import main
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    main.init_db()
+    seed(main, args)
+    main.precompile_templates()
+    server = make_server("127.0.0.1", 0, main.app, threaded=True, request_handler=QuietHandler)
+    return main, start_server(server)
+
+
+def seed(main, args):
+    t0 = time.perf_counter()
+    with main.app.app_context():
+        db = main.db
+        db.session.execute(db.insert(main.User), [
+            {"login": f"user{i}", "password": "pass", "is_admin": False,
+             "tariff": ("demo", "standart", "premium")[i % 3]} for i in range(args.users)])
+        db.session.execute(db.insert(main.Knowledge), [
+            {"phrase": f"вопрос номер {i} про тестовую тему", "answer": f"ответ {i}"} for i in range(args.knowledge)])
+        db.session.commit()
+        uids = [u for (u,) in db.session.query(main.User.id)]
+        db.session.execute(db.insert(main.Support), [
+            {"user_id": random.choice(uids), "text": f"обращение {i}", "is_tariff": i % 4 == 0,
+             "answer": "готово" if i % 2 else None} for i in range(args.support)])
+        db.session.commit()
+    print(f"база: {args.users} пользователей, {args.knowledge} фраз, {args.support} заявок "
+          f"за {time.perf_counter() - t0:.1f} с")
+
+
+def question(args):
+    r = random.random()
+    if r < 0.5:  # фраза из базы знаний
+        return f"вопрос номер {random.randrange(args.knowledge)} про тестовую тему"
+    if r < 0.7:  # повтор популярного — должен браться из кэша
+        return f"популярный вопрос {random.randrange(20)}"
+    return f"новый вопрос {random.getrandbits(40)}"
+
+
+def request(s, base, method, path, data):
+    """Один запрос: (секунды, успешен ли). Вход успешен только редиректом в чат:
+    200 на /login — это форма с ошибкой."""
+    t0 = time.perf_counter()
+    try:
+        if path == "/login":
+            resp = s.post(base + path, data=data, timeout=30, allow_redirects=False)
+            ok = resp.status_code == 302
+        else:
+            resp = s.request(method, base + path, data=data, timeout=30)
+            ok = resp.status_code == 200
+    except requests.RequestException:
+        ok = False
+    return time.perf_counter() - t0, ok
+
+
+def client(base, login, args, deadline, results, lock):
+    s = requests.Session()
+    is_admin = login is ADMIN
+    routes = [(name, r) for name, r in ROUTES.items() if is_admin or not r[3]]
+    weights = [r[2] for _, r in routes]
+    local = {name: [] for name, _ in routes}
+    elapsed, ok = request(s, base, "POST", "/login", login)
+    local["POST /login"].append(elapsed)
+    errors = int(not ok)
+    while time.monotonic() < deadline:
+        name, (method, path, _w, _a) = random.choices(routes, weights)[0]
+        if path == "/login":
+            s.cookies.clear()   # иначе /login сразу редиректит, не проверяя пароль
+            data = login
+        else:
+            data = {"text": question(args)} if method == "POST" else None
+        elapsed, ok = request(s, base, method, path, data)
+        local[name].append(elapsed)
+        errors += not ok
+    with lock:
+        for name, lat in local.items():
+            results["latency"].setdefault(name, []).extend(lat)
+        results["errors"] += errors
+
+
+def pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+def git_rev():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main_():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--clients", type=int, default=16)
+    ap.add_argument("--admins", type=int, default=1, help="сколько клиентов из --clients ходят админом")
+    ap.add_argument("--duration", type=float, default=20)
+    ap.add_argument("--users", type=int, default=1000)
+    ap.add_argument("--knowledge", type=int, default=10000)
+    ap.add_argument("--support", type=int, default=5000)
+    ap.add_argument("--wiki-latency", type=float, default=0.05)
+    ap.add_argument("--llm-latency", type=float, default=0.3)
+    ap.add_argument("--wiki-hit-ratio", type=float, default=0.5)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--out", default="bench-results.json")
+    args = ap.parse_args()
+    random.seed(args.seed)
+
+    main, base = boot_app(args)
+    results = {"latency": {}, "errors": 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + args.duration
+    logins = [ADMIN if i < args.admins else {"login": f"user{i % args.users}", "password": "pass"}
+              for i in range(args.clients)]
+    threads = [threading.Thread(target=client, args=(base, login, args, deadline, results, lock))
+               for login in logins]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - t0
+    main.answers.shutdown(wait=True)
+
+    routes = {}
+    print(f"{'route':<14} {'req/s':>8} {'p50,ms':>8} {'p95,ms':>8} {'p99,ms':>8}")
+    for name, lat in sorted(results["latency"].items()):
+        routes[name] = {"requests": len(lat), "rps": len(lat) / wall,
+                        "p50": pct(lat, 0.5), "p95": pct(lat, 0.95), "p99": pct(lat, 0.99)}
+        r = routes[name]
+        print(f"{name:<14} {r['rps']:>8.1f} {r['p50'] * 1000:>8.1f} {r['p95'] * 1000:>8.1f} {r['p99'] * 1000:>8.1f}")
+    total = sum(len(v) for v in results["latency"].values())
+    print(f"всего {total / wall:.1f} req/s, ошибок {results['errors']}, "
+          f"вызовов Википедии {FakeUpstream.calls['wiki']}, LLM {FakeUpstream.calls['llm']}")
+
+    report = {
+        "git": git_rev(),
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "params": vars(args),
+        "wall": wall,
+        "total_rps": total / wall,
+        "errors": results["errors"],
+        "upstream_calls": dict(FakeUpstream.calls),
+        "routes": routes,
+    }
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print("результаты:", args.out)
+
+
+if __name__ == "__main__":
+    main_()
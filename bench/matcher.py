@@ -0,0 +1,86 @@
+"""Бенчмарк поиска по базе знаний: прежний перебор vs PhraseMatcher.
+
+Запуск из корня репозитория:
+    python bench/matcher.py [--sizes 1000,100000,1000000] [--messages 200]
+
+Фразы синтетические, но похожи на то, что копит smart_answer_learn:
+обрезанные до 120 символов вопросы пользователей в нижнем регистре.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from matcher import PhraseMatcher  # noqa: E402
+
+WORDS = (
+    "как почему сколько где когда кто что такое нейросеть python flask погода "
+    "курс доллара биткоин рецепт борща фильм книга история россии москва "
+    "космос планета солнце луна океан кошка собака здоровье спорт футбол "
+    "музыка программирование база данных сервер интернет телефон школа"
+).split()
+
+
+def make_phrase(rng):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 12)))[:120] + f" #{rng.getrandbits(40):x}"
+
+
+def make_message(rng, phrases):
+    # Половина сообщений содержит известную фразу, половина — промах
+    msg = " ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 16)))
+    if rng.random() < 0.5:
+        msg += " " + rng.choice(phrases)
+    return msg
+
+
+def naive(rows, text):
+    for _id, phrase in rows:
+        if phrase in text:
+            return _id
+    return None
+
+
+def run(size, messages, naive_limit):
+    rng = random.Random(size)
+    phrases = [make_phrase(rng) for _ in range(size)]
+    rows = list(enumerate(phrases, 1))
+
+    t0 = time.perf_counter()
+    m = PhraseMatcher()
+    for kid, phrase in rows:
+        m.add(phrase, kid, kid)
+    build = time.perf_counter() - t0
+
+    texts = [make_message(rng, phrases) for _ in range(messages)]
+    t0 = time.perf_counter()
+    got = [m.match(t) for t in texts]
+    indexed = (time.perf_counter() - t0) / messages
+
+    n_naive = min(messages, naive_limit)
+    t0 = time.perf_counter()
+    expected = [naive(rows, t) for t in texts[:n_naive]]
+    scan = (time.perf_counter() - t0) / n_naive
+
+    for hit, exp in zip(got, expected):
+        assert (hit[1] if hit else None) == exp, "результаты расходятся"
+    return build, indexed, scan
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="1000,100000,1000000")
+    ap.add_argument("--messages", type=int, default=200)
+    ap.add_argument("--naive-limit", type=int, default=20,
+                    help="сколько сообщений гонять через медленный перебор")
+    args = ap.parse_args()
+    print(f"{'rows':>9} {'build, s':>9} {'index, ms/msg':>14} {'scan, ms/msg':>13}")
+    for size in (int(s) for s in args.sizes.split(",")):
+        build, indexed, scan = run(size, args.messages, args.naive_limit)
+        print(f"{size:>9} {build:>9.2f} {indexed * 1000:>14.3f} {scan * 1000:>13.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""Микробенчмарк отрисовки страниц: запросов в секунду для /, /chat и /admin.
+
+Запуск из корня репозитория:
+    python bench/pages.py [--requests 500]
+
+Страницы гоняются через тестовый клиент Flask в одном потоке, так что
+цифры — это стоимость рендера и запросов к БД без сети и gunicorn.
+База — временный файл SQLite с парой десятков сообщений и заявок.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+_tmp = tempfile.mkdtemp(prefix="neiro-bench-")
+os.environ.setdefault("SQLALCHEMY_DATABASE_URI", f"sqlite:///{_tmp}/bench.sqlite3")
+
+import main  # noqa: E402
+
+ADMIN = {"login": "Artem2013", "password": "Art2013Ar"}
+
+
+def seed():
+    with main.app.app_context():
+        admin = main.User.query.filter_by(login=ADMIN["login"]).first()
+        for i in range(20):
+            main.db.session.add(main.Support(user_id=admin.id, text=f"Вопрос {i}", is_tariff=i % 3 == 0))
+        main.db.session.commit()
+
+
+def bench(client, path, n):
+    client.get(path)  # прогрев
+    t0 = time.perf_counter()
+    for _ in range(n):
+        r = client.get(path)
+        assert r.status_code == 200, (path, r.status_code)
+    return n / (time.perf_counter() - t0)
+
+
+def main_():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--requests", type=int, default=500)
+    args = ap.parse_args()
+    main.init_db()
+    seed()
+    client = main.app.test_client()
+    anon = {"/": bench(client, "/", args.requests)}
+    client.post("/login", data=ADMIN)
+    for path in ("/", "/chat", "/admin"):
+        rps = bench(client, path, args.requests)
+        print(f"{path:<8} {rps:>8.0f} req/s" + (f"   (аноним: {anon[path]:.0f})" if path in anon else ""))
+    if hasattr(main, "answers"):
+        main.answers.shutdown(wait=False)
+
+
+if __name__ == "__main__":
+    main_()
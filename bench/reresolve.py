@@ -0,0 +1,184 @@
+"""Доразрешение заглушек: какая доля живых вопросов получает настоящий ответ.
+
+Запуск из корня репозитория:
+    python bench/reresolve.py [--rows 5000] [--asks 20000] [--fail 0.3] [--llm-fail 0.05] [--rate 50]
+
+Во временную базу кладётся --rows заглушек; частота вопросов по ним —
+распределение Ципфа, и hits в базе такие, какие насчитал бы HitTracker.
+Внешние сервисы — локальный фейковый сервер: Википедия знает ответ на
+половину фраз, LLM отвечает на остальные; доля --fail запросов к
+Википедии и --llm-fail к LLM падает с 503 (LLM реже: на 503 llm_dispatch
+уменьшает лимит и делает паузу для всех вызовов воркера).
+
+Режимы: hits — как в reresolve.py, самые спрашиваемые первыми; id —
+тот же Reresolver, но все hits в базе обнулены (порядок вставки). По ходу
+доразрешения выводится, какая доля --asks живых вопросов (из того же
+распределения) уже получит настоящий ответ из базы, и сколько запросов
+ушло во внешние сервисы. В конце живые вопросы задаются через
+local_answer(): сколько из них пошло бы во внешние сервисы и сколько
+получило заглушку.
+"""
+import argparse
+import bisect
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+class FakeUpstream(BaseHTTPRequestHandler):
+    fail = 0.3
+    llm_fail = 0.05
+    latency = 0.02
+    calls = 0
+    lock = threading.Lock()
+
+    def log_message(self, *args):
+        pass
+
+    def _json(self, status, data):
+        body = json.dumps(data, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _call(self, fail):
+        with FakeUpstream.lock:
+            FakeUpstream.calls += 1
+        time.sleep(self.latency)
+        return random.random() >= fail
+
+    def do_GET(self):  # Википедия: знает фразы с чётным номером
+        if not self._call(self.fail):
+            self._json(503, {})
+            return
+        phrase = unquote(self.path.rsplit("/", 1)[-1]).replace("_", " ")
+        if int(phrase.split()[1]) % 2:
+            self._json(404, {"title": "Not found."})
+        else:
+            self._json(200, {"extract": f"Статья про {phrase} — это подробный ответ энциклопедии."})
+
+    def do_POST(self):  # LLM
+        req = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        if not self._call(self.llm_fail):
+            self._json(503, {"error": "unavailable"})
+            return
+        self._json(200, {"choices": [{"message": {"content": "Ответ модели: " + req["messages"][-1]["content"]}}]})
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+
+def main_():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=5000)
+    ap.add_argument("--asks", type=int, default=20000)
+    ap.add_argument("--fail", type=float, default=0.3, help="доля запросов к Википедии, падающих с 503")
+    ap.add_argument("--llm-fail", type=float, default=0.05)
+    ap.add_argument("--rate", type=float, default=50, help="поисков в секунду")
+    ap.add_argument("--concurrency", type=int, default=4)
+    ap.add_argument("--batch", type=int, default=50)
+    args = ap.parse_args()
+    FakeUpstream.fail, FakeUpstream.llm_fail = args.fail, args.llm_fail
+    random.seed(1)
+
+    server = Server(("127.0.0.1", 0), FakeUpstream)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    tmp = tempfile.mkdtemp(prefix="neiro-reresolve-")
+    os.environ.update({
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp}/reresolve.sqlite3",
+        "WRITE_BEHIND": "0",
+        "WIKIPEDIA_URL": base,
+        "WIKIPEDIA_RETRIES": "0",
+        "DEEPINFRA_URL": base,
+        "DEEPINFRA_API_KEY": "fake",
+        "LLM_BREAKER_FAILURES": "1000000",   # 503 здесь — «шум», а не авария
+        "NEGATIVE_CACHE_TTL": "0",
+        "FUZZY_THRESHOLD": "0",
+        "RERESOLVE_CONCURRENCY": str(args.concurrency),
+        "RERESOLVE_RATE": str(args.rate),
+        "RERESOLVE_BATCH": str(args.batch),
+        "RERESOLVE_BACKOFF": "0",            # повтор неудачных — в следующем проходе
+    })
+    import main
+    from sqlalchemy import update
+    main.init_db()
+    k, engine = main.Knowledge.__table__, main.reresolver.engine
+
+    phrases = [f"объект {i} что это" for i in range(args.rows)]
+    weights = [1 / (i + 1) for i in range(args.rows)]
+    random.shuffle(weights)   # популярность не связана с порядком вставки
+    cum, total = [], 0.0
+    for w in weights:
+        total += w
+        cum.append(total)
+    asks = [bisect.bisect(cum, random.random() * total) for _ in range(args.asks)]
+    counts = [0] * args.rows
+    for i in asks:
+        counts[i] += 1
+
+    print(f"{args.rows} заглушек, {args.asks} вопросов; сбоев {args.fail:.0%}/{args.llm_fail:.0%}, "
+          f"{args.rate:.0f} поисков/с, параллельно {args.concurrency}")
+    print(f"{'order':<5} {'rows done':>10} {'upstream':>9} {'asks answered':>14} {'elapsed,s':>10}")
+    for order in ("hits", "id"):
+        with main.app.app_context():
+            main.db.session.execute(main.db.delete(main.Knowledge))
+            main.db.session.execute(main.db.insert(main.Knowledge), [
+                {"id": i + 1, "phrase": p, "answer": main.PLACEHOLDER_ANSWER,
+                 "hits": counts[i] if order == "hits" else 0} for i, p in enumerate(phrases)])
+            main.db.session.commit()
+        main.answer_cache.clear()
+        main.reresolver.claimed = main.reresolver.resolved = main.reresolver.failed = main.reresolver.rounds = 0
+        FakeUpstream.calls = 0
+        t0 = time.perf_counter()
+        marks = [int(args.rows * f) for f in (0.05, 0.1, 0.25, 0.5, 1.0)]
+        done = 0
+        while True:
+            n = main.reresolver.run_once()
+            if not n:
+                # Неудачные строки ждут следующего прохода — как после паузы
+                with engine.begin() as conn:
+                    conn.execute(update(k).values(resolve_after=None))
+                n = main.reresolver.run_once()
+                if not n:
+                    break
+            done += n
+            if marks and done >= marks[0]:
+                marks.pop(0)
+                with engine.connect() as conn:
+                    good = {r.id - 1 for r in conn.execute(
+                        k.select().with_only_columns(k.c.id).where(k.c.answer != main.PLACEHOLDER_ANSWER))}
+                share = sum(counts[i] for i in good) / args.asks
+                print(f"{order:<5} {done:>10} {FakeUpstream.calls:>9} {share:>13.1%} "
+                      f"{time.perf_counter() - t0:>10.1f}")
+        stats = main.reresolver.stats()
+        print(f"{order:<5} всего: найдено {stats['resolved']}, неудач {stats['failed']}, "
+              f"пачек {stats['rounds']}, запросов наружу {FakeUpstream.calls}")
+
+    # Живые вопросы после доразрешения: всё из базы, наружу ничего
+    FakeUpstream.calls = 0
+    placeholders = 0
+    t0 = time.perf_counter()
+    with main.app.app_context():
+        for i in asks[:2000]:
+            answer = main.local_answer(f"скажите, {phrases[i]} такое")
+            placeholders += answer == main.PLACEHOLDER_ANSWER
+    print(f"живые вопросы: {min(2000, len(asks))}, заглушек {placeholders}, запросов наружу {FakeUpstream.calls}, "
+          f"{(time.perf_counter() - t0) * 1000 / min(2000, len(asks)):.2f} мс на вопрос")
+    main.answers.shutdown()
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,118 @@
+"""Качество и скорость нечёткого поиска (retrieval.FuzzyIndex).
+
+Запуск из корня репозитория:
+    python bench/retrieval.py [--sizes 10000,100000] [--queries 2000] [--threshold 0.4]
+
+Корпус — синтетические русские вопросы «<вопросительная часть> <прилагательное>
+<существительное> <уточнение>». Запросы к индексу — перефразировки
+сохранённых вопросов: другая вопросительная часть, другие окончания,
+перестановка слов, опечатка, вежливые слова. Отдельно меряется доля
+ложных срабатываний на вопросах о том, чего в базе нет.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from retrieval import FuzzyIndex  # noqa: E402
+
+QUESTIONS = ["что такое", "кто такой", "как работает", "сколько стоит", "где находится",
+             "почему существует", "когда появился", "зачем нужен"]
+PARAPHRASE = {"что такое": "объясни что значит", "кто такой": "расскажи кто это",
+              "как работает": "как устроен", "сколько стоит": "какая цена у",
+              "где находится": "где расположен", "почему существует": "отчего есть",
+              "когда появился": "в каком году появился", "зачем нужен": "для чего нужен"}
+ADJ = ["большой", "красный", "древний", "квантовый", "русский", "морской", "горный", "цифровой",
+       "лунный", "солнечный", "быстрый", "тихий", "северный", "южный", "зелёный", "стальной"]
+NOUN = ["компьютер", "кит", "замок", "реактор", "самовар", "корабль", "перевал", "кошелёк",
+        "кратер", "парус", "поезд", "лес", "ледник", "берег", "лес", "мост", "алгоритм", "телескоп"]
+FILLER = ["подскажи пожалуйста", "слушай", "а вот", "скажи", ""]
+
+
+def make_corpus(n, rng):
+    seen, docs = set(), []
+    while len(docs) < n:
+        tag = "".join(rng.choice("абвгдежзиклмнопрстуфхцчшэюя") for _ in range(rng.randint(5, 8)))
+        q = f"{rng.choice(QUESTIONS)} {rng.choice(ADJ)} {rng.choice(NOUN)} {tag}"
+        if q not in seen:
+            seen.add(q)
+            docs.append(q)
+    return docs
+
+
+def typo(word, rng):
+    if len(word) < 4:
+        return word
+    i = rng.randrange(1, len(word) - 2)
+    return word[:i] + word[i + 1] + word[i] + word[i + 2:]
+
+
+def paraphrase(q, rng):
+    for k, v in PARAPHRASE.items():
+        if q.startswith(k):
+            head, rest = (v if rng.random() < 0.6 else k), q[len(k) + 1:].split()
+            break
+    adj, noun, tag = rest
+    if rng.random() < 0.5:
+        adj = adj[:-2] + rng.choice(["ого", "ая", "ом", "ые"])
+    if rng.random() < 0.5:
+        noun = noun + rng.choice(["а", "ы", "ом", ""])
+    if rng.random() < 0.4:
+        tag = typo(tag, rng)
+    words = [adj, noun, tag]
+    if rng.random() < 0.3:
+        words = [noun, adj, tag]
+    return " ".join(filter(None, [rng.choice(FILLER), head, *words])) + rng.choice(["?", "", "??"])
+
+
+def pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def run(size, queries, threshold):
+    rng = random.Random(size)
+    docs = make_corpus(size, rng)
+    idx = FuzzyIndex()
+    t0 = time.perf_counter()
+    for i, d in enumerate(docs):
+        idx.add(i, d)
+    build = time.perf_counter() - t0
+
+    hits = wrong = 0
+    lat = []
+    for _ in range(queries):
+        target = rng.randrange(size)
+        q = paraphrase(docs[target], rng)
+        t0 = time.perf_counter()
+        best = idx.best(q, threshold)
+        lat.append(time.perf_counter() - t0)
+        if best and best[0] == target:
+            hits += 1
+        elif best:
+            wrong += 1
+
+    known = set(docs)
+    unseen = make_corpus(queries, random.Random(-size))
+    false_pos = sum(1 for q in unseen if q not in known and idx.best(paraphrase(q, rng), threshold))
+    return build, hits / queries, wrong / queries, false_pos / queries, pct(lat, 0.5), pct(lat, 0.99)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="10000,100000")
+    ap.add_argument("--queries", type=int, default=2000)
+    ap.add_argument("--threshold", type=float, default=0.4)
+    args = ap.parse_args()
+    print(f"порог {args.threshold}")
+    print(f"{'docs':>7} {'build,s':>8} {'hit':>6} {'wrong':>6} {'false+':>7} {'p50,ms':>7} {'p99,ms':>7}")
+    for size in (int(s) for s in args.sizes.split(",")):
+        build, hit, wrong, fp, p50, p99 = run(size, args.queries, args.threshold)
+        print(f"{size:>7} {build:>8.1f} {hit:>6.1%} {wrong:>6.1%} {fp:>7.1%} {p50 * 1000:>7.2f} {p99 * 1000:>7.2f}")
+
+
+if __name__ == "__main__":
+    main()
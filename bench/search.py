@@ -0,0 +1,127 @@
+"""Полнотекстовый поиск админки (search.py) на больших таблицах.
+
+Запуск из корня репозитория:
+    python bench/search.py [--rows 1000000] [--queries 200]
+
+Во временную базу пишутся --rows заявок и --rows фраз базы знаний из
+синтетического русского словаря (слова в разных падежах, частоты по
+Ципфу), индекс FTS5 строится ensure_fts(), затем меряются: время
+построения, цена триггеров на вставку пачки строк и задержки
+запросов — редкое слово, частое слово, два слова, дальняя страница.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+STEMS = ("кошк", "собак", "оплат", "тариф", "карт", "ошибк", "страниц", "ответ", "вопрос", "город",
+         "книг", "машин", "школ", "работ", "погод", "музык", "планет", "истори", "задач", "программ",
+         "систем", "деньг", "недел", "минут", "поддержк", "заявк", "подписк", "доступ", "пароль", "логин",
+         "реки", "гор", "мор", "лес", "звезд", "дорог", "улиц", "комнат", "окн", "двер")
+ENDINGS = ("а", "и", "у", "ой", "ами", "ах", "е", "ы", "ом", "ов", "")
+
+
+def vocabulary(size, rng):
+    words = {s + e for s in STEMS for e in ENDINGS}
+    while len(words) < size:
+        words.add("".join(rng.choice("абвгдежзиклмнопрстуфхцчшэюя") for _ in range(rng.randint(4, 10))))
+    return sorted(words)
+
+
+def zipf(words):
+    """Накопленные веса по Ципфу: первые слова самые частые."""
+    acc, total = [], 0.0
+    for i in range(len(words)):
+        total += 1 / (i + 1)
+        acc.append(total)
+    return acc
+
+
+def sentences(n, words, rng, length, cum):
+    for _ in range(n):
+        yield " ".join(rng.choices(words, cum_weights=cum, k=rng.randint(*length)))
+
+
+def pct(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+def main_():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=1000000)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+    rng = random.Random(args.seed)
+
+    tmp = tempfile.mkdtemp(prefix="neiro-search-")
+    os.environ["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{tmp}/search.sqlite3"
+    import main
+    from search import ensure_fts, search
+
+    words = vocabulary(50000, rng)
+    cum = zipf(words)
+    with main.app.app_context():
+        db = main.db
+        db.create_all()
+        t0 = time.perf_counter()
+        batch = 50000
+        for start in range(0, args.rows, batch):
+            n = min(batch, args.rows - start)
+            db.session.execute(db.insert(main.Support), [
+                {"user_id": 1, "text": t, "answer": a, "is_tariff": False}
+                for t, a in zip(sentences(n, words, rng, (5, 30), cum), sentences(n, words, rng, (0, 15), cum))])
+            db.session.execute(db.insert(main.Knowledge), [
+                {"phrase": f"{t} {start + i}", "answer": a}
+                for i, (t, a) in enumerate(zip(sentences(n, words, rng, (2, 8), cum),
+                                                   sentences(n, words, rng, (5, 40), cum)))])
+            db.session.commit()
+        print(f"{args.rows} заявок и {args.rows} фраз за {time.perf_counter() - t0:.1f} с")
+
+        t0 = time.perf_counter()
+        ensure_fts(db.engine)
+        print(f"построение индексов: {time.perf_counter() - t0:.1f} с, "
+              f"размер базы {os.path.getsize(f'{tmp}/search.sqlite3') / 1048576:.0f} МБ")
+
+        # Цена триггеров: та же пачка вставок с индексом и без него
+        extra = list(sentences(10000, words, rng, (5, 30), cum))
+        for label in ("с триггерами", "без триггеров"):
+            if label == "без триггеров":
+                for suffix in ("ai", "ad", "au"):
+                    db.session.execute(db.text(f"DROP TRIGGER support_fts_{suffix}"))
+            t0 = time.perf_counter()
+            db.session.execute(db.insert(main.Support), [{"user_id": 1, "text": t} for t in extra])
+            db.session.commit()
+            print(f"вставка 10000 заявок {label}: {(time.perf_counter() - t0) * 1000:.0f} мс")
+
+        common, rare = words[:20], words[-2000:]
+        cases = {
+            "редкое слово": lambda: rng.choice(rare),
+            "частое слово": lambda: rng.choice(common),
+            "два слова": lambda: f"{rng.choice(words[:2000])} {rng.choice(words[:2000])}",
+            "словоформа": lambda: rng.choice(STEMS) + rng.choice(("ами", "ой", "ах")),
+        }
+        print(f"{'запрос':<16} {'область':<10} {'стр.':>4} {'p50,мс':>7} {'p99,мс':>7} {'найдено':>8}")
+        for name, make in cases.items():
+            for scope in ("support", "knowledge"):
+                for page in (1, 10):
+                    lat, found = [], 0
+                    for _ in range(args.queries):
+                        q = make()
+                        t0 = time.perf_counter()
+                        rows, _more = search(db.session, scope, q, page, 50)
+                        lat.append(time.perf_counter() - t0)
+                        found += bool(rows)
+                    print(f"{name:<16} {scope:<10} {page:>4} {pct(lat, .5) * 1000:>7.2f} "
+                          f"{pct(lat, .99) * 1000:>7.2f} {found / args.queries:>8.0%}")
+    main.answers.shutdown()
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,183 @@
+"""Снимок базы знаний (snapshot.py): память и время старта воркера.
+
+Запуск из корня репозитория:
+    python bench/snapshot.py [--rows 1000000] [--workers 4] [--modes memory,snapshot] [--fuzzy 0.4]
+
+Во временную базу кладётся --rows фраз базы знаний (3-6 слов из
+словаря с распределением Ципфа), затем для каждого режима запускается
+--workers процессов-«воркеров», как их запускает gunicorn: import main и
+warmup(). memory — весь индекс в памяти воркера (без SNAPSHOT_DIR),
+snapshot — снимок, собранный заранее (kb.py snapshot), плюс дельта.
+Воркеры стартуют по одному; когда готовы все, каждый прогоняет одни и
+те же вопросы через lookup_local()/lookup_fuzzy() и сообщает время
+старта, VmRSS, из него
+файловые страницы (RssFile), и PSS — память с учётом того, что общие
+страницы делятся между процессами (/proc/self/smaps_rollup).
+--fuzzy 0 выключает нечёткий индекс в обоих режимах.
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SYLLABLES = ("ка", "ло", "ми", "ра", "ни", "то", "ве", "су", "да", "ре", "по", "ны", "ла", "ко", "ст", "ен",
+             "ов", "ар", "ти", "мо", "за", "пе", "ду", "ви")
+
+
+def vocabulary(n, rng):
+    words = set()
+    while len(words) < n:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def phrases(n, rng):
+    words = vocabulary(20000, rng)
+    cum, total = [], 0.0
+    for i in range(len(words)):
+        total += 1 / (i + 1)
+        cum.append(total)
+    seen = set()
+    while len(seen) < n:
+        p = " ".join(rng.choices(words, cum_weights=cum, k=rng.randint(3, 6)))
+        if p not in seen:
+            seen.add(p)
+            yield p
+
+
+def kb(tmp):
+    return {"SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp}/kb.sqlite3", "WRITE_BEHIND": "0",
+            "WARMUP_CACHE_ROWS": "0"}
+
+
+def memory():
+    out = {}
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(("VmRSS", "RssAnon", "RssFile")):
+                out[line.split(":")[0]] = int(line.split()[1]) // 1024
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            if line.startswith("Pss:"):
+                out["Pss"] = int(line.split()[1]) // 1024
+    return out
+
+
+def worker(queries):
+    """Процесс-воркер: старт, сигнал о готовности, затем поиск и замеры по команде."""
+    t0 = time.perf_counter()
+    import main
+    phrases_n, _cached = main.warmup()
+    startup = time.perf_counter() - t0
+    print(json.dumps({"ready": True}), flush=True)
+    sys.stdin.readline()
+    with open(queries) as f:
+        qs = json.load(f)
+    with main.app.app_context():
+        t0 = time.perf_counter()
+        found = sum(main.lookup_local(q) is not None for q in qs["exact"])
+        exact = (time.perf_counter() - t0) / len(qs["exact"])
+        t0 = time.perf_counter()
+        fuzzy = sum(main.lookup_fuzzy(q) is not None for q in qs["fuzzy"])
+        fuzzy_t = (time.perf_counter() - t0) / len(qs["fuzzy"])
+    print(json.dumps(dict(memory(), startup=startup, phrases=phrases_n, exact_ms=exact * 1000, exact_found=found,
+                          fuzzy_ms=fuzzy_t * 1000, fuzzy_found=fuzzy, delta=main._delta_rows)), flush=True)
+    sys.stdin.readline()
+    main.answers.shutdown()
+
+
+def run_mode(mode, tmp, args, queries):
+    env = dict(os.environ, **kb(tmp), FUZZY_THRESHOLD=str(args.fuzzy))
+    env.pop("SNAPSHOT_DIR", None)
+    if mode == "snapshot":
+        env["SNAPSHOT_DIR"] = f"{tmp}/snap"
+    procs = []
+    for _ in range(args.workers):
+        # По одному: время старта не зависит от числа ядер
+        p = subprocess.Popen([sys.executable, __file__, "--worker", queries], env=env, cwd=ROOT,
+                             stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+        json.loads(p.stdout.readline())
+        procs.append(p)
+    # Замеры — когда запущены все: общие страницы делятся на всех
+    results = []
+    for p in procs:
+        p.stdin.write("go\n")
+        p.stdin.flush()
+        results.append(json.loads(p.stdout.readline()))
+    for p in procs:
+        p.stdin.write("bye\n")
+        p.stdin.flush()
+        p.wait()
+    return results
+
+
+def main_():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=1000000)
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--modes", default="memory,snapshot")
+    ap.add_argument("--fuzzy", type=float, default=0.4, help="FUZZY_THRESHOLD воркеров, 0 — без нечёткого индекса")
+    ap.add_argument("--delta", type=int, default=1000, help="строк, добавленных после снимка")
+    ap.add_argument("--worker")
+    args = ap.parse_args()
+    if args.worker:
+        worker(args.worker)
+        return
+
+    tmp = tempfile.mkdtemp(prefix="neiro-snapshot-")
+    os.environ.update(kb(tmp), SNAPSHOT_DIR=f"{tmp}/snap")
+    import main
+    main.init_db()
+    rng = random.Random(1)
+    t0 = time.perf_counter()
+    sample = []
+    with main.app.app_context():
+        batch = []
+        for i, p in enumerate(phrases(args.rows + args.delta, rng)):
+            batch.append({"phrase": p, "answer": f"Ответ номер {i}: " + p[::-1]})
+            if i % 997 == 0:
+                sample.append(p)
+            if len(batch) == 50000 or i == args.rows - 1:
+                main.db.session.execute(main.db.insert(main.Knowledge), batch)
+                main.db.session.commit()
+                batch = []
+            if i == args.rows - 1:
+                print(f"база знаний: {args.rows} строк за {time.perf_counter() - t0:.0f} с", flush=True)
+                t0 = time.perf_counter()
+                path = main.build_snapshot()
+                print(f"снимок: {os.path.getsize(path) / 1048576:.0f} МБ за {time.perf_counter() - t0:.0f} с",
+                      flush=True)
+        if batch:
+            main.db.session.execute(main.db.insert(main.Knowledge), batch)
+            main.db.session.commit()
+    main.answers.shutdown()
+    words = [w for p in sample for w in p.split()]
+    queries = {
+        "exact": [f"подскажи {p} пожалуйста" for p in sample[:300]],
+        # перефразы: слово выпало, слова переставлены
+        "fuzzy": [" ".join(rng.sample(p.split(), len(p.split()))[1:] + [rng.choice(words)]) for p in sample[:100]],
+    }
+    qpath = f"{tmp}/queries.json"
+    with open(qpath, "w") as f:
+        json.dump(queries, f, ensure_ascii=False)
+
+    print(f"{'mode':<9} {'start,s':>8} {'RSS,MB':>7} {'file,MB':>8} {'anon,MB':>8} {'PSS,MB':>7} "
+          f"{'exact,ms':>9} {'fuzzy,ms':>9} {'found':>9}")
+    for mode in args.modes.split(","):
+        results = run_mode(mode, tmp, args, qpath)
+        for r in results:
+            print(f"{mode:<9} {r['startup']:>8.2f} {r['VmRSS']:>7} {r['RssFile']:>8} {r['RssAnon']:>8} {r['Pss']:>7} "
+                  f"{r['exact_ms']:>9.3f} {r['fuzzy_ms']:>9.2f} {r['exact_found']:>4}/{r['fuzzy_found']:<4}")
+        print(f"{mode:<9} всего PSS {sum(r['Pss'] for r in results)} МБ на {len(results)} воркеров; "
+              f"фраз {results[0]['phrases']}, дельта {results[0]['delta']}", flush=True)
+
+
+if __name__ == "__main__":
+    main_()
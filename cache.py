@@ -0,0 +1,205 @@
+"""Кэш ответов: LRU с TTL в памяти процесса + необязательное общее хранилище.
+
+LRUCache живёт в каждом воркере и отвечает без обращений к БД и сети.
+SharedStore — локальная замена Redis: файл SQLite, который видят все
+воркеры gunicorn на машине. LayeredCache связывает оба уровня.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+MISS = object()  # отличает «нет в кэше» от закэшированного None (отрицательный ответ)
+
+
+class LRUCache:
+    def __init__(self, maxsize=10000, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()   # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expired = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=MISS):
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            if item[0] <= now:
+                del self._data[key]
+                self.expired += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def set(self, key, value, ttl=None):
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self, prefix=""):
+        with self._lock:
+            if not prefix:
+                self._data.clear()
+                return
+            for key in [k for k in self._data if k.startswith(prefix)]:
+                del self._data[key]
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._data), "hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions, "expired": self.expired}
+
+
+class SharedStore:
+    """Ключ-значение с TTL в файле SQLite, общее для всех процессов.
+
+    Значения сериализуются в JSON. Соединение — своё в каждом потоке.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self.hits = self.misses = 0
+        conn = self._conn()
+        conn.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT, expires REAL)")
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get_entry(self, key):
+        """(значение, сколько секунд ему осталось жить) или None."""
+        row = self._conn().execute("SELECT value, expires FROM kv WHERE key = ?", (key,)).fetchone()
+        now = time.time()
+        if row is None or row[1] <= now:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(row[0]), row[1] - now
+
+    def get(self, key, default=MISS):
+        entry = self.get_entry(key)
+        return default if entry is None else entry[0]
+
+    def set(self, key, value, ttl):
+        conn = self._conn()
+        conn.execute("INSERT OR REPLACE INTO kv (key, value, expires) VALUES (?, ?, ?)",
+                     (key, json.dumps(value, ensure_ascii=False), time.time() + ttl))
+        conn.commit()
+
+    def delete(self, key):
+        conn = self._conn()
+        conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+        conn.commit()
+
+    def clear(self, prefix=""):
+        conn = self._conn()
+        conn.execute("DELETE FROM kv WHERE substr(key, 1, ?) = ?", (len(prefix), prefix))
+        conn.commit()
+
+    def purge_expired(self):
+        conn = self._conn()
+        conn.execute("DELETE FROM kv WHERE expires <= ?", (time.time(),))
+        conn.commit()
+
+
+class LayeredCache:
+    """Сначала LRU процесса, потом (если задан) общий SharedStore.
+
+    clear() увеличивает счётчик поколений в общем хранилище; остальные
+    процессы замечают это не позже чем через sync_interval секунд и
+    сбрасывают свой LRU.
+    """
+
+    GENERATION_KEY = "__generation__"
+
+    def __init__(self, local, shared=None, sync_interval=1.0):
+        self.local = local
+        self.shared = shared
+        self.sync_interval = sync_interval
+        self._generation = None
+        self._checked_at = 0.0
+
+    def _sync_generation(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.sync_interval:
+            return
+        self._checked_at = now
+        gen = self.shared.get(self.GENERATION_KEY, 0)
+        if self._generation is not None and gen != self._generation:
+            self.local.clear()
+        self._generation = gen
+
+    def get(self, key):
+        if self.shared is not None:
+            try:
+                self._sync_generation()
+            except sqlite3.Error as e:
+                print("shared cache error:", e)
+        value = self.local.get(key)
+        if value is not MISS or self.shared is None:
+            return value
+        try:
+            entry = self.shared.get_entry(key)
+        except sqlite3.Error as e:
+            print("shared cache error:", e)
+            return MISS
+        if entry is None:
+            return MISS
+        value, ttl_left = entry
+        self.local.set(key, value, min(self.local.ttl, ttl_left))
+        return value
+
+    def set(self, key, value, ttl=None):
+        self.local.set(key, value, ttl)
+        if self.shared is not None:
+            try:
+                self.shared.set(key, value, self.local.ttl if ttl is None else ttl)
+            except sqlite3.Error as e:
+                print("shared cache error:", e)
+
+    def delete(self, key):
+        self.local.delete(key)
+        if self.shared is not None:
+            self.shared.delete(key)
+
+    def clear(self, prefix=""):
+        """Явная инвалидация ключей с данным префиксом во всех процессах."""
+        self.local.clear(prefix)
+        if self.shared is not None:
+            self._generation = self.shared.get(self.GENERATION_KEY, 0) + 1
+            self.shared.clear(prefix)
+            self.shared.set(self.GENERATION_KEY, self._generation, ttl=10 * 365 * 86400)
+
+    def stats(self):
+        st = self.local.stats()
+        if self.shared is not None:
+            st["shared_hits"] = self.shared.hits
+            st["shared_misses"] = self.shared.misses
+        return st
@@ -0,0 +1,220 @@
+"""Обслуживание базы знаний: учёт попаданий и периодическое сжатие.
+
+HitTracker считает, сколько раз строка Knowledge дала ответ, и раз в
+interval секунд пишет это одним UPDATE на пачку (hits, last_used).
+
+compact() — задача для cron (python kb.py compact). Она приводит фразы
+к normalize_text(), сливает дубликаты и почти-дубликаты (фразы, которые
+совпадают после удаления знаков препинания и замены ё на е), удаляет
+заглушки, слишком короткие фразы и давно не использованные строки.
+Всё делается короткими транзакциями по batch строк, чтобы живые запросы
+не ждали. Каждая удалённая строка записывается в таблицу надгробий
+(tombstones), и воркеры убирают её из своих индексов при ближайшей
+sync_phrases(), без полной перезагрузки.
+"""
+import atexit
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import (
+    DateTime,
+    bindparam,
+    delete,
+    func,
+    insert,
+    literal,
+    select,
+    text,
+    update,
+)
+
+_WORD = re.compile(r"\w+")
+
+
+def dedup_key(phrase):
+    """Ключ почти-дубликатов: только слова, нижний регистр, ё -> е."""
+    return " ".join(_WORD.findall(phrase.lower().replace("ё", "е")))
+
+
+class HitTracker:
+    """Попадания по id строки; в БД уходят пачкой раз в interval секунд."""
+
+    def __init__(self, engine, table, interval=60.0):
+        self.engine = engine
+        self.table = table
+        self.interval = interval
+        self._hits = {}       # id -> [попаданий, время последнего]
+        self._lock = threading.Lock()
+        self._thread_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        atexit.register(self.close)
+
+    def _ensure_thread(self):
+        # Как и в WriteBehind: поток заводится уже в воркере, а не в мастере до fork
+        if self._thread is None or not self._thread.is_alive():
+            with self._thread_lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name="kb-hits", daemon=True)
+                    self._thread.start()
+
+    def hit(self, row_id):
+        self._ensure_thread()
+        now = datetime.utcnow()
+        with self._lock:
+            item = self._hits.get(row_id)
+            if item is None:
+                self._hits[row_id] = [1, now]
+            else:
+                item[0] += 1
+                item[1] = now
+
+    def flush(self):
+        with self._lock:
+            hits, self._hits = self._hits, {}
+        if not hits:
+            return
+        t = self.table
+        stmt = (update(t).where(t.c.id == bindparam("row_id"))
+                .values(hits=t.c.hits + bindparam("n"), last_used=bindparam("at")))
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(stmt, [{"row_id": k, "n": n, "at": at} for k, (n, at) in hits.items()])
+        except Exception as e:
+            print("kb hits flush error:", e)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def close(self):
+        self._stop.set()
+        self.flush()
+
+
+def _table_bytes(conn, name):
+    try:
+        return conn.execute(text("SELECT SUM(pgsize) FROM dbstat WHERE name = :n"), {"n": name}).scalar()
+    except Exception:
+        return None  # SQLite собран без dbstat
+
+
+def compact(engine, knowledge, tombstones, placeholder, normalize, *, batch=500, min_len=3,
+            placeholder_days=7, idle_days=180, min_hits=1, tombstone_days=7, dry_run=False):
+    """Сжимает таблицу knowledge. Возвращает отчёт: размеры до/после и что удалено.
+
+    placeholder_days — заглушки старше стольки дней удаляются (0 — все сразу);
+    idle_days — строки, у которых меньше min_hits попаданий и которые не
+    использовались idle_days дней, удаляются (0 — не трогать).
+    """
+    k, tb = knowledge, tombstones
+    t0 = time.perf_counter()
+    now = datetime.utcnow()
+    report = {"removed": {"placeholder": 0, "short": 0, "duplicate": 0, "idle": 0}, "renamed": 0}
+    with engine.connect() as conn:
+        report["rows_before"] = conn.execute(select(func.count()).select_from(k)).scalar()
+        report["bytes_before"] = _table_bytes(conn, k.name)
+        # Строкам без даты (до появления колонки) отсчёт начинается с сегодня
+        conn.execute(update(k).where(k.c.created_at.is_(None)).values(created_at=now))
+        conn.commit()
+
+        # 1. Ключи почти-дубликатов во временной таблице: группировка в SQLite, а не в памяти
+        conn.exec_driver_sql("DROP TABLE IF EXISTS temp.kb_keys")
+        conn.exec_driver_sql("CREATE TEMP TABLE kb_keys (id INTEGER PRIMARY KEY, key TEXT NOT NULL, "
+                             "good INTEGER NOT NULL, hits INTEGER NOT NULL)")
+        last = 0
+        while True:
+            rows = conn.execute(select(k.c.id, k.c.phrase, k.c.answer, k.c.hits).where(k.c.id > last)
+                                .order_by(k.c.id).limit(batch * 10)).all()
+            if not rows:
+                break
+            last = rows[-1].id
+            conn.execute(text("INSERT INTO temp.kb_keys (id, key, good, hits) VALUES (:id, :key, :good, :hits)"),
+                         [{"id": r.id, "key": dedup_key(r.phrase), "good": int(r.answer != placeholder),
+                           "hits": r.hits or 0} for r in rows])
+        conn.exec_driver_sql("CREATE INDEX temp.kb_keys_key ON kb_keys (key, good DESC, hits DESC, id)")
+        conn.commit()
+
+        # 2. Что удалить. Внутри группы остаётся строка с настоящим ответом,
+        # затем с большим числом попаданий, затем самая старая; попадания
+        # остальных прибавляются к ней.
+        doomed = {}            # id -> причина
+        bonus = {}             # id оставшейся строки -> попадания слитых
+        keeper, keeper_key = None, None
+        for row_id, key, _good, hits in conn.exec_driver_sql(
+                "SELECT id, key, good, hits FROM temp.kb_keys ORDER BY key, good DESC, hits DESC, id"):
+            if len(key) < min_len:
+                doomed[row_id] = "short"
+                continue
+            if key == keeper_key:
+                doomed[row_id] = "duplicate"
+                if hits:
+                    bonus[keeper] = bonus.get(keeper, 0) + hits
+                continue
+            keeper, keeper_key = row_id, key
+        conn.exec_driver_sql("DROP TABLE temp.kb_keys")
+
+        placeholder_cut = now - timedelta(days=placeholder_days)
+        for (row_id,) in conn.execute(select(k.c.id).where(k.c.answer == placeholder,
+                                                           k.c.created_at <= placeholder_cut)):
+            doomed.setdefault(row_id, "placeholder")
+        if idle_days:
+            idle_cut = now - timedelta(days=idle_days)
+            used = func.coalesce(k.c.last_used, k.c.created_at)
+            for (row_id,) in conn.execute(select(k.c.id).where(k.c.hits < min_hits, used <= idle_cut)):
+                doomed.setdefault(row_id, "idle")
+        for row_id in doomed:
+            bonus.pop(row_id, None)
+        for reason in doomed.values():
+            report["removed"][reason] += 1
+        conn.commit()
+
+        if not dry_run:
+            # 3. Удаление пачками: надгробие + delete в одной короткой транзакции
+            ids = sorted(doomed)
+            for i in range(0, len(ids), batch):
+                chunk = ids[i:i + batch]
+                conn.execute(insert(tb).from_select(
+                    ["knowledge_id", "phrase", "created_at"],
+                    select(k.c.id, k.c.phrase, literal(now, DateTime)).where(k.c.id.in_(chunk))))
+                conn.execute(delete(k).where(k.c.id.in_(chunk)))
+                conn.commit()
+            items = list(bonus.items())
+            for i in range(0, len(items), batch):
+                conn.execute(update(k).where(k.c.id == bindparam("row_id"))
+                             .values(hits=k.c.hits + bindparam("n")),
+                             [{"row_id": row_id, "n": n} for row_id, n in items[i:i + batch]])
+                conn.commit()
+
+            # 4. Фразы не в нормальной форме переписываются новой строкой
+            # (новый id — воркеры подхватят её обычной синхронизацией)
+            last = 0
+            while True:
+                rows = conn.execute(select(k).where(k.c.id > last).order_by(k.c.id).limit(batch * 10)).all()
+                if not rows:
+                    break
+                last = rows[-1].id
+                bad = [r for r in rows if normalize(r.phrase)[:256] != r.phrase]
+                conn.commit()
+                for i in range(0, len(bad), batch):
+                    chunk = bad[i:i + batch]
+                    for r in chunk:
+                        conn.execute(insert(k).prefix_with("OR IGNORE").values(
+                            phrase=normalize(r.phrase)[:256], answer=r.answer, hits=r.hits,
+                            last_used=r.last_used, created_at=r.created_at))
+                        conn.execute(insert(tb).values(knowledge_id=r.id, phrase=r.phrase, created_at=now))
+                        conn.execute(delete(k).where(k.c.id == r.id))
+                    conn.commit()
+                    report["renamed"] += len(chunk)
+
+            # 5. Старые надгробия больше не нужны: воркер, который их пропустил,
+            # заметит разрыв в id и перечитает индекс целиком
+            conn.execute(delete(tb).where(tb.c.created_at < now - timedelta(days=tombstone_days)))
+            conn.commit()
+
+        report["rows_after"] = conn.execute(select(func.count()).select_from(k)).scalar()
+        report["bytes_after"] = _table_bytes(conn, k.name)
+    report["seconds"] = time.perf_counter() - t0
+    return report
@@ -0,0 +1,199 @@
+"""Контекст разговора для LLM в пределах бюджета токенов.
+
+Промпт собирается так, чтобы его начало менялось как можно реже:
+системный промпт (постоянный), краткое содержание старой части
+разговора (summary), затем реплики после неё по порядку и в конце новый
+вопрос. Пока реплики помещаются в budget токенов, каждый следующий
+промпт — это предыдущий плюс новые реплики, и кэш префиксов у
+провайдера срабатывает на всём, что уже было отправлено.
+
+Когда summary и реплики после него занимают больше high * budget,
+ContextBuilder в фоне сворачивает самые старые реплики в summary (LLM
+получает прежнее summary и эти реплики), пока остаток не станет не
+больше keep * budget. Свёртка начинается заранее, пока промпт ещё
+помещается целиком, и успевает закончиться, пока пользователь пишет
+следующий вопрос: префикс меняется один раз на свёртку.
+Summary и id последнего свёрнутого сообщения лежат в самой строке
+conversation — общие для всех воркеров и переживают перезапуск. Запись
+условная (по старому id), поэтому два воркера, свернувшие одно и то же,
+не затрут друг друга. Пока свёртка не готова (или LLM недоступен), в
+промпт идут самые новые реплики, которые помещаются в бюджет.
+
+Токены считаются приближённо, по кускам слов (count_tokens); точное
+число, посчитанное провайдером, видно в метрике neiro_llm_prompt_tokens.
+
+Контекст нужен не каждому вопросу: «что такое квазар» понятен и без
+него, и ответ на него общий для всех — его можно кэшировать и не
+спрашивать LLM дважды. is_follow_up() отличает уточнения («а он где
+живёт?», «почему?», «подробнее») по местоимениям и словам-связкам.
+"""
+import queue
+import re
+import threading
+from collections import namedtuple
+
+from sqlalchemy import select, update
+
+_TOKEN = re.compile(r"\w{1,4}|[^\w\s]")
+
+ROLES = {"user": "user", "ai": "assistant"}
+
+_WORD = re.compile(r"\w+")
+# Слова, которые отсылают к сказанному раньше
+FOLLOW_UP_WORDS = frozenset("""
+он она оно они его её ее него неё нее их них ему ей нему ней им ним нём нем ими ними
+этот эта это эти этого этой этому этим этом этих этими тот та те того той тому тем том тех
+там туда оттуда тогда так
+ещё еще подробнее поподробнее дальше иначе тоже также
+""".split())
+# Начало фразы, продолжающее разговор: «а если...», «и сколько...»
+FOLLOW_UP_START = frozenset("а и но или ну".split())
+# Вопрос из одного такого слова понятен только в разговоре
+BARE_QUESTIONS = frozenset("почему зачем как когда где куда откуда сколько кто что какой чей правда точно".split())
+
+
+def is_follow_up(text):
+    """Вопрос-уточнение, которому нужен контекст разговора."""
+    words = _WORD.findall((text or "").lower())
+    if not words:
+        return False
+    if len(words) == 1 and words[0] in BARE_QUESTIONS:
+        return True
+    return words[0] in FOLLOW_UP_START or any(w in FOLLOW_UP_WORDS for w in words)
+
+
+def count_tokens(text):
+    """Примерное число токенов: кусок слова до 4 букв или знак препинания."""
+    return len(_TOKEN.findall(text or ""))
+
+
+class Dialog(namedtuple("Dialog", "conversation_id summary turns tokens")):
+    """summary — краткое содержание или None; turns — ((роль, текст), ...)."""
+
+    def messages(self, summary_prefix):
+        """Сообщения перед вопросом в формате chat/completions: ((role, content), ...)."""
+        head = (("system", summary_prefix + self.summary),) if self.summary else ()
+        return head + self.turns
+
+
+class ContextBuilder:
+    """summarize(summary, turns) -> новое краткое содержание или None;
+    skip — тексты ответов, которые в контекст не попадают (заглушки, ошибки)."""
+
+    def __init__(self, engine, conversations, messages, summarize, budget=2048, high=0.8, keep=0.5,
+                 scan=200, skip=()):
+        self.engine = engine
+        self.conversations = conversations
+        self.messages = messages
+        self.summarize = summarize
+        self.budget = budget
+        self.high = high
+        self.keep = keep
+        self.scan = scan
+        self.skip = frozenset(skip)
+        self._queue = queue.Queue()
+        self._pending = set()   # разговоры, которые уже сворачиваются
+        self._lock = threading.Lock()
+        self._thread_lock = threading.Lock()
+        self._thread = None
+        self.built = self.trimmed = self.compacted = self.failed = 0
+
+    def _load(self, conn, conversation_id, before_id):
+        c, m = self.conversations.c, self.messages.c
+        row = conn.execute(select(c.summary, c.summary_upto).where(c.id == conversation_id)).first()
+        summary, upto = (row.summary, row.summary_upto or 0) if row else (None, 0)
+        rows = conn.execute(
+            select(m.id, m.role, m.text)
+            .where(m.conversation_id == conversation_id, m.id > upto, m.id < before_id)
+            .order_by(m.id.desc()).limit(self.scan)
+        ).all()
+        turns = [(r.id, ROLES.get(r.role, "user"), r.text) for r in reversed(rows)
+                 if r.text and not (r.role == "ai" and r.text in self.skip)]
+        return summary, upto, turns
+
+    def build(self, conversation_id, before_id):
+        """Контекст для вопроса с id before_id (сам вопрос и всё после него не входят)."""
+        if self.budget <= 0:
+            return Dialog(conversation_id, None, (), 0)
+        with self.engine.connect() as conn:
+            summary, _upto, turns = self._load(conn, conversation_id, before_id)
+        self.built += 1
+        used = count_tokens(summary)
+        if used > self.budget:
+            summary, used = None, 0
+        sizes = [count_tokens(text) for _id, _role, text in turns]
+        if used + sum(sizes) > self.high * self.budget:
+            self._schedule(conversation_id, before_id)
+        if used + sum(sizes) > self.budget:
+            # Свёртка не успела — самые новые реплики, что помещаются
+            self.trimmed += 1
+            start = len(turns)
+            while start > 0 and used + sizes[start - 1] <= self.budget:
+                start -= 1
+                used += sizes[start]
+            turns = turns[start:]
+        else:
+            used += sum(sizes)
+        return Dialog(conversation_id, summary, tuple((role, text) for _id, role, text in turns), used)
+
+    def _ensure_thread(self):
+        # Как и в WriteBehind: поток заводится уже в воркере, а не в мастере до fork
+        if self._thread is None or not self._thread.is_alive():
+            with self._thread_lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name="dialog-summary", daemon=True)
+                    self._thread.start()
+
+    def _schedule(self, conversation_id, before_id):
+        with self._lock:
+            if conversation_id in self._pending:
+                return
+            self._pending.add(conversation_id)
+        self._ensure_thread()
+        self._queue.put((conversation_id, before_id))
+
+    def _run(self):
+        while True:
+            conversation_id, before_id = self._queue.get()
+            try:
+                self.compact(conversation_id, before_id)
+            except Exception as e:
+                self.failed += 1
+                print("dialog summary error:", e)
+            finally:
+                with self._lock:
+                    self._pending.discard(conversation_id)
+
+    def compact(self, conversation_id, before_id):
+        """Сворачивает старые реплики до id before_id в summary. True — записано."""
+        with self.engine.connect() as conn:
+            summary, upto, turns = self._load(conn, conversation_id, before_id)
+        sizes = [count_tokens(text) for _id, _role, text in turns]
+        total = count_tokens(summary) + sum(sizes)
+        if total <= self.high * self.budget:
+            return False
+        # Сворачиваем с начала, пока остаток не станет не больше keep * budget
+        cut, rest = 0, sum(sizes)
+        while cut < len(turns) and rest > self.keep * self.budget:
+            rest -= sizes[cut]
+            cut += 1
+        folded = turns[:cut]
+        if not folded:
+            return False
+        new_summary = self.summarize(summary, tuple((role, text) for _id, role, text in folded))
+        if not new_summary:
+            self.failed += 1
+            return False
+        c = self.conversations.c
+        with self.engine.begin() as conn:
+            done = conn.execute(
+                update(self.conversations)
+                .where(c.id == conversation_id, c.summary_upto == upto)
+                .values(summary=new_summary, summary_upto=folded[-1][0])
+            ).rowcount
+        self.compacted += done
+        return bool(done)
+
+    def stats(self):
+        return {"budget": self.budget, "built": self.built, "trimmed": self.trimmed,
+                "compacted": self.compacted, "failed": self.failed, "pending": len(self._pending)}
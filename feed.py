@@ -0,0 +1,134 @@
+"""Лента изменений заявок для админки (Server-Sent Events).
+
+У каждой строки support есть rev — номер последнего изменения. Триггеры
+ставят его при вставке и при изменении text/answer/is_tariff:
+max(rev) + 1 по индексу, одним оператором внутри той же транзакции, так
+что номера растут вместе с порядком коммитов (SQLite пишет по одному).
+Курсор ленты — rev последней отправленной строки; changes() отдаёт всё,
+что изменилось после него, одним проходом по индексу rev. Стоимость
+запроса зависит от числа изменений, а не от размера таблицы.
+
+FeedWatcher — один на воркер: пока кто-то ждёт изменений, его поток раз
+в interval секунд читает max(rev) (одно чтение конца индекса) и будит
+ожидающих. Изменения из этого же воркера будят их сразу через notify().
+"""
+import atexit
+import threading
+
+from sqlalchemy import func, select, text
+
+TABLE = "support"
+COLUMNS = ("text", "answer", "is_tariff")
+
+
+def _next_rev(table):
+    return f"(SELECT coalesce(max(rev), 0) + 1 FROM {table})"
+
+
+def ensure_feed(engine):
+    """Триггеры, которые ведут support.rev. Колонку и индекс создаёт модель."""
+    if engine.dialect.name != "sqlite":
+        return
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            f"CREATE TRIGGER IF NOT EXISTS {TABLE}_rev_ai AFTER INSERT ON {TABLE} BEGIN "
+            f"UPDATE {TABLE} SET rev = {_next_rev(TABLE)} WHERE id = new.id; END")
+        # UPDATE OF не включает rev, поэтому триггер сам себя не вызывает
+        conn.exec_driver_sql(
+            f"CREATE TRIGGER IF NOT EXISTS {TABLE}_rev_au AFTER UPDATE OF {', '.join(COLUMNS)} ON {TABLE} BEGIN "
+            f"UPDATE {TABLE} SET rev = {_next_rev(TABLE)} WHERE id = new.id; END")
+
+
+def latest(conn, table):
+    return conn.execute(select(func.coalesce(func.max(table.c.rev), 0))).scalar()
+
+
+class FeedWatcher:
+    def __init__(self, engine, table, interval=1.0):
+        self.engine = engine
+        self.table = table
+        self.interval = interval
+        self.rev = None          # последний известный max(rev)
+        self.waiting = 0
+        self.polls = 0
+        self._cond = threading.Condition()
+        self._thread_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        atexit.register(self.close)
+
+    def _ensure_thread(self):
+        # Как и в WriteBehind: поток заводится уже в воркере, а не в мастере до fork
+        if self._thread is None or not self._thread.is_alive():
+            with self._thread_lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name="support-feed", daemon=True)
+                    self._thread.start()
+
+    def _poll(self):
+        with self.engine.connect() as conn:
+            rev = latest(conn, self.table)
+        self.polls += 1
+        with self._cond:
+            if self.rev is None or rev > self.rev:
+                self.rev = rev
+                self._cond.notify_all()
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self._cond:
+                while not self.waiting and not self._stop.is_set():
+                    self._cond.wait()   # никто не ждёт — в БД не ходим
+            if self._stop.is_set():
+                return
+            try:
+                self._poll()
+            except Exception as e:
+                print("support feed poll error:", e)
+            self._stop.wait(self.interval)
+
+    def notify(self):
+        """Изменение в этом воркере (после коммита): ожидающие узнают о нём сразу."""
+        if self.waiting:
+            try:
+                self._poll()
+            except Exception as e:
+                print("support feed poll error:", e)
+
+    def wait(self, cursor, timeout):
+        """Ждёт, пока max(rev) станет больше cursor; False — вышло время."""
+        self._ensure_thread()
+        with self._cond:
+            self.waiting += 1
+            self._cond.notify_all()
+            try:
+                return self._cond.wait_for(lambda: self.rev is not None and self.rev > cursor, timeout)
+            finally:
+                self.waiting -= 1
+
+    def close(self):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+
+    def stats(self):
+        return {"waiting": self.waiting, "polls": self.polls, "rev": self.rev or 0}
+
+
+_ROWS = (f'SELECT s.id, s.rev, s.user_id, u.login, s.is_tariff, s.text, s.answer FROM {TABLE} s '
+         f'LEFT JOIN "user" u ON u.id = s.user_id ')
+
+
+def _rows(conn, where, params):
+    return [dict(r, is_tariff=bool(r["is_tariff"])) for r in conn.execute(text(_ROWS + where), params).mappings()]
+
+
+def changes(conn, after, limit=100):
+    """Заявки, изменённые после курсора after, по возрастанию rev, с логином автора."""
+    return _rows(conn, "WHERE s.rev > :after ORDER BY s.rev LIMIT :n", {"after": after, "n": limit})
+
+
+def ticket(conn, ticket_id):
+    """Одна заявка в том же виде, что и в ленте, или None."""
+    rows = _rows(conn, "WHERE s.id = :id", {"id": ticket_id})
+    return rows[0] if rows else None
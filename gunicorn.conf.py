@@ -0,0 +1,37 @@
+"""Настройки gunicorn: gunicorn -c gunicorn.conf.py main:app
+
+Модель воркеров задаёт GUNICORN_WORKER_CLASS: gthread (по умолчанию,
+WEB_CONCURRENCY процессов по GUNICORN_THREADS потоков) или
+uvicorn.workers.UvicornWorker вместе с asgi:app вместо main:app
+(см. asgi.py). Режим ответов в обоих случаях — ANSWER_MODE.
+
+Мастер до запуска воркеров обновляет схему базы (kb.py migrate): warmup()
+и запросы воркеров рассчитывают на новые таблицы и колонки. С SNAPSHOT_DIR
+он затем собирает снимок базы знаний,
+если его ещё нет (см. snapshot.py): воркеры сразу открывают его через
+mmap, а не грузят всю базу знаний каждый в свою память.
+"""
+import os
+import subprocess
+import sys
+
+bind = os.getenv("BIND", "0.0.0.0:5000")
+workers = int(os.getenv("WEB_CONCURRENCY", "4"))
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+
+
+def on_starting(server):
+    # Отдельным процессом: мастер не открывает базу и не импортирует main до fork
+    kb = os.path.join(os.path.dirname(os.path.abspath(__file__)), "kb.py")
+    # Без схемы воркеры не поднимутся, поэтому ошибка миграции останавливает запуск
+    subprocess.run([sys.executable, kb, "migrate"], check=True)
+    if os.getenv("SNAPSHOT_DIR"):
+        subprocess.run([sys.executable, kb, "snapshot", "--if-missing"], check=False)
+
+
+def post_worker_init(worker):
+    # Индексы фраз и кэш ответов грузятся до первого запроса воркера
+    from main import warmup
+    phrases, cached = warmup()
+    worker.log.info("warmup: %d phrases indexed, %d answers cached", phrases, cached)
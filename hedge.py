@@ -0,0 +1,112 @@
+"""Гонка двух источников ответа: основной (Википедия) и запасной (LLM).
+
+Политики (LOOKUP_POLICY):
+  serial   — запасной запускается, только когда основной ничего не дал;
+             промах платит сумму задержек;
+  parallel — оба сразу; платим вызовом LLM за каждый промах кэша;
+  hedged   — запасной запускается, если основной не ответил за
+             hedge_delay секунд (или ответил пусто).
+Основной в приоритете: его ответ берётся, даже если запасной пришёл
+раньше, но только до deadline секунд от начала — дальше годится любой
+первый непустой. Когда победитель известен, проигравший отменяется.
+
+start_primary() -> Future основного. start_secondary(wait) -> Future
+запасного или None, если он недоступен; wait=False — не ждать
+ограничителей (слота тарифа): такой запуск откладывается до промаха
+основного. Ошибка запуска запасного пробрасывается, только если
+основной тоже ничего не дал. Результат — (источник, ответ): источник
+"primary" или "secondary", либо (None, None).
+"""
+import asyncio
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+from contextlib import suppress
+
+POLICIES = ("serial", "parallel", "hedged")
+
+
+def _value(fut):
+    if fut is None or not fut.done() or fut.cancelled() or fut.exception() is not None:
+        return None
+    return fut.result() or None
+
+
+def race(start_primary, start_secondary, policy="serial", hedge_delay=0.3, deadline=1.0, timeout=None):
+    """Синхронная гонка на concurrent.futures; timeout — сколько ждать запасной."""
+    t0 = time.monotonic()
+    primary = start_primary()
+    secondary = None
+    if policy != "serial":
+        if policy == "hedged":
+            wait([primary], timeout=hedge_delay)
+        if not _value(primary):
+            # не вышло — повторим с ожиданием, если основной ничего не даст
+            with suppress(Exception):
+                secondary = start_secondary(False)
+    while True:
+        if primary.done():
+            answer = _value(primary)
+            if answer:
+                if secondary is not None:
+                    secondary.cancel()
+                return "primary", answer
+            if secondary is None:
+                # serial, или запасной не запустился без ожидания — теперь ждём его
+                secondary = start_secondary(True)
+                if secondary is None:
+                    return None, None
+            try:
+                answer = secondary.result(timeout)
+            except Exception:
+                secondary.cancel()
+                answer = None
+            return ("secondary", answer) if answer else (None, None)
+        if secondary is not None and secondary.done() and _value(secondary) \
+                and time.monotonic() - t0 >= deadline:
+            primary.cancel()
+            return "secondary", _value(secondary)
+        # Ждём первого завершения, но не дольше, чем до deadline: после него
+        # готовый запасной годится и без основного
+        left = deadline - (time.monotonic() - t0)
+        pending = [f for f in (primary, secondary) if f is not None and not f.done()]
+        wait(pending, timeout=left if left > 0 else None, return_when=FIRST_COMPLETED)
+
+
+async def arace(start_primary, start_secondary, policy="serial", hedge_delay=0.3, deadline=1.0, timeout=None):
+    """race() для asyncio: start_primary() — корутина, start_secondary(wait) —
+    корутина, возвращающая asyncio.Future или None."""
+    t0 = time.monotonic()
+    primary = asyncio.ensure_future(start_primary())
+    secondary = None
+    if policy != "serial":
+        if policy == "hedged":
+            await asyncio.wait([primary], timeout=hedge_delay)
+        if not _value(primary):
+            with suppress(Exception):
+                secondary = await start_secondary(False)
+    try:
+        while True:
+            if primary.done():
+                answer = _value(primary)
+                if answer:
+                    return "primary", answer
+                if secondary is None:
+                    secondary = await start_secondary(True)
+                    if secondary is None:
+                        return None, None
+                try:
+                    answer = await asyncio.wait_for(secondary, timeout)
+                except Exception:
+                    answer = None
+                return ("secondary", answer) if answer else (None, None)
+            if secondary is not None and secondary.done() and _value(secondary) \
+                    and time.monotonic() - t0 >= deadline:
+                return "secondary", _value(secondary)
+            left = deadline - (time.monotonic() - t0)
+            pending = [f for f in (primary, secondary) if f is not None and not f.done()]
+            await asyncio.wait(pending, timeout=left if left > 0 else None, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        # Проигравший (или всё, если нас самих отменили) снимается
+        for fut in (primary, secondary):
+            if fut is not None and not fut.done():
+                fut.cancel()
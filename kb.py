@@ -0,0 +1,205 @@
+"""Массовая загрузка и выгрузка базы знаний, прогрев кэша.
+
+    python kb.py import knowledge.jsonl [--replace] [--batch 10000]
+    python kb.py export knowledge.jsonl [--skip-placeholders]
+    python kb.py warmup [--cache-rows 1000]
+    python kb.py compact [--dry-run] [--placeholder-days 7] [--idle-days 180]
+    python kb.py snapshot [--if-missing]
+    python kb.py reresolve [--limit 1000]
+    python kb.py migrate
+
+compact — обслуживание по cron (например, раз в сутки), см. compaction.py.
+snapshot — собрать снимок базы знаний в SNAPSHOT_DIR (см. snapshot.py);
+воркеры запускают его сами, когда дельта вырастает до SNAPSHOT_DELTA_ROWS.
+reresolve — заново поискать ответы на заглушки сейчас, не дожидаясь
+тихого времени воркеров (например, по cron ночью), см. reresolve.py.
+migrate — только создать таблицы и досоздать колонки и индексы (init_db);
+его запускает мастер gunicorn до старта воркеров. Остальные команды
+делают то же перед работой.
+
+Формат — JSON Lines, по паре на строку: {"phrase": "...", "answer": "..."}
+(вместо "phrase" можно "question"); "-" вместо файла — stdin/stdout.
+Фразы приводятся к виду normalize_text() (нижний регистр, одиночные
+пробелы), дубликаты отсекает уникальный индекс knowledge.phrase:
+без --replace существующие фразы не трогаются, с --replace им
+обновляется ответ. Файл читается потоково и пишется пачками по
+--batch строк, одной транзакцией на пачку, так что память не зависит
+от размера файла.
+"""
+import argparse
+import json
+import sys
+import time
+from contextlib import nullcontext
+
+import main as app_main
+from compaction import compact
+from main import (Knowledge, KnowledgeTombstone, PLACEHOLDER_ANSWER, SNAPSHOT_DIR, app, build_snapshot, db, init_db,
+                  invalidate_answers, match_phrase, normalize_text, sync_phrases, warmup)
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+
+def read_pairs(f, stats):
+    for lineno, line in enumerate(f, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item = json.loads(line)
+            phrase = normalize_text(item.get("phrase") or item.get("question") or "")[:256]
+            answer = item.get("answer")
+        except (ValueError, AttributeError):
+            phrase = answer = None
+        if not phrase or not isinstance(answer, str) or not answer:
+            stats["bad"] += 1
+            if stats["bad"] <= 5:
+                print(f"строка {lineno}: пропущена", file=sys.stderr)
+            continue
+        yield {"phrase": phrase, "answer": answer}
+
+
+def import_pairs(f, replace=False, batch_size=10000):
+    stats = {"read": 0, "bad": 0}
+    stmt = sqlite_insert(Knowledge)
+    if replace:
+        stmt = stmt.on_conflict_do_update(index_elements=["phrase"], set_={"answer": stmt.excluded.answer})
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=["phrase"])
+    with app.app_context():
+        before = db.session.query(Knowledge.id).count()
+        batch = []
+        for row in read_pairs(f, stats):
+            batch.append(row)
+            if len(batch) >= batch_size:
+                stats["read"] += _write(stmt, batch)
+                batch = []
+        if batch:
+            stats["read"] += _write(stmt, batch)
+        stats["added"] = db.session.query(Knowledge.id).count() - before
+        # Новые фразы воркеры подхватят сами (sync_phrases), а закэшированные
+        # ответы могли устареть
+        invalidate_answers()
+    return stats
+
+
+def _write(stmt, batch):
+    with db.engine.begin() as conn:
+        conn.execute(stmt, batch)
+    return len(batch)
+
+
+def export_pairs(f, skip_placeholders=False, batch_size=10000):
+    n = 0
+    with app.app_context():
+        q = db.session.query(Knowledge.phrase, Knowledge.answer).order_by(Knowledge.id)
+        if skip_placeholders:
+            q = q.filter(Knowledge.answer != PLACEHOLDER_ANSWER)
+        for phrase, answer in q.yield_per(batch_size):
+            f.write(json.dumps({"phrase": phrase, "answer": answer}, ensure_ascii=False) + "\n")
+            n += 1
+    return n
+
+
+def lookup_ms(samples):
+    """Среднее время поиска по индексу фраз воркера на выборке вопросов, мс."""
+    sync_phrases()
+    t0 = time.perf_counter()
+    for q in samples:
+        match_phrase(q)
+    return (time.perf_counter() - t0) * 1000 / max(1, len(samples))
+
+
+def compact_kb(args):
+    with app.app_context():
+        app_main.kb_hits.flush()
+        samples = [p for (p,) in db.session.query(Knowledge.phrase).order_by(db.func.random()).limit(500)]
+        samples = [f"подскажи пожалуйста {p} и ещё немного текста" for p in samples]
+        before = lookup_ms(samples)
+        report = compact(db.engine, Knowledge.__table__, KnowledgeTombstone.__table__, PLACEHOLDER_ANSWER,
+                         normalize_text, placeholder_days=args.placeholder_days, idle_days=args.idle_days,
+                         min_hits=args.min_hits, dry_run=args.dry_run)
+        after = lookup_ms(samples)
+        if not args.dry_run:
+            invalidate_answers()
+    report["lookup_ms_before"], report["lookup_ms_after"] = before, after
+    return report
+
+
+def reresolve_kb(limit):
+    with app.app_context():
+        app_main.kb_hits.flush()   # приоритет — по свежим hits
+        done = 0
+        while done < limit:
+            n = app_main.reresolver.run_once()
+            if not n:
+                break
+            done += n
+    return app_main.reresolver.stats()
+
+
+def _mb(size):
+    return "?" if size is None else f"{size / 1048576:.1f} МБ"
+
+
+def main():
+    ap = argparse.ArgumentParser(description="База знаний: импорт/экспорт JSONL и прогрев")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("import", help="загрузить пары вопрос-ответ")
+    p.add_argument("file")
+    p.add_argument("--replace", action="store_true", help="обновлять ответ у существующих фраз")
+    p.add_argument("--batch", type=int, default=10000)
+    p = sub.add_parser("export", help="выгрузить базу знаний")
+    p.add_argument("file")
+    p.add_argument("--skip-placeholders", action="store_true", help="без строк-заглушек")
+    p = sub.add_parser("warmup", help="загрузить индексы фраз и кэш ответов (как при старте воркера)")
+    p.add_argument("--cache-rows", type=int, default=None)
+    p = sub.add_parser("compact", help="слить дубликаты, убрать заглушки и неиспользуемые фразы")
+    p.add_argument("--dry-run", action="store_true", help="только посчитать, что будет удалено")
+    p.add_argument("--placeholder-days", type=int, default=7)
+    p.add_argument("--idle-days", type=int, default=180, help="0 — не удалять по неиспользованию")
+    p.add_argument("--min-hits", type=int, default=1)
+    p = sub.add_parser("snapshot", help="собрать снимок базы знаний для воркеров")
+    p.add_argument("--if-missing", action="store_true", help="только если снимка ещё нет")
+    p = sub.add_parser("reresolve", help="доразрешить заглушки через Википедию/LLM")
+    p.add_argument("--limit", type=int, default=1000, help="не больше стольких строк за запуск")
+    sub.add_parser("migrate", help="создать таблицы, досоздать колонки и индексы")
+    args = ap.parse_args()
+
+    init_db()
+    t0 = time.perf_counter()
+    if args.cmd == "import":
+        with nullcontext(sys.stdin) if args.file == "-" else open(args.file, encoding="utf-8") as f:
+            stats = import_pairs(f, args.replace, args.batch)
+        print(f"прочитано {stats['read']}, новых {stats['added']}, пропущено строк {stats['bad']}"
+              f" за {time.perf_counter() - t0:.1f} с", file=sys.stderr)
+    elif args.cmd == "export":
+        with nullcontext(sys.stdout) if args.file == "-" else open(args.file, "w", encoding="utf-8") as f:
+            n = export_pairs(f, args.skip_placeholders)
+        print(f"выгружено {n} за {time.perf_counter() - t0:.1f} с", file=sys.stderr)
+    elif args.cmd == "compact":
+        r = compact_kb(args)
+        print(f"строк {r['rows_before']} -> {r['rows_after']}, размер {_mb(r['bytes_before'])} -> "
+              f"{_mb(r['bytes_after'])}, поиск {r['lookup_ms_before']:.3f} -> {r['lookup_ms_after']:.3f} мс")
+        print("удалено: " + ", ".join(f"{k} {v}" for k, v in r["removed"].items()) +
+              f"; переписано фраз {r['renamed']}" + (" (dry run)" if args.dry_run else "") +
+              f"; {r['seconds']:.1f} с", file=sys.stderr)
+    elif args.cmd == "snapshot":
+        if not SNAPSHOT_DIR:
+            sys.exit("SNAPSHOT_DIR не задан")
+        path = build_snapshot(args.if_missing)
+        print(f"снимок {path} за {time.perf_counter() - t0:.1f} с" if path else "снимок не нужен или уже собирается",
+              file=sys.stderr)
+    elif args.cmd == "migrate":
+        print(f"схема базы обновлена за {time.perf_counter() - t0:.1f} с", file=sys.stderr)
+    elif args.cmd == "reresolve":
+        r = reresolve_kb(args.limit)
+        print(f"взято {r['claimed']}, найдено ответов {r['resolved']}, неудач {r['failed']}"
+              f" за {time.perf_counter() - t0:.1f} с", file=sys.stderr)
+    else:
+        phrases, cached = warmup(args.cache_rows)
+        print(f"фраз в индексе {phrases}, ответов в кэше {cached} за {time.perf_counter() - t0:.1f} с",
+              file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
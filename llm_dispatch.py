@@ -0,0 +1,247 @@
+"""Диспетчер вызовов LLM: микропакеты, общий лимит параллельности,
+адаптивный откат на 429/5xx и автоматический выключатель.
+
+У OpenAI-совместимого /chat/completions нет пакетного режима (один
+запрос — один диалог), поэтому «пакет» здесь — это запросы, собранные за
+окно window секунд: одинаковые промпты склеиваются в один вызов, а
+остальные уходят параллельно, но не больше текущего лимита. Лимит
+меняется по AIMD: +1/лимит после успеха, вдвое меньше после 429/5xx,
+плюс пауза перед следующими вызовами (Retry-After, если он есть).
+
+CircuitBreaker после failures подряд неудач (5xx, таймауты, сетевые
+ошибки) размыкается на reset_timeout секунд: вызовы не уходят, а сразу
+получают None, и цепочка ответа идёт дальше без LLM. Потом один пробный
+вызов решает, замкнуться обратно или ждать ещё; если пробный вызов так и
+не ушёл (его отменили или он не дождался очереди), release() пропускает
+следующий.
+
+Future из submit() можно отменить (fut.cancel()), пока вызов не ушёл:
+такой промпт в LLM не отправится. Так снимается проигравший в гонке
+Википедии и LLM (см. hedge.py).
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError, ThreadPoolExecutor
+from contextlib import suppress
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+class CircuitBreaker:
+    def __init__(self, failures=5, reset_timeout=30.0):
+        self.failures = failures
+        self.reset_timeout = reset_timeout
+        self._count = 0
+        self._opened_at = None
+        self._probe = False
+        self._lock = threading.Lock()
+        self.opened = 0   # сколько раз размыкался
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            return "half-open" if time.monotonic() - self._opened_at >= self.reset_timeout else "open"
+
+    def allow(self):
+        """Можно ли сейчас звать LLM. В полуоткрытом состоянии пропускает один
+        пробный вызов и возвращает для него "probe": его исход нужно сообщить
+        через success()/failure() или снять пробу через release()."""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._probe:
+                return False
+            self._probe = True
+            return "probe"
+
+    def release(self):
+        """Пробный вызов не состоялся: следующий allow() снова пропустит пробу."""
+        with self._lock:
+            self._probe = False
+
+    def success(self):
+        with self._lock:
+            self._count = 0
+            self._opened_at = None
+            self._probe = False
+
+    def failure(self):
+        with self._lock:
+            self._count += 1
+            if self._probe or (self._opened_at is None and self._count >= self.failures):
+                if self._opened_at is None:
+                    self.opened += 1
+                self._opened_at = time.monotonic()
+            self._probe = False
+
+
+class LLMDispatcher:
+    """Очередь промптов перед LLM.
+
+    call(prompt, system_prompt, history) -> (HTTP-статус, текст или None, Retry-After или None);
+    history — предыдущие сообщения разговора, кортеж пар (role, content).
+    Исключение из call считается сетевой ошибкой.
+    """
+
+    def __init__(self, call, max_concurrency=4, window=0.02, max_batch=16, retries=2,
+                 backoff=0.5, max_backoff=30.0, breaker=None):
+        self.call = call
+        self.max_concurrency = max_concurrency
+        self.window = window
+        self.max_batch = max_batch
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker = breaker or CircuitBreaker()
+        self.limit = float(max_concurrency)
+        self._queue = queue.Queue()
+        self._active = 0
+        self._cond = threading.Condition()
+        self._resume_at = 0.0
+        self._penalty = backoff
+        self._pool = None
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self.calls = self.coalesced = self.throttled = self.failed = self.skipped = self.cancelled = 0
+
+    def _ensure_thread(self):
+        # Как и в WriteBehind: поток заводится уже в воркере, а не в мастере до fork
+        if self._thread is None or not self._thread.is_alive():
+            with self._thread_lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._pool = ThreadPoolExecutor(self.max_concurrency, thread_name_prefix="llm")
+                    self._thread = threading.Thread(target=self._run, name="llm-dispatch", daemon=True)
+                    self._thread.start()
+
+    def submit(self, prompt, system_prompt, history=()):
+        """Ставит промпт в очередь; Future с текстом ответа или None.
+        Склеиваются только промпты с одинаковой историей."""
+        fut = Future()
+        allowed = self.breaker.allow()
+        if not allowed:
+            self.skipped += 1
+            fut.set_result(None)
+            return fut
+        self._ensure_thread()
+        self._queue.put(((prompt, system_prompt, tuple(history)), fut, 0, allowed == "probe"))
+        return fut
+
+    def ask(self, prompt, system_prompt, history=(), timeout=None):
+        """Блокирующий вариант submit(): текст ответа или None (ошибка, выключатель, таймаут)."""
+        try:
+            return self.submit(prompt, system_prompt, history).result(timeout)
+        except Exception:
+            return None
+
+    def _collect(self):
+        items = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(items) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                items.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return items
+
+    def _run(self):
+        while True:
+            groups = {}   # одинаковые промпты из одного окна — один вызов
+            for key, fut, attempt, probe in self._collect():
+                group = groups.setdefault(key, [[], attempt, False])
+                group[0].append(fut)
+                group[1] = max(group[1], attempt)
+                group[2] = group[2] or probe
+            self.coalesced += sum(len(futs) - 1 for futs, _a, _p in groups.values())
+            for key, (futs, attempt, probe) in groups.items():
+                if not self._acquire():
+                    self.skipped += len(futs)
+                    self._resolve(futs, None)
+                    if probe:
+                        self.breaker.release()
+                    continue
+                # После set_running_or_notify_cancel() future отменить уже нельзя
+                live = [f for f in futs if f.running() or f.set_running_or_notify_cancel()]
+                self.cancelled += len(futs) - len(live)
+                if not live:
+                    with self._cond:
+                        self._active -= 1
+                        self._cond.notify_all()
+                    if probe:
+                        self.breaker.release()   # проба не ушла — иначе выключатель не замкнётся никогда
+                    continue
+                self._pool.submit(self._invoke, key, live, attempt)
+
+    def _acquire(self):
+        """Ждёт места под текущим лимитом и конца паузы; False — выключатель разомкнут."""
+        with self._cond:
+            while True:
+                if self.breaker.state == "open":
+                    return False
+                wait = self._resume_at - time.monotonic()
+                if wait <= 0 and self._active < max(1, int(self.limit)):
+                    self._active += 1
+                    return True
+                self._cond.wait(wait if wait > 0 else None)
+
+    def _invoke(self, key, futs, attempt):
+        status = text = retry_after = None
+        try:
+            self.calls += 1
+            status, text, retry_after = self.call(*key)
+        except Exception as e:
+            print("LLM dispatch error:", e)
+        finally:
+            if status is None or status >= 500:
+                self.breaker.failure()
+            else:
+                self.breaker.success()
+            with self._cond:
+                self._active -= 1
+                if status in RETRY_STATUSES:
+                    self._throttle(retry_after)
+                elif status is not None and status < 500:
+                    self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+                    self._penalty = self.backoff
+                self._cond.notify_all()
+
+        allowed = status in RETRY_STATUSES and attempt < self.retries and self.breaker.allow()
+        if allowed:
+            for i, fut in enumerate(futs):
+                self._queue.put((key, fut, attempt + 1, allowed == "probe" and i == 0))
+            return
+        if status != 200 or text is None:
+            self.failed += 1
+            text = None
+        self._resolve(futs, text)
+
+    @staticmethod
+    def _resolve(futs, text):
+        for fut in futs:
+            with suppress(InvalidStateError):   # отменена, пока ждала своей очереди
+                fut.set_result(text)
+
+    def throttle(self, retry_after=None):
+        """429/5xx от вызова в обход очереди (потоковый ответ): та же пауза и лимит."""
+        with self._cond:
+            self._throttle(retry_after)
+            self._cond.notify_all()
+
+    def _throttle(self, retry_after):
+        # под self._cond: мультипликативное уменьшение и пауза для всех
+        self.throttled += 1
+        self.limit = max(1.0, self.limit / 2)
+        pause = retry_after if retry_after is not None else self._penalty
+        self._penalty = min(self.max_backoff, self._penalty * 2)
+        self._resume_at = max(self._resume_at, time.monotonic() + min(pause, self.max_backoff))
+
+    def stats(self):
+        return {"limit": self.limit, "active": self._active, "queued": self._queue.qsize(),
+                "calls": self.calls, "coalesced": self.coalesced, "throttled": self.throttled,
+                "failed": self.failed, "skipped": self.skipped, "cancelled": self.cancelled,
+                "breaker": self.breaker.state}
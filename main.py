@@ -1,155 +1,597 @@
-from flask import Flask, render_template_string, request, redirect, session
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from flask import (
+    Flask,
+    Response,
+    g,
+    has_app_context,
+    jsonify,
+    redirect,
+    render_template,
+    request,
+    session,
+    stream_with_context,
+)
 from flask_sqlalchemy import SQLAlchemy
-import random
-import requests  # Для поиска по Википедии
+from markupsafe import Markup, escape
+from sqlalchemy import event
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
 
-# --- LLM (DeepInfra) integration ---
-import os
-import requests as _requests
+from auth import AuthCache, SessionUser, hash_password, needs_rehash
+from cache import MISS, LayeredCache, LRUCache, SharedStore
+from compaction import HitTracker
+from dialog import ContextBuilder, is_follow_up
+from feed import FeedWatcher, ensure_feed
+from feed import changes as feed_changes
+from feed import latest as feed_latest
+from feed import ticket as feed_ticket
+from hedge import POLICIES, arace, race
+from llm_dispatch import RETRY_STATUSES, CircuitBreaker, LLMDispatcher
+from matcher import PhraseMatcher
+from metrics import Registry
+from pipeline import AnswerPipeline, AsyncAnswerPipeline
+from quota import ConcurrencyLimit, MonthlyCounter, RateLimiter, SlotBusy
+from reresolve import Reresolver
+from retrieval import FuzzyIndex
+from search import SCOPES as SEARCH_SCOPES
+from search import ensure_fts, highlight
+from search import search as fts_search
+from singleflight import AsyncSingleFlight, SingleFlight
+from snapshot import SnapshotStore
+from snapshot import build as snapshot_build
+from snapshot import building as snapshot_building
+from snapshot import current_name as snapshot_current
+from snapshot import readable as snapshot_readable
+from storage import WriteBehind, configure_sqlite, engine_options
+from upstream import AsyncUpstreamClient, UpstreamClient
+
+try:  # brotli необязателен: без него стиль отдаётся в gzip
+    import brotli
+except ImportError:
+    brotli = None
 
+# --- LLM (DeepInfra) integration ---
 DEEPINFRA_API_KEY = os.getenv("DEEPINFRA_API_KEY")
 
-def ask_llm(message, system_prompt="Ты умный помощник. Отвечай кратко и по-русски."):
+# Общие пулы keep-alive соединений к внешним сервисам (см. upstream.py)
+UPSTREAM_POOL_SIZE = int(os.getenv("UPSTREAM_POOL_SIZE", "10"))
+wikipedia = UpstreamClient(
+    "wikipedia", os.getenv("WIKIPEDIA_URL", "https://ru.wikipedia.org"),
+    timeout=float(os.getenv("WIKIPEDIA_TIMEOUT", "2")),
+    pool_size=UPSTREAM_POOL_SIZE,
+    retries=int(os.getenv("WIKIPEDIA_RETRIES", "1")),
+)
+deepinfra = UpstreamClient(
+    "deepinfra", os.getenv("DEEPINFRA_URL", "https://api.deepinfra.com"),
+    timeout=float(os.getenv("LLM_TIMEOUT", "60")),
+    pool_size=UPSTREAM_POOL_SIZE,
+)
+
+LLM_MODEL = "meta-llama/Meta-Llama-3-8B-Instruct"
+LLM_SYSTEM_PROMPT = "Ты умный помощник. Отвечай кратко и по-русски."
+
+def _llm_request(message, system_prompt, stream=False, history=()):
+    """history — предыдущие сообщения разговора ((role, content), ...), см. dialog.py."""
+    headers = {
+        "Authorization": f"Bearer {DEEPINFRA_API_KEY}",
+        "Content-Type": "application/json",
+    }
+    payload = {
+        "model": LLM_MODEL,
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            *({"role": role, "content": content} for role, content in history),
+            {"role": "user", "content": message},
+        ],
+        "temperature": 0.3,
+    }
+    if stream:
+        payload["stream"] = True
+    return deepinfra.post("/v1/openai/chat/completions", headers=headers, json=payload, stream=stream)
+
+def _llm_call(message, system_prompt, history=()):
+    """Один вызов для LLMDispatcher: (статус, текст, Retry-After)."""
+    try:
+        resp = _llm_request(message, system_prompt, history=history)
+        if resp.status_code != 200:
+            retry_after = resp.headers.get("Retry-After", "")
+            return resp.status_code, None, float(retry_after) if retry_after.isdigit() else None
+        data = resp.json()
+        _llm_usage(data.get("usage"))
+        return 200, data.get("choices", [{}])[0].get("message", {}).get("content"), None
+    except Exception as e:
+        upstream_errors.inc(service="deepinfra", error=type(e).__name__)
+        raise
+
+# Все вызовы LLM воркера идут через одну очередь (см. llm_dispatch.py)
+LLM_WAIT = float(os.getenv("LLM_WAIT", "120"))  # дольше ответа не ждём, даже с повторами
+llm_dispatch = LLMDispatcher(
+    _llm_call,
+    max_concurrency=int(os.getenv("LLM_CONCURRENCY", "8")),
+    window=float(os.getenv("LLM_BATCH_WINDOW", "0.02")),
+    breaker=CircuitBreaker(failures=int(os.getenv("LLM_BREAKER_FAILURES", "5")),
+                           reset_timeout=float(os.getenv("LLM_BREAKER_RESET", "30"))),
+)
+
+def ask_llm(message, system_prompt=LLM_SYSTEM_PROMPT, history=()):
     """Call DeepInfra OpenAI-compatible endpoint if API key is set.
-    Returns string answer or None on error / not configured.
+    Returns string answer or None on error / not configured / circuit open.
     """
     if not DEEPINFRA_API_KEY:
         return None
+    with stage_seconds.time(stage="llm"):
+        return llm_dispatch.ask(message, system_prompt, history, timeout=LLM_WAIT)
+
+def ask_llm_stream(message, system_prompt=LLM_SYSTEM_PROMPT, history=()):
+    """Same as ask_llm, but yields text chunks as the provider streams them
+    (OpenAI-compatible SSE, stream=true). Yields nothing if not configured,
+    circuit open or HTTP error; raises if the stream breaks before [DONE],
+    so a truncated answer is never taken for a complete one.
+    """
+    if not DEEPINFRA_API_KEY:
+        return
+    allowed = llm_dispatch.breaker.allow()
+    if not allowed:
+        return
     try:
-        url = "https://api.deepinfra.com/v1/openai/chat/completions"
-        headers = {
-            "Authorization": f"Bearer {DEEPINFRA_API_KEY}",
-            "Content-Type": "application/json",
-        }
-        payload = {
-            "model": "meta-llama/Meta-Llama-3-8B-Instruct",
-            "messages": [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": message},
-            ],
-            "temperature": 0.3,
-        }
-        resp = _requests.post(url, headers=headers, json=payload, timeout=60)
-        data = resp.json()
-        return data.get("choices", [{}])[0].get("message", {}).get("content")
+        with stage_seconds.time(stage="llm_stream"), \
+                _llm_request(message, system_prompt, stream=True, history=history) as resp:
+            if resp.status_code != 200:
+                upstream_errors.inc(service="deepinfra", error=f"HTTP {resp.status_code}")
+                # Исход сообщается выключателю всегда: иначе пробный вызов повиснет
+                if resp.status_code >= 500 or resp.status_code == 429:
+                    llm_dispatch.breaker.failure()
+                elif allowed == "probe":
+                    llm_dispatch.breaker.release()
+                if resp.status_code in RETRY_STATUSES:
+                    retry_after = resp.headers.get("Retry-After", "")
+                    llm_dispatch.throttle(float(retry_after) if retry_after.isdigit() else None)
+                return
+            llm_dispatch.breaker.success()
+            resp.encoding = "utf-8"
+            for line in resp.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    return
+                chunk = json.loads(data)
+                delta = chunk.get("choices", [{}])[0].get("delta", {}).get("content")
+                if delta:
+                    yield delta
+            raise ConnectionError("LLM stream ended before [DONE]")
     except Exception as e:
-        # Fail soft: don't break the app if LLM call fails
-        print("LLM error:", e)
-        return None
-import re
+        print("LLM stream error:", e)
+        upstream_errors.inc(service="deepinfra", error=type(e).__name__)
+        llm_dispatch.breaker.failure()
+        raise
 
 app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///db.sqlite3'
-app.secret_key = 'secretkey'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('SQLALCHEMY_DATABASE_URI', 'sqlite:///db.sqlite3')
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(
+    app.config['SQLALCHEMY_DATABASE_URI'],
+    pool_size=int(os.getenv("DB_POOL_SIZE", "10")),
+    max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "20")),
+)
+app.secret_key = os.getenv('FLASK_SECRET', 'secretkey')
 db = SQLAlchemy(app)
 
+# WAL и прочие PRAGMA на каждом соединении; вставки Knowledge — пачками
+# в фоне (WRITE_BEHIND=0 возвращает запись прямо в запросе). Заявки Support —
+# данные пользователя, они пишутся всегда сразу. См. storage.py
+with app.app_context():
+    configure_sqlite(db.engine)
+    writes = WriteBehind(
+        db.engine,
+        batch_size=int(os.getenv("WRITE_BATCH_SIZE", "100")),
+        interval=float(os.getenv("WRITE_FLUSH_INTERVAL", "0.5")),
+    ) if os.getenv("WRITE_BEHIND", "1") == "1" else None
+
+# --- Метрики (см. metrics.py): /metrics в формате Prometheus, METRICS=0 выключает
+metrics = Registry(enabled=os.getenv("METRICS", "1") == "1")
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+stage_seconds = metrics.histogram("neiro_stage_seconds", "Длительность стадий цепочки ответа", ["stage"])
+answers_served = metrics.counter("neiro_answers_total", "Чем обслужен ответ", ["source"])
+upstream_errors = metrics.counter("neiro_upstream_errors_total", "Исключения при вызовах внешних сервисов",
+                                  ["service", "error"])
+request_seconds = metrics.histogram("neiro_request_seconds", "Время обработки HTTP-запроса", ["endpoint"])
+requests_total = metrics.counter("neiro_requests_total", "HTTP-запросы", ["endpoint", "status"])
+remote_seconds = metrics.histogram("neiro_remote_lookup_seconds", "Поиск во внешних сервисах по политике и победителю",
+                                   ["policy", "source"])
+request_queries = metrics.histogram("neiro_request_db_queries", "SQL-запросов на HTTP-запрос", ["endpoint"],
+                                    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55))
+llm_prompt_tokens = metrics.histogram("neiro_llm_prompt_tokens", "Токены промпта LLM по подсчёту провайдера: "
+                                      "всего и из кэша префиксов", ["kind"],
+                                      buckets=(16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192))
+
+def _llm_usage(usage):
+    if not usage:
+        return
+    llm_prompt_tokens.observe(usage.get("prompt_tokens", 0), kind="prompt")
+    cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens")
+    if cached is not None:
+        llm_prompt_tokens.observe(cached, kind="cached")
+
+if metrics.enabled:
+    def _count_query(*_args):
+        if has_app_context() and "db_queries" in g:
+            g.db_queries += 1
+
+    with app.app_context():
+        event.listen(db.engine, "before_cursor_execute", _count_query)
+
+    @app.before_request
+    def _start_request():
+        g.db_queries = 0
+        g.request_t0 = time.perf_counter()
+
+    @app.after_request
+    def _finish_request(resp):
+        if "request_t0" in g:
+            endpoint = request.endpoint or "unknown"
+            request_seconds.observe(time.perf_counter() - g.request_t0, endpoint=endpoint)
+            request_queries.observe(g.db_queries, endpoint=endpoint)
+            requests_total.inc(endpoint=endpoint, status=resp.status_code)
+        return resp
+
 # --- Модели ---
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     login = db.Column(db.String(32), unique=True, nullable=False)
-    password = db.Column(db.String(32), nullable=False)
+    password = db.Column(db.String(256), nullable=False)  # хэш, см. auth.py
     is_admin = db.Column(db.Boolean, default=False)
     tariff = db.Column(db.String(16), default='demo')  # demo, standart, premium
 
 class Support(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
     text = db.Column(db.Text, nullable=False)
     answer = db.Column(db.Text)
     is_tariff = db.Column(db.Boolean, default=False)
+    rev = db.Column(db.Integer, nullable=False, default=0, server_default="0", index=True)  # номер изменения, см. feed.py
+    __table_args__ = (
+        db.Index('ix_support_is_tariff_id', 'is_tariff', 'id'),
+        # Частичный индекс под фильтр «без ответа» в админке
+        db.Index('ix_support_unanswered_id', 'id', sqlite_where=db.text("answer IS NULL OR answer = ''")),
+    )
 
 class Knowledge(db.Model):  # Самообучающаяся база "вопрос-ответ"
     id = db.Column(db.Integer, primary_key=True)
     phrase = db.Column(db.String(256), nullable=False, unique=True)
     answer = db.Column(db.Text, nullable=False)
+    hits = db.Column(db.Integer, nullable=False, default=0, server_default="0")  # см. compaction.py
+    last_used = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Заглушка: сколько раз не удалось доразрешить и когда пробовать снова (см. reresolve.py)
+    resolve_attempts = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    resolve_after = db.Column(db.DateTime)
+
+class KnowledgeTombstone(db.Model):  # Удалённые строки Knowledge: воркеры убирают их из индексов
+    id = db.Column(db.Integer, primary_key=True)
+    knowledge_id = db.Column(db.Integer, nullable=False)
+    phrase = db.Column(db.String(256), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    __table_args__ = {"sqlite_autoincrement": True}  # id не переиспользуются после чистки
+
+class Conversation(db.Model):  # История переписки: чат с ИИ или техподдержка
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    kind = db.Column(db.String(16), nullable=False, default='chat')  # chat, support
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    summary = db.Column(db.Text)  # краткое содержание сообщений до summary_upto (см. dialog.py)
+    summary_upto = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    __table_args__ = (db.UniqueConstraint('user_id', 'kind'),)
+
+class Message(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id'), nullable=False)
+    role = db.Column(db.String(8), nullable=False)  # user, ai
+    text = db.Column(db.Text)  # None — ответ ещё готовится
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    __table_args__ = (db.Index('ix_message_conversation_id_id', 'conversation_id', 'id'),)
+
+class Usage(db.Model):  # Сколько вопросов пользователь задал за месяц (см. quota.py)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    period = db.Column(db.String(7), primary_key=True)  # ГГГГ-ММ
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+# Попадания по строкам базы знаний для сжатия (см. compaction.py)
+with app.app_context():
+    kb_hits = HitTracker(db.engine, Knowledge.__table__, interval=float(os.getenv("KB_HITS_FLUSH_INTERVAL", "60")))
 
 # --- Хелперы ---
+# Текущий пользователь: один раз за запрос (g), между запросами — снимок
+# SessionUser в кэше процесса на USER_CACHE_TTL секунд. admin() сбрасывает
+# его при смене тарифа; в соседних воркерах он доживает свой TTL.
+_session_users = LRUCache(maxsize=int(os.getenv("USER_CACHE_SIZE", "10000")),
+                          ttl=float(os.getenv("USER_CACHE_TTL", "30")))
+
 def get_current_user():
+    if "current_user" in g:
+        return g.current_user
     uid = session.get('user_id')
+    user = None
     if uid:
-        return User.query.get(uid)
+        user = _session_users.get(uid, None)
+        if user is None:
+            row = db.session.get(User, uid)
+            if row is not None:
+                user = SessionUser.of(row)
+                _session_users.set(uid, user)
+    g.current_user = user
+    return user
+
+def forget_user(uid):
+    _session_users.delete(uid)
+    g.pop("current_user", None)
+
+# --- Пароли: соль + PBKDF2, стоимость настраивается (см. auth.py)
+PASSWORD_HASH_ITERATIONS = int(os.getenv("PASSWORD_HASH_ITERATIONS", "260000"))
+auth_cache = AuthCache(app.secret_key, ttl=float(os.getenv("AUTH_CACHE_TTL", "300")))
+
+def make_password(password):
+    return hash_password(password, PASSWORD_HASH_ITERATIONS)
+
+def authenticate(login, password):
+    """Пользователь с таким логином и паролем или None. Старый формат пароля
+    перехэшируется при успешном входе."""
+    u = User.query.filter_by(login=login).first()
+    if u is None or not auth_cache.verify(login, password, u.password):
+        return None
+    if needs_rehash(u.password, PASSWORD_HASH_ITERATIONS):
+        u.password = make_password(password)
+        db.session.commit()
+    return u
+
+# --- История переписки хранится в БД, в cookie только user_id
+CHAT_PAGE_SIZE = int(os.getenv("CHAT_PAGE_SIZE", "30"))
+
+def get_conversation(user, kind="chat"):
+    conv = Conversation.query.filter_by(user_id=user.id, kind=kind).first()
+    if not conv:
+        conv = Conversation(user_id=user.id, kind=kind)
+        db.session.add(conv)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Первые запросы пользователя пришли разом: разговор создал соседний
+            db.session.rollback()
+            conv = Conversation.query.filter_by(user_id=user.id, kind=kind).one()
+    return conv
+
+def history_page(conv, before=None, limit=None):
+    """Последние limit сообщений до курсора before (id), по возрастанию.
+    Возвращает (сообщения, курсор для более ранних или None)."""
+    limit = limit or CHAT_PAGE_SIZE
+    q = Message.query.filter_by(conversation_id=conv.id)
+    if before:
+        q = q.filter(Message.id < before)
+    rows = q.order_by(Message.id.desc()).limit(limit + 1).all()
+    more = len(rows) > limit
+    rows = rows[:limit][::-1]
+    return rows, (rows[0].id if more and rows else None)
+
+def save_support(user_id, text, is_tariff=False):
+    """Новая заявка/вопрос оператору: пишется сразу, не через очередь записи."""
+    db.session.add(Support(user_id=user_id, text=text, is_tariff=is_tariff))
+    db.session.commit()
+    support_feed.notify()
+
+# --- Фоновые ответы: /chat и /support не ждут Википедию и LLM (см. pipeline.py)
+ANSWER_TIMEOUT = int(os.getenv("ANSWER_TIMEOUT", "180"))
+OVERLOAD_ANSWER = "Сейчас слишком много вопросов, попробуйте через минуту."
+LOST_ANSWER = "Ответ не сохранился, задайте вопрос ещё раз."
+PENDING_TEXT = "…"
+
+def _save_answer(message_id, answer):
+    msg = db.session.get(Message, message_id)
+    msg.text = answer
+    db.session.commit()
+
+def _resolve_answer(message_id, text, context=None, tariff=None):
+    with app.app_context():
+        try:
+            with stage_seconds.time(stage="answer"):
+                answer = smart_answer_learn(text, context=context, tariff=tariff, message_id=message_id)
+        except SlotBusy:
+            answers_served.inc(source="overload")
+            answer = OVERLOAD_ANSWER
+        except Exception as e:
+            db.session.rollback()
+            print("answer error:", e)
+            answers_served.inc(source="error")
+            answer = LOST_ANSWER
+        _save_answer(message_id, answer)
+        return answer
+
+async def _resolve_answer_async(message_id, text, context=None, tariff=None):
+    """То же, что _resolve_answer, для ANSWER_MODE=async."""
+    try:
+        with stage_seconds.time(stage="answer"):
+            answer = await smart_answer_learn_async(text, tariff=tariff, message_id=message_id)
+    except SlotBusy:
+        answers_served.inc(source="overload")
+        answer = OVERLOAD_ANSWER
+    except Exception as e:
+        print("answer error:", e)
+        answers_served.inc(source="error")
+        answer = LOST_ANSWER
+    await in_app(_save_answer, message_id, answer)
+    return answer
+
+# threads — ответы считаются в пуле из ANSWER_WORKERS потоков, и каждый
+# поток ждёт Википедию/LLM; async — в цикле событий (httpx), ANSWER_WORKERS
+# потоков остаются только для БД, а в полёте может быть до ANSWER_QUEUE ответов.
+ANSWER_MODE = os.getenv("ANSWER_MODE", "threads")
+answers = (AsyncAnswerPipeline if ANSWER_MODE == "async" else AnswerPipeline)(
+    _resolve_answer_async if ANSWER_MODE == "async" else _resolve_answer,
+    max_workers=int(os.getenv("ANSWER_WORKERS", "8")),
+    max_pending=int(os.getenv("ANSWER_QUEUE", "256")),
+)
+
+def add_question(conv, text):
+    """Сохраняет вопрос и пустое сообщение-ответ; возвращает последнее."""
+    db.session.add(Message(conversation_id=conv.id, role="user", text=text))
+    ai = Message(conversation_id=conv.id, role="ai", text=None)
+    db.session.add(ai)
+    db.session.commit()
+    return ai
+
+def ask_async(conv, text, context=None, tariff=None):
+    """Добавляет вопрос в историю и ставит ответ в очередь."""
+    ai = add_question(conv, text)
+    if answers.submit(ai.id, text, context, tariff) is None:
+        ai.text = OVERLOAD_ANSWER
+        db.session.commit()
+    return ai
+
+# --- Лимиты тарифов (см. quota.py). Месячные квоты — как на странице /tariffs
+TARIFF_LIMITS = {
+    # тариф: (вопросов в месяц или None, вопросов в минуту, одновременных вызовов LLM)
+    "demo": (None, int(os.getenv("DEMO_PER_MINUTE", "6")), int(os.getenv("DEMO_LLM_SLOTS", "2"))),
+    "standart": (600, 20, 4),
+    "premium": (2000, 60, 8),
+}
+QUOTA_ENABLED = os.getenv("QUOTA", "1") == "1"
+RATE_ANSWER = "Слишком часто, подождите {} с."
+QUOTA_ANSWER = "Вопросы по тарифу на этот месяц закончились. Сменить тариф можно на странице «Тарифы»."
+
+def _load_usage(key):
+    with app.app_context():
+        row = db.session.get(Usage, key)
+        return row.count if row else 0
+
+def _store_usage(deltas):
+    """Прибавляет пачку приростов одной транзакцией; возвращает итоговые значения."""
+    with app.app_context():
+        for (user_id, period), n in deltas.items():
+            db.session.execute(
+                sqlite_insert(Usage).values(user_id=user_id, period=period, count=n)
+                .on_conflict_do_update(index_elements=["user_id", "period"], set_={"count": Usage.count + n}))
+        db.session.commit()
+        return {(u.user_id, u.period): u.count for u in Usage.query.filter(
+            db.tuple_(Usage.user_id, Usage.period).in_(list(deltas)))}
+
+usage = MonthlyCounter(_load_usage, _store_usage, flush_interval=float(os.getenv("QUOTA_FLUSH_INTERVAL", "5")))
+rate_limits = {t: RateLimiter(per_minute / 60, per_minute) for t, (_m, per_minute, _s) in TARIFF_LIMITS.items()}
+llm_slots = ConcurrencyLimit({t: slots for t, (_m, _p, slots) in TARIFF_LIMITS.items()},
+                             timeout=float(os.getenv("LLM_SLOT_WAIT", "10")))
+
+def check_quota(user):
+    """Проверка до любой работы с вопросом: None — можно, иначе текст отказа.
+    Засчитывает вопрос в месячную квоту."""
+    if not QUOTA_ENABLED or user.is_admin:
+        return None
+    tariff = user.tariff if user.tariff in TARIFF_LIMITS else "demo"
+    month, _per_minute, _slots = TARIFF_LIMITS[tariff]
+    wait = rate_limits[tariff].take(user.id)
+    if wait:
+        return RATE_ANSWER.format(int(wait) + 1)
+    if not usage.hit((user.id, datetime.utcnow().strftime("%Y-%m")), month):
+        return QUOTA_ANSWER
     return None
 
+def ensure_indexes():
+    """create_all() не добавляет индексы в уже существующие таблицы — досоздаём их."""
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
+
+def ensure_columns():
+    """create_all() не добавляет и колонки — новые колонки моделей досоздаются
+    через ALTER TABLE ADD COLUMN (им нужен server_default или NULL)."""
+    inspector = db.inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        existing = {c["name"] for c in inspector.get_columns(table.name)}
+        for col in table.columns:
+            if col.name in existing:
+                continue
+            ddl = f'ALTER TABLE "{table.name}" ADD COLUMN "{col.name}" {col.type.compile(db.engine.dialect)}'
+            if col.server_default is not None:
+                ddl += ("" if col.nullable else " NOT NULL") + f" DEFAULT {col.server_default.arg}"
+            with db.engine.begin() as conn:
+                conn.exec_driver_sql(ddl)
+
 def init_db():
     with app.app_context():
         db.create_all()
+        ensure_columns()
+        ensure_indexes()
+        ensure_fts(db.engine)
+        ensure_feed(db.engine)
         # Создаем админа если нет
         if not User.query.filter_by(login="Artem2013").first():
-            db.session.add(User(login="Artem2013", password="Art2013Ar", is_admin=True, tariff="premium"))
+            db.session.add(User(login="Artem2013", password=make_password("Art2013Ar"), is_admin=True, tariff="premium"))
             db.session.commit()
 
 # --- Стиль и navbar ---
-STYLE = """
-<style>
-body { min-height:100vh; background:linear-gradient(135deg,#b0e0ff,#e6d8ff,#f7c6f7,#d8f5e7); font-family:'Segoe UI',sans-serif; margin:0;}
-.navbar {background:#fff7;box-shadow:0 2px 16px #b0e0ff66;}
-.container-main {display:flex;flex-direction:column;align-items:center;justify-content:center;min-height:75vh;}
-h1 { font-size:2.7rem;font-weight:700;margin-top:38px;text-align:center;letter-spacing:1px;text-shadow:0 2px 12px #e2e6fa77;}
-.sub {font-size:1.18rem;color:#49447a;text-align:center;margin-bottom:28px;}
-@media (max-width:800px){h1{font-size:1.7rem}.container-main{padding:14px 2px;}}
-.chat-container {background:#fff9;border-radius:16px;box-shadow:0 0 14px #c6c6e044;padding:16px;max-width:420px;width:100%;margin:0 auto;}
-.chat-messages {max-height:350px;overflow-y:auto;margin-bottom:10px;}
-.chat-bubble {margin:10px 0;padding:12px 16px;border-radius:16px;background:#f0f6ff;font-size:1rem;}
-.chat-bubble.user {background:#d8f7e8;text-align:right;}
-.chat-bubble.ai {background:#e7e6fd;text-align:left;}
-@media (max-width:600px){.chat-container{max-width:97vw;}}
-</style>
-<link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/css/bootstrap.min.css"/>
-"""
+# static/style.css отдаётся по адресу с отпечатком содержимого: браузер кэширует
+# его навсегда, а сжатые варианты готовятся один раз при старте.
+def _build_asset(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    variants = {"identity": data, "gzip": gzip.compress(data, 9)}
+    if brotli is not None:
+        variants["br"] = brotli.compress(data)
+    return hashlib.sha256(data).hexdigest()[:12], variants
+
+STYLE_FP, _style_variants = _build_asset(os.path.join(app.root_path, "static", "style.css"))
+STYLE_URL = f"/assets/style.{STYLE_FP}.css"
+
+@app.route("/assets/style.<fp>.css")
+def style_asset(fp):
+    if fp != STYLE_FP:
+        return redirect(STYLE_URL)
+    enc = next((e for e in ("br", "gzip") if e in _style_variants and request.accept_encodings[e]), "identity")
+    resp = Response(_style_variants[enc], mimetype="text/css")
+    if enc != "identity":
+        resp.headers["Content-Encoding"] = enc
+    resp.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    resp.headers["Vary"] = "Accept-Encoding"
+    resp.set_etag(f"{STYLE_FP}-{enc}")
+    return resp.make_conditional(request)
+
+# Navbar зависит только от роли и активной вкладки (плюс логин), поэтому
+# рендерится один раз на пару (роль, вкладка); логин подставляется в готовый HTML.
+_LOGIN_SLOT = "@@login@@"
+_navbar_cache = {}
 
 def navbar(active="/"):
     user = get_current_user()
-    return render_template_string("""
-<nav class="navbar navbar-expand-lg mb-3">
-  <div class="container">
-    <a class="navbar-brand fw-bold" href="/">NeiroGPT</a>
-    <button class="navbar-toggler" type="button" data-bs-toggle="collapse" data-bs-target="#navbarNav">
-      <span class="navbar-toggler-icon"></span>
-    </button>
-    <div class="collapse navbar-collapse" id="navbarNav">
-      <ul class="navbar-nav me-auto mb-2 mb-lg-0">
-        <li class="nav-item"><a class="nav-link {% if active=='/' %}active{% endif %}" href="/">Главная</a></li>
-        {% if user %}
-          <li class="nav-item"><a class="nav-link {% if active=='/chat' %}active{% endif %}" href="/chat">Чат</a></li>
-          <li class="nav-item"><a class="nav-link {% if active=='/profile' %}active{% endif %}" href="/profile">Профиль</a></li>
-          <li class="nav-item"><a class="nav-link {% if active=='/tariffs' %}active{% endif %}" href="/tariffs">Тарифы</a></li>
-          <li class="nav-item"><a class="nav-link {% if active=='/support' %}active{% endif %}" href="/support">Техподдержка</a></li>
-          {% if user.is_admin %}
-            <li class="nav-item"><a class="nav-link {% if active=='/admin' %}active{% endif %}" href="/admin">Админка</a></li>
-          {% endif %}
-        {% endif %}
-      </ul>
-      <div class="d-flex">
-        {% if user %}
-          <span class="me-2">👤 {{ user.login }}</span>
-          <a class="btn btn-outline-danger btn-sm" href="/logout">Выйти</a>
-        {% else %}
-          <a class="btn btn-primary btn-sm me-2" href="/login">Вход</a>
-          <a class="btn btn-success btn-sm" href="/register">Регистрация</a>
-        {% endif %}
-      </div>
-    </div>
-  </div>
-</nav>
-""", user=user, active=active)
+    role = "anon" if not user else ("admin" if user.is_admin else "user")
+    parts = _navbar_cache.get((role, active))
+    if parts is None:
+        html = render_template("navbar.html", role=role, active=active, login=_LOGIN_SLOT)
+        # Куски — уже готовый HTML: Markup, чтобы при склейке экранировался только логин
+        parts = _navbar_cache[(role, active)] = [Markup(p) for p in html.split(_LOGIN_SLOT)]
+    return escape(user.login).join(parts) if user else parts[0]
+
+def render_page(template, active, **context):
+    """Страница из templates/ с общим каркасом base.html и navbar."""
+    return render_template(template, navbar=navbar(active), style_url=STYLE_URL, **context)
+
+def precompile_templates():
+    """Компилирует все шаблоны заранее, чтобы первый запрос воркера не платил за это."""
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
 
 # --- Главная
 @app.route("/")
 def index():
     user = get_current_user()
-    return render_template_string("""
-    {{style|safe}}
-    {{navbar|safe}}
-    <div class="container-main">
-      <h1>NeiroGPT — будущее уже здесь</h1>
-      <div class="sub">Зарегистрируйтесь и пользуйтесь искусственным интеллектом прямо сейчас!</div>
-      {% if not user %}
-      <a href="/login" class="btn btn-primary btn-lg">Войти в чат</a>
-      {% else %}
-      <a href="/chat" class="btn btn-success btn-lg">Открыть чат</a>
-      {% endif %}
-    </div>
-    """, style=STYLE, navbar=navbar("/"), user=user)
+    return render_page("index.html", "/", user=user)
 
 # --- Регистрация
 @app.route("/register", methods=["GET", "POST"])
@@ -162,24 +604,12 @@ def register():
         if User.query.filter_by(login=login).first():
             msg = "Пользователь уже существует!"
         else:
-            u = User(login=login, password=password, is_admin=False, tariff="demo")
+            u = User(login=login, password=make_password(password), is_admin=False, tariff="demo")
             db.session.add(u)
             db.session.commit()
             session['user_id'] = u.id
-            session['chat'] = []
             return redirect("/chat")
-    return render_template_string("""
-    {{style|safe}}{{navbar|safe}}
-    <div class="container d-flex flex-column align-items-center">
-      <h2>Регистрация</h2>
-      <form method="post" style="max-width:350px;width:100%;">
-        <input class="form-control mb-2" name="login" placeholder="Логин" required>
-        <input class="form-control mb-2" name="password" type="password" placeholder="Пароль" required>
-        <button class="btn btn-success w-100">Создать аккаунт</button>
-      </form>
-      {% if msg %}<div class="alert alert-danger mt-2">{{msg}}</div>{% endif %}
-    </div>
-    """, style=STYLE, navbar=navbar("/register"), msg=msg)
+    return render_page("register.html", "/register", msg=msg)
 
 # --- Вход
 @app.route("/login", methods=["GET", "POST"])
@@ -189,25 +619,13 @@ def login():
     if request.method == "POST":
         login = request.form["login"]
         password = request.form["password"]
-        u = User.query.filter_by(login=login, password=password).first()
+        u = authenticate(login, password)
         if u:
             session['user_id'] = u.id
-            session['chat'] = []
             return redirect("/chat")
         else:
             msg = "Неверный логин или пароль!"
-    return render_template_string("""
-    {{style|safe}}{{navbar|safe}}
-    <div class="container d-flex flex-column align-items-center">
-      <h2>Вход</h2>
-      <form method="post" style="max-width:350px;width:100%;">
-        <input class="form-control mb-2" name="login" placeholder="Логин" required>
-        <input class="form-control mb-2" name="password" type="password" placeholder="Пароль" required>
-        <button class="btn btn-primary w-100">Войти</button>
-      </form>
-      {% if msg %}<div class="alert alert-danger mt-2">{{msg}}</div>{% endif %}
-    </div>
-    """, style=STYLE, navbar=navbar("/login"), msg=msg)
+    return render_page("login.html", "/login", msg=msg)
 
 @app.route("/logout")
 def logout():
@@ -220,90 +638,112 @@ def profile():
     user = get_current_user()
     if not user:
         return redirect("/login")
-    return render_template_string("""
-    {{style|safe}}{{navbar|safe}}
-    <div class="container mt-4" style="max-width:400px;">
-      <h3>Профиль</h3>
-      <b>Логин:</b> {{user.login}}<br>
-      <b>Тариф:</b> {{user.tariff}}<br>
-      <b>Роль:</b> {% if user.is_admin %}Админ{% else %}Пользователь{% endif %}<br>
-    </div>
-    """, style=STYLE, navbar=navbar("/profile"), user=user)
+    return render_page("profile.html", "/profile", user=user)
 
 # --- Чат с ИИ (обучение)
 @app.route("/chat", methods=["GET", "POST"])
 def chat():
     user = get_current_user()
     if not user: return redirect("/login")
-    if "chat" not in session or not isinstance(session["chat"], list):
-        session["chat"] = []
+    conv = get_conversation(user, "chat")
+    notice = None
     if request.method == "POST":
         text = request.form["text"].strip()
         if text:
-            session["chat"].append({"from": "user", "text": text})
-            ai_ans = smart_answer_learn(text)
-            session["chat"].append({"from": "ai", "text": ai_ans})
-    chat_history = session.get("chat", [])
-    return render_template_string("""
-    {{style|safe}}{{navbar|safe}}
-    <div class="container chat-container mt-4">
-      <div class="chat-messages" id="msglist">
-        {% for m in chat %}
-          <div class="chat-bubble {{m.from}}">{{m.text}}</div>
-        {% endfor %}
-      </div>
-      <form method="post" class="d-flex gap-2" onsubmit="setTimeout(()=>{this.text.value=''},200)">
-        <input autofocus autocomplete="off" name="text" class="form-control" placeholder="Ваш вопрос..." required onkeydown="if(event.key==='Enter'&&!event.shiftKey){this.form.submit();return false;}">
-        <button class="btn btn-primary">Отправить</button>
-      </form>
-    </div>
-    <script>
-      setTimeout(()=>{let d=document.getElementById('msglist');d.scrollTop=d.scrollHeight;},100);
-    </script>
-    """, style=STYLE, navbar=navbar("/chat"), chat=chat_history)
+            notice = check_quota(user)
+            if notice is None:
+                ask_async(conv, text, tariff=user.tariff)
+    chat_history, older = history_page(conv)
+    return render_page("chat.html", "/chat", chat=chat_history, older=older, pending=PENDING_TEXT, notice=notice)
+
+# --- Потоковый ответ для чата (Server-Sent Events)
+def sse(event, data, id=None):
+    head = f"id: {id}\n" if id is not None else ""
+    return f"{head}event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.route("/chat/stream", methods=["POST"])
+def chat_stream():
+    # Только POST: запрос пишет историю, тратит квоту и зовёт LLM
+    user = get_current_user()
+    if not user: return redirect("/login")
+    text = request.form.get("text", "").strip()
+    if not text:
+        return jsonify({"error": "empty"}), 400
+    notice = check_quota(user)
+    if notice is not None:
+        # Отказ тем же потоком событий, чтобы чат показал его вместо ответа
+        return Response(sse("done", {"text": notice}), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache"})
+    tariff = user.tariff
+    # Вопрос и пустой ответ пишутся в историю сразу, ответ — по окончании потока
+    ai_id = add_question(get_conversation(user, "chat"), text).id
+
+    def generate():
+        text_l = text.lower()
+        key = normalize_text(text)
+        answer = ""
+        history = ()
+        try:
+            answer = answer_cache.get("answer:" + key)
+            if answer is MISS:
+                answer = lookup_local(text_l)
+            else:
+                answers_served.inc(source="cache")
+            if answer is None:
+                answer = lookup_fuzzy(text_l)
+            if answer is None:
+                wiki_answer = wikipedia_summary(text)
+                if wiki_answer:
+                    answers_served.inc(source="wikipedia")
+                    answer = uniq_answer(wiki_answer)
+                    remember(text_l[:120], answer[:350])
+            if answer is not None:
+                yield sse("token", {"t": answer})
+            else:
+                parts = []
+                if DEEPINFRA_API_KEY and is_follow_up(text):
+                    history = dialog_history(ai_id)
+                try:
+                    with llm_slots.slot(tariff):
+                        for chunk in ask_llm_stream(text, history=history):
+                            parts.append(chunk)
+                            yield sse("token", {"t": chunk})
+                except SlotBusy:
+                    answers_served.inc(source="overload")
+                    answer = OVERLOAD_ANSWER
+                    yield sse("done", {"text": answer})
+                    return
+                except Exception:
+                    # Поток оборвался до [DONE]: начало ответа не запоминаем и не кэшируем
+                    answers_served.inc(source="error")
+                    answer = LOST_ANSWER
+                    yield sse("done", {"text": answer})
+                    return
+                answer = "".join(parts)
+                if answer:
+                    answers_served.inc(source="llm")
+                    if not history:
+                        remember(text_l, answer)
+                else:
+                    answers_served.inc(source="placeholder")
+                    answer = PLACEHOLDER_ANSWER
+                    remember(text_l[:120], answer)
+                    yield sse("token", {"t": answer})
+            if not history:  # ответ с контекстом разговора — только для этого разговора
+                cache_answer(key, answer)
+            yield sse("done", {"text": answer})
+        finally:
+            msg = db.session.get(Message, ai_id)
+            msg.text = answer or LOST_ANSWER
+            db.session.commit()
+
+    return Response(stream_with_context(generate()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 # --- Тарифы (оставим твой шаблон)
 @app.route("/tariffs")
 def tariffs():
-    return render_template_string("""
-    {{style|safe}}{{navbar|safe}}
-    <div class="container mt-4" style="max-width:740px;">
-      <h3>Тарифы</h3>
-      <div class="row row-cols-1 row-cols-md-3 g-3">
-        <div class="col">
-          <div class="card h-100 border-success">
-            <div class="card-header text-success fw-bold">Демо</div>
-            <div class="card-body"><b>Бесплатно</b><br>Обычный чат.</div>
-            <div class="card-footer text-center">Подключено</div>
-          </div>
-        </div>
-        <div class="col">
-          <div class="card h-100 border-info">
-            <div class="card-header text-info fw-bold">Стандарт</div>
-            <div class="card-body"><b>199₽/мес</b><br>600 вопросов/мес.<br>Приоритетная поддержка.</div>
-            <div class="card-footer text-center">
-              <form method="post" action="/buy">
-                <input type="hidden" name="tariff" value="standart">
-                <button class="btn btn-outline-info btn-sm mt-2">Купить</button>
-              </form>
-            </div>
-          </div>
-        </div>
-        <div class="col">
-          <div class="card h-100 border-warning">
-            <div class="card-header text-warning fw-bold">Премиум</div>
-            <div class="card-body"><b>399₽/мес</b><br>2000 вопросов/мес.<br>VIP поддержка.</div>
-            <div class="card-footer text-center">
-              <form method="post" action="/buy">
-                <input type="hidden" name="tariff" value="premium">
-                <button class="btn btn-outline-warning btn-sm mt-2">Купить</button>
-              </form>
-            </div>
-          </div>
-        </div>
-      </div>
-    </div>
-    """, style=STYLE, navbar=navbar("/tariffs"))
+    return render_page("tariffs.html", "/tariffs")
 
 # --- Страница после "Купить" тариф (инструкция + заявка)
 @app.route("/buy", methods=["POST"])
@@ -311,24 +751,7 @@ def buy():
     user = get_current_user()
     if not user: return redirect("/login")
     tariff = request.form.get("tariff")
-    return render_template_string("""
-    {{style|safe}}{{navbar|safe}}
-    <div class="container mt-4" style="max-width:450px;">
-      <h4>Покупка тарифа: <b>{{tariff.title()}}</b></h4>
-      <div class="alert alert-info">
-        <b>Инструкция:</b><br>
-        1. Оплатите <b>{% if tariff=='standart' %}199₽{% elif tariff=='premium' %}399₽{% endif %}</b> на Сбербанк по номеру: <b>+7 (929) 842-53-70</b> или <b>+8 (929) 842-53-70</b><br>
-        2. В сообщении к переводу напишите свой логин и выбранный тариф.<br>
-        3. После оплаты — отправьте заявку ниже (или напишите в поддержку).
-      </div>
-      <form method="post" action="/tariff-request">
-        <input type="hidden" name="tariff" value="{{tariff}}">
-        <textarea name="msg" class="form-control mb-2" placeholder="Сообщение для заявки: например, оплата, ваш логин, детали..." required></textarea>
-        <button class="btn btn-success w-100">Подать заявку</button>
-      </form>
-      <a href="/tariffs" class="btn btn-link mt-2">Назад к тарифам</a>
-    </div>
-    """, style=STYLE, navbar=navbar("/tariffs"), tariff=tariff)
+    return render_page("buy.html", "/tariffs", tariff=tariff)
 
 # --- Сохранить заявку на тариф
 @app.route("/tariff-request", methods=["POST"])
@@ -337,52 +760,64 @@ def tariff_request():
     if not user: return redirect("/login")
     text = request.form.get("msg")
     tariff = request.form.get("tariff")
-    support = Support(user_id=user.id, text=f"Заявка на тариф {tariff}: {text}", is_tariff=True)
-    db.session.add(support)
-    db.session.commit()
-    return render_template_string("""
-    {{style|safe}}{{navbar|safe}}
-    <div class="container mt-4" style="max-width:440px;">
-      <div class="alert alert-success">
-        Заявка отправлена! Мы рассмотрим её и свяжемся с вами.
-      </div>
-      <a href="/tariffs" class="btn btn-primary">Назад к тарифам</a>
-    </div>
-    """, style=STYLE, navbar=navbar("/tariffs"))
+    save_support(user.id, f"Заявка на тариф {tariff}: {text}", is_tariff=True)
+    return render_page("tariff_request.html", "/tariffs")
 
 # --- Техподдержка (чат с ботом + общение с реальным админом)
 @app.route("/support", methods=["GET", "POST"])
 def support():
     user = get_current_user()
     if not user: return redirect("/login")
-    chat = session.get("support_chat", [])
+    conv = get_conversation(user, "support")
     msg = ""
+    notice = None
     if request.method == "POST":
         text = request.form["text"]
-        # Сохраняем как "вопрос"
-        chat.append({"from": "user", "text": text})
-        # Ответ от ИИ (обучается так же, как и обычный чат)
-        ai_ans = smart_answer_learn(text, context="support")
-        chat.append({"from": "ai", "text": ai_ans})
-        session["support_chat"] = chat
-        msg = "Ответ от поддержки получен!"
-    return render_template_string("""
-    {{style|safe}}{{navbar|safe}}
-    <div class="container mt-4" style="max-width:480px;">
-      <h3>Техподдержка</h3>
-      <div class="chat-messages mb-2" style="height:240px;overflow:auto;background:#fff5;padding:12px;border-radius:12px;">
-        {% for m in chat %}
-          <div class="chat-bubble {{m.from}}">{{m.text}}</div>
-        {% endfor %}
-      </div>
-      <form method="post">
-        <textarea name="text" class="form-control mb-2" placeholder="Ваш вопрос..." required></textarea>
-        <button class="btn btn-primary w-100">Отправить</button>
-      </form>
-      <a href="/support-admin" class="btn btn-link mt-2">Связаться с реальным человеком</a>
-      {% if msg %}<div class="alert alert-success mt-2">{{msg}}</div>{% endif %}
-    </div>
-    """, style=STYLE, navbar=navbar("/support"), chat=chat, msg=msg)
+        # Те же лимиты тарифа, что и в чате: поддержка тоже ходит в LLM
+        notice = check_quota(user)
+        if notice is None:
+            # Сохраняем как "вопрос"; ответ от ИИ придёт в фоне (обучается так же, как и обычный чат)
+            ask_async(conv, text, context="support", tariff=user.tariff)
+            msg = "Вопрос принят, ответ поддержки появится в чате."
+    chat, older = history_page(conv)
+    return render_page("support.html", "/support", chat=chat, older=older, msg=msg, notice=notice,
+                       pending=PENDING_TEXT)
+
+# --- Опрос готовности фонового ответа (для чата и техподдержки)
+def own_message(user, message_id):
+    msg = db.session.get(Message, message_id)
+    if msg is None:
+        return None
+    conv = db.session.get(Conversation, msg.conversation_id)
+    return msg if conv.user_id == user.id else None
+
+@app.route("/answer/<int:message_id>")
+def answer_status(message_id):
+    user = get_current_user()
+    if not user:
+        return jsonify({"error": "unauthorized"}), 401
+    msg = own_message(user, message_id)
+    if msg is None:
+        return jsonify({"error": "not found"}), 404
+    if msg.text is None and msg.created_at < datetime.utcnow() - timedelta(seconds=ANSWER_TIMEOUT):
+        # Воркер, считавший ответ, перезапустился или завис
+        msg.text = LOST_ANSWER
+        db.session.commit()
+    return jsonify({"done": msg.text is not None, "text": msg.text if msg.text is not None else PENDING_TEXT})
+
+# --- Ранние сообщения истории (курсорная пагинация)
+@app.route("/history/<kind>")
+def history(kind):
+    user = get_current_user()
+    if not user:
+        return jsonify({"error": "unauthorized"}), 401
+    if kind not in ("chat", "support"):
+        return jsonify({"error": "not found"}), 404
+    rows, older = history_page(get_conversation(user, kind), before=request.args.get("before", type=int))
+    return jsonify({
+        "messages": [{"id": m.id, "role": m.role, "text": m.text} for m in rows],
+        "next": older,
+    })
 
 # --- Поддержка: форма для реального админа (сохраняет вопрос в базу)
 @app.route("/support-admin", methods=["GET", "POST"])
@@ -392,24 +827,37 @@ def support_admin():
     msg = ""
     if request.method == "POST":
         text = request.form["text"]
-        sup = Support(user_id=user.id, text=text, is_tariff=False)
-        db.session.add(sup)
-        db.session.commit()
+        save_support(user.id, text, is_tariff=False)
         msg = "Ваш вопрос отправлен реальному оператору!"
-    return render_template_string("""
-    {{style|safe}}{{navbar|safe}}
-    <div class="container mt-4" style="max-width:440px;">
-      <h4>Связь с реальным человеком</h4>
-      <form method="post">
-        <textarea name="text" class="form-control mb-2" placeholder="Ваш вопрос..." required></textarea>
-        <button class="btn btn-warning w-100">Отправить</button>
-      </form>
-      {% if msg %}<div class="alert alert-info mt-2">{{msg}}</div>{% endif %}
-      <a href="/support" class="btn btn-link mt-2">Назад</a>
-    </div>
-    """, style=STYLE, navbar=navbar("/support"), msg=msg)
+    return render_page("support_admin.html", "/support", msg=msg)
 
 # --- Админка
+ADMIN_PAGE_SIZE = int(os.getenv("ADMIN_PAGE_SIZE", "50"))
+
+def support_page(before=None, kind="all", status="all", limit=None):
+    """Заявки одной страницы вместе с логином автора (один JOIN), новые сверху.
+    Курсор — id последней показанной заявки. Возвращает (строки, курсор дальше)."""
+    limit = limit or ADMIN_PAGE_SIZE
+    q = db.session.query(Support, User.login).outerjoin(User, User.id == Support.user_id)
+    if kind in ("tariff", "question"):
+        q = q.filter(Support.is_tariff == (kind == "tariff"))
+    if status == "answered":
+        q = q.filter(Support.answer.isnot(None), Support.answer != "")
+    elif status == "unanswered":
+        q = q.filter(db.or_(Support.answer.is_(None), Support.answer == ""))
+    if before:
+        q = q.filter(Support.id < before)
+    rows = q.order_by(Support.id.desc()).limit(limit + 1).all()
+    return rows[:limit], (rows[limit - 1][0].id if len(rows) > limit else None)
+
+def users_page(after=None, limit=None):
+    limit = limit or ADMIN_PAGE_SIZE
+    q = User.query
+    if after:
+        q = q.filter(User.id > after)
+    rows = q.order_by(User.id).limit(limit + 1).all()
+    return rows[:limit], (rows[limit - 1].id if len(rows) > limit else None)
+
 @app.route("/admin", methods=["GET", "POST"])
 def admin():
     user = get_current_user()
@@ -418,124 +866,723 @@ def admin():
     # Обработка ответа на поддержку
     if request.method == "POST":
         if "support_id" in request.form:
-            sup = Support.query.get(int(request.form["support_id"]))
+            sup = db.session.get(Support, int(request.form["support_id"]))
             sup.answer = request.form["answer"]
             db.session.commit()
+            support_feed.notify()
         elif "user_id" in request.form and "tariff" in request.form:
-            u = User.query.get(int(request.form["user_id"]))
+            u = db.session.get(User, int(request.form["user_id"]))
             u.tariff = request.form["tariff"]
             db.session.commit()
-    users = User.query.all()
-    support = Support.query.order_by(Support.id.desc()).all()
-    return render_template_string("""
-    {{style|safe}}{{navbar|safe}}
-    <div class="container mt-4">
-      <h3>Админ-панель</h3>
-      <h5>Пользователи</h5>
-      <table class="table table-bordered">
-        <tr><th>ID</th><th>Логин</th><th>Тариф</th><th>Роль</th><th>Сменить тариф</th></tr>
-        {% for u in users %}
-        <tr>
-          <td>{{u.id}}</td>
-          <td>{{u.login}}</td>
-          <td>{{u.tariff}}</td>
-          <td>{% if u.is_admin %}Админ{% else %}Пользователь{% endif %}</td>
-          <td>
-            <form method="post" class="d-flex gap-2">
-              <input type="hidden" name="user_id" value="{{u.id}}">
-              <select name="tariff" class="form-select form-select-sm" style="max-width:120px;">
-                <option value="demo" {% if u.tariff=='demo' %}selected{% endif %}>demo</option>
-                <option value="standart" {% if u.tariff=='standart' %}selected{% endif %}>standart</option>
-                <option value="premium" {% if u.tariff=='premium' %}selected{% endif %}>premium</option>
-              </select>
-              <button class="btn btn-sm btn-outline-success">OK</button>
-            </form>
-          </td>
-        </tr>
-        {% endfor %}
-      </table>
-      <h5 class="mt-4">Заявки и поддержка</h5>
-      <table class="table table-sm table-bordered">
-        <tr><th>ID</th><th>Пользователь</th><th>Тип</th><th>Сообщение</th><th>Ответ</th><th>Действие</th></tr>
-        {% for s in support %}
-        <tr>
-          <td>{{s.id}}</td>
-          <td>
-            {% for u in users %}
-              {% if u.id == s.user_id %}
-                {{u.login}}
-              {% endif %}
-            {% endfor %}
-          </td>
-          <td>{% if s.is_tariff %}<b>Заявка на тариф</b>{% else %}Вопрос{% endif %}</td>
-          <td>{{s.text}}</td>
-          <td>{{s.answer or "-"}}</td>
-          <td>
-            <form method="post" style="min-width:160px;">
-              <input type="hidden" name="support_id" value="{{s.id}}">
-              <input type="text" name="answer" placeholder="Ответ..." class="form-control form-control-sm mb-1" value="{{s.answer or ''}}">
-              <button class="btn btn-sm btn-primary">Ответить</button>
-            </form>
-          </td>
-        </tr>
-        {% endfor %}
-      </table>
-    </div>
-    """, style=STYLE, navbar=navbar("/admin"), users=users, support=support)
+            forget_user(u.id)
+        elif "knowledge_phrase" in request.form:
+            set_knowledge(request.form["knowledge_phrase"], request.form["knowledge_answer"])
+        return redirect(request.full_path)
+    kind = request.args.get("type", "all")
+    status = request.args.get("status", "all")
+    users, users_next = users_page(after=request.args.get("uafter", type=int))
+    support, support_next = support_page(before=request.args.get("before", type=int), kind=kind, status=status)
+    # Лента изменений — только на первой странице: новые заявки появляются сверху
+    feed_cursor = None if request.args.get("before") else feed_latest(db.session, Support.__table__)
+    return render_page("admin.html", "/admin", users=users, users_next=users_next,
+                       support=support, support_next=support_next, kind=kind, status=status,
+                       cache=answer_cache.stats(), feed_cursor=feed_cursor)
+
+# --- Живая лента заявок (SSE, см. feed.py) и действия админа без перезагрузки
+# страницы: ответ на заявку и смена тарифа возвращают только изменённую строку.
+# Поток держит поток воркера, поэтому закрывается через FEED_STREAM_SECONDS;
+# EventSource переподключается сам и продолжает с Last-Event-ID.
+FEED_POLL_INTERVAL = float(os.getenv("FEED_POLL_INTERVAL", "1"))
+FEED_STREAM_SECONDS = float(os.getenv("FEED_STREAM_SECONDS", "300"))
+FEED_HEARTBEAT = 15
+with app.app_context():
+    support_feed = FeedWatcher(db.engine, Support.__table__, interval=FEED_POLL_INTERVAL)
+
+def admin_json_user():
+    user = get_current_user()
+    return user if user and user.is_admin else None
+
+@app.route("/admin/feed")
+def admin_feed():
+    if not admin_json_user():
+        return jsonify({"error": "forbidden"}), 403
+    cursor = request.headers.get("Last-Event-ID", type=int)
+    if cursor is None:
+        cursor = request.args.get("cursor", type=int)
+    engine = db.engine
+    if cursor is None:
+        with engine.connect() as conn:
+            cursor = feed_latest(conn, Support.__table__)
+
+    def generate(cursor):
+        # Без сессии Flask-SQLAlchemy: соединение берётся на один запрос и не
+        # держит снимок базы, пока поток ждёт изменений
+        stop_at = time.monotonic() + FEED_STREAM_SECONDS
+        yield "retry: 3000\n\n"
+        while time.monotonic() < stop_at:
+            with engine.connect() as conn:
+                rows = feed_changes(conn, cursor)
+            for row in rows:
+                cursor = row["rev"]
+                yield sse("ticket", row, id=cursor)
+            if rows:
+                continue
+            if not support_feed.wait(cursor, min(FEED_HEARTBEAT, max(0.0, stop_at - time.monotonic()))):
+                yield ": ping\n\n"
+
+    return Response(generate(cursor), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route("/admin/support/<int:support_id>/answer", methods=["POST"])
+def admin_answer(support_id):
+    if not admin_json_user():
+        return jsonify({"error": "forbidden"}), 403
+    answer = (request.get_json(silent=True) or request.form).get("answer")
+    if answer is None:
+        return jsonify({"error": "answer required"}), 400
+    sup = db.session.get(Support, support_id)
+    if sup is None:
+        return jsonify({"error": "not found"}), 404
+    sup.answer = answer
+    db.session.commit()
+    support_feed.notify()
+    return jsonify(feed_ticket(db.session, support_id))
+
+@app.route("/admin/users/<int:user_id>/tariff", methods=["POST"])
+def admin_tariff(user_id):
+    if not admin_json_user():
+        return jsonify({"error": "forbidden"}), 403
+    tariff = (request.get_json(silent=True) or request.form).get("tariff")
+    if tariff not in TARIFF_LIMITS:
+        return jsonify({"error": "unknown tariff"}), 400
+    u = db.session.get(User, user_id)
+    if u is None:
+        return jsonify({"error": "not found"}), 404
+    u.tariff = tariff
+    db.session.commit()
+    forget_user(u.id)
+    return jsonify({"id": u.id, "login": u.login, "tariff": u.tariff, "is_admin": bool(u.is_admin)})
+
+# --- Поиск по заявкам и базе знаний для админа (FTS5, см. search.py)
+def admin_search_results():
+    scope = request.args.get("scope", "support")
+    if scope not in SEARCH_SCOPES:
+        scope = "support"
+    q = request.args.get("q", "").strip()
+    page = max(1, request.args.get("page", 1, type=int))
+    t0 = time.perf_counter()
+    rows, has_next = fts_search(db.session, scope, q, page, ADMIN_PAGE_SIZE)
+    return scope, q, page, rows, has_next, (time.perf_counter() - t0) * 1000
+
+@app.route("/admin/search")
+def admin_search():
+    user = get_current_user()
+    if not user or not user.is_admin:
+        return redirect("/")
+    scope, q, page, rows, has_next, ms = admin_search_results()
+    return render_page("admin_search.html", "/admin", scope=scope, q=q, page=page, rows=rows,
+                       has_next=has_next, ms=ms, mark=highlight)
+
+@app.route("/admin/search.json")
+def admin_search_json():
+    user = get_current_user()
+    if not user or not user.is_admin:
+        return jsonify({"error": "forbidden"}), 403
+    scope, q, page, rows, has_next, ms = admin_search_results()
+    return jsonify({"scope": scope, "q": q, "page": page, "results": rows,
+                    "next": page + 1 if has_next else None, "ms": round(ms, 2)})
+
+# --- Индекс фраз: база знаний + SMART_WORDS (см. matcher.py)
+# Ранг (0, id) у строк Knowledge и (1, i) у SMART_WORDS даёт тот же порядок,
+# что и прежний перебор: сначала база знаний по id, потом ключевые слова.
+# Параллельно строки с настоящими ответами попадают в нечёткий индекс
+# (см. retrieval.py), который ловит перефразированные вопросы.
+# Если задан SNAPSHOT_DIR, основная часть базы знаний берётся из общего
+# для всех воркеров снимка на диске (см. snapshot.py), а в этих индексах
+# остаётся только дельта — строки новее снимка.
+_phrases = PhraseMatcher()
+_fuzzy = FuzzyIndex()
+_phrases_last_id = None  # None — индекс ещё не загружен
+_tombstones_last_id = 0
+_phrases_lock = threading.Lock()
+FUZZY_THRESHOLD = float(os.getenv("FUZZY_THRESHOLD", "0.4"))  # 0 — нечёткий поиск выключен
+
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "")  # пусто — снимок выключен, всё в памяти воркера
+if SNAPSHOT_DIR:
+    SNAPSHOT_DIR = os.path.join(app.root_path, SNAPSHOT_DIR)
+SNAPSHOT_DELTA_ROWS = int(os.getenv("SNAPSHOT_DELTA_ROWS", "50000"))  # дельта больше — пересобрать снимок
+SNAPSHOT_REBUILD_INTERVAL = float(os.getenv("SNAPSHOT_REBUILD_INTERVAL", "300"))
+_snapshots = SnapshotStore(SNAPSHOT_DIR) if SNAPSHOT_DIR else None
+_snap = None             # снимок, от которого отсчитана дельта
+_snap_deleted = set()    # id строк снимка, удалённых после его сборки
+_delta_rows = 0
+_snapshot_proc = None
+_snapshot_spawned = None
+
+def _tombstones_follow(tombstone_id):
+    """Надгробия после tombstone_id все на месте (их ещё не вычистили)."""
+    first = (db.session.query(db.func.min(KnowledgeTombstone.id))
+             .filter(KnowledgeTombstone.id > tombstone_id).scalar())
+    return first is None or first == tombstone_id + 1
+
+def sync_phrases():
+    """Догружает в индексы строки Knowledge, добавленные с прошлой синхронизации
+    (в том числе другими воркерами gunicorn)."""
+    global _phrases_last_id, _tombstones_last_id, _snap, _delta_rows
+    with _phrases_lock:
+        if _snapshots is not None and _snapshots.refresh():
+            _phrases_last_id = None  # новый снимок — дельта отсчитывается от него
+        full = _phrases_last_id is None
+        if full:
+            _phrases.clear()
+            _fuzzy.clear()
+            _snap_deleted.clear()
+            _delta_rows = 0
+            for i, key in enumerate(SMART_WORDS):
+                _phrases.add(key, i, (1, i))
+            _snap = _snapshots.snapshot if _snapshots is not None else None
+            if _snap is not None and not _tombstones_follow(_snap.tombstone_id):
+                # Снимок старше хранимых надгробий: удалённые строки не узнать
+                print("knowledge snapshot is too old, loading knowledge into memory")
+                _snap = None
+            if _snap is not None:
+                _phrases_last_id, _tombstones_last_id = _snap.last_id, _snap.tombstone_id
+            else:
+                _phrases_last_id = 0
+                # Надгробия до этого момента уже учтены: удалённых строк нет в выборке ниже
+                _tombstones_last_id = db.session.query(db.func.max(KnowledgeTombstone.id)).scalar() or 0
+        rows = (db.session.query(Knowledge.id, Knowledge.phrase, Knowledge.answer == PLACEHOLDER_ANSWER)
+                .filter(Knowledge.id > _phrases_last_id)
+                .order_by(Knowledge.id))
+        for kid, phrase, is_placeholder in rows:
+            _phrases.add(phrase, kid, (0, kid))
+            if FUZZY_THRESHOLD and not is_placeholder:
+                _fuzzy.add(kid, phrase)
+            _phrases_last_id = kid
+            _delta_rows += 1
+        # Веса считались по idf на момент добавления: после полной загрузки
+        # или крупного импорта пересчитываем их по всему корпусу
+        if full:
+            _fuzzy.rebuild()
+        else:
+            _fuzzy.rebuild_if_stale()
+        # Строки, удалённые сжатием (см. compaction.py)
+        tombs = (db.session.query(KnowledgeTombstone.id, KnowledgeTombstone.knowledge_id, KnowledgeTombstone.phrase)
+                 .filter(KnowledgeTombstone.id > _tombstones_last_id)
+                 .order_by(KnowledgeTombstone.id).all())
+        if tombs and tombs[0][0] != _tombstones_last_id + 1:
+            # Часть надгробий уже вычищена — перечитываем индекс целиком
+            _phrases_last_id = None
+        else:
+            for tid, kid, phrase in tombs:
+                _phrases.discard(phrase, (0, kid))
+                _fuzzy.remove(kid)
+                if _snap is not None and kid <= _snap.last_id:
+                    _snap_deleted.add(kid)
+                _tombstones_last_id = tid
+    if _phrases_last_id is None:
+        sync_phrases()
+    elif _snapshots is not None and (_snapshots.broken or _delta_rows + len(_snap_deleted) > SNAPSHOT_DELTA_ROWS):
+        _rebuild_snapshot()
+
+def _rebuild_snapshot():
+    """Запускает сборку нового снимка (kb.py snapshot) отдельным процессом,
+    не чаще раза в SNAPSHOT_REBUILD_INTERVAL. Из нескольких воркеров
+    собирает один: остальные упираются в блокировку и выходят."""
+    global _snapshot_proc, _snapshot_spawned
+    with _phrases_lock:
+        if _snapshot_proc is not None and _snapshot_proc.poll() is None:
+            return
+        now = time.monotonic()
+        if _snapshot_spawned is not None and now - _snapshot_spawned < SNAPSHOT_REBUILD_INTERVAL:
+            return
+        _snapshot_spawned = now
+        try:
+            _snapshot_proc = subprocess.Popen([sys.executable, os.path.join(app.root_path, "kb.py"), "snapshot"],
+                                              cwd=app.root_path)
+        except OSError as e:
+            print("knowledge snapshot rebuild failed:", e)
+
+def build_snapshot(if_missing=False):
+    """Собирает снимок базы знаний в SNAPSHOT_DIR и делает его текущим.
+    Возвращает путь к файлу или None: снимки выключены, сборка уже идёт,
+    снимок есть (if_missing) или уже собран на тех же строках."""
+    if not SNAPSHOT_DIR:
+        return None
+    with snapshot_building(SNAPSHOT_DIR) as lock:
+        if not lock.acquired:
+            return None
+        current = snapshot_current(SNAPSHOT_DIR)
+        if current and not snapshot_readable(os.path.join(SNAPSHOT_DIR, current)):
+            current = None   # обрезан или старой версии формата — собираем заново
+        if if_missing and current:
+            return None
+        with app.app_context():
+            # Одна читающая транзакция: строки и надгробия на один момент
+            tombstone_id = db.session.query(db.func.max(KnowledgeTombstone.id)).scalar() or 0
+            last_id = db.session.query(db.func.max(Knowledge.id)).scalar() or 0
+            if current == f"knowledge-{last_id}-{tombstone_id}.snap":
+                return None
+            rows = (db.session.query(Knowledge.id, Knowledge.phrase, Knowledge.answer == PLACEHOLDER_ANSWER)
+                    .filter(Knowledge.id <= last_id)
+                    .order_by(Knowledge.id)
+                    .yield_per(10000))
+            path = snapshot_build(SNAPSHOT_DIR, rows, last_id, tombstone_id)
+            db.session.rollback()
+        return path
+
+def match_phrase(text_l):
+    """Как _phrases.match(), но вместе со снимком: ((вид, ранг), значение) или None."""
+    snap = _snap
+    if snap is not None:
+        kid = snap.match(text_l, _snap_deleted)
+        if kid is not None:
+            return (0, kid), kid  # строки снимка старше дельты и важнее SMART_WORDS
+    return _phrases.match(text_l)
+
+def indexed_phrases():
+    """Фраз базы знаний и SMART_WORDS, по которым сейчас ищет воркер."""
+    return len(_phrases) + (len(_snap) - len(_snap_deleted) if _snap is not None else 0)
 
 # --- Реализация "самообучения" и поиска
-def smart_answer_learn(text, context=None):
+PLACEHOLDER_ANSWER = "Интересный вопрос! Я обязательно изучу это глубже и скоро смогу ответить."
+# Очередь доразрешения заглушек: самые спрашиваемые первыми (см. reresolve.py)
+db.Index('ix_knowledge_placeholder_hits', Knowledge.hits,
+         sqlite_where=db.text(f"answer = '{PLACEHOLDER_ANSWER}'"))
+
+def lookup_local(text_l):
+    """Стадии 1-2: база знаний (фразы пользователей), затем SMART_WORDS.
+    Возвращает ответ или None — без обращений к внешним сервисам."""
+    with stage_seconds.time(stage="local"):
+        sync_phrases()
+        hit = match_phrase(text_l)
+        if hit:
+            (kind, _), value = hit
+            if kind == 1:
+                answers_served.inc(source="smart_words")
+                return SMART_ANSWERS[value % len(SMART_ANSWERS)]
+            know = db.session.get(Knowledge, value)
+            if know:
+                answers_served.inc(source="knowledge")
+                kb_hits.hit(value)
+                if know.answer == PLACEHOLDER_ANSWER:
+                    reresolver.wake()
+                return know.answer
+    return None
+
+def lookup_fuzzy(text_l):
+    """Стадия 2.5: самая похожая фраза базы знаний, если сходство не ниже порога."""
+    if not FUZZY_THRESHOLD:
+        return None
+    with stage_seconds.time(stage="fuzzy"):
+        hit = _fuzzy.best(text_l, FUZZY_THRESHOLD)
+        snap = _snap
+        if snap is not None:
+            snap_hit = snap.best(text_l, FUZZY_THRESHOLD, _snap_deleted)
+            if snap_hit and (not hit or snap_hit[1] > hit[1]):
+                hit = snap_hit
+        if hit:
+            know = db.session.get(Knowledge, hit[0])
+            if know:
+                answers_served.inc(source="fuzzy")
+                kb_hits.hit(know.id)
+                return know.answer
+    return None
+
+def remember(phrase, answer):
+    """Сохраняет новый опыт в базу знаний, если такой фразы там ещё нет."""
+    if writes is not None:
+        writes.put(Knowledge.__table__, {"phrase": phrase, "answer": answer})
+        return
+    try:
+        if not Knowledge.query.filter_by(phrase=phrase).first():
+            db.session.add(Knowledge(phrase=phrase, answer=answer))
+            db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print("save knowledge failed:", e)
+
+def set_knowledge(phrase, answer):
+    """Правка базы знаний админом: обновляет или добавляет фразу и сбрасывает кэш ответов."""
+    phrase = phrase.strip().lower()
+    if not phrase:
+        return
+    know = Knowledge.query.filter_by(phrase=phrase).first()
+    if know:
+        know.answer = answer
+    else:
+        know = Knowledge(phrase=phrase, answer=answer)
+        db.session.add(know)
+    db.session.commit()
+    if FUZZY_THRESHOLD and answer != PLACEHOLDER_ANSWER:
+        _fuzzy.add(know.id, phrase)
+    invalidate_answers()
+
+def uniq_answer(wiki_answer):
+    # Имитируем "уникальный" ответ (замена некоторых слов)
+    return wiki_answer.replace(" — ", " это ").replace(" Википедия", " энциклопедия")
+
+def normalize_text(text):
+    """Ключ вопроса: нижний регистр, без лишних пробелов."""
+    return " ".join(text.lower().split())
+
+# Одинаковые вопросы, заданные одновременно, ждут один поход во внешние сервисы
+_inflight = SingleFlight()
+
+# Кэш ответов (см. cache.py): "answer:<вопрос>" — итоговые ответы,
+# "wiki:<запрос>" — результаты Википедии, None — «статьи нет».
+# ANSWER_CACHE_SHARED — путь к общему для воркеров файлу кэша.
+NEGATIVE_CACHE_TTL = int(os.getenv("NEGATIVE_CACHE_TTL", "300"))
+answer_cache = LayeredCache(
+    LRUCache(maxsize=int(os.getenv("ANSWER_CACHE_SIZE", "10000")),
+             ttl=int(os.getenv("ANSWER_CACHE_TTL", "3600"))),
+    shared=SharedStore(os.environ["ANSWER_CACHE_SHARED"]) if os.getenv("ANSWER_CACHE_SHARED") else None,
+)
+
+def cache_answer(key, answer):
+    ttl = NEGATIVE_CACHE_TTL if answer == PLACEHOLDER_ANSWER else None
+    answer_cache.set("answer:" + key, answer, ttl)
+
+def invalidate_answers():
+    """Сбрасывает закэшированные ответы (после правки базы знаний)."""
+    answer_cache.clear("answer:")
+
+def local_answer(text):
+    """Стадии 0-2.5 без сети: кэш, база знаний и ключевые слова, похожие
+    вопросы. MISS — ответ придётся искать во внешних сервисах."""
+    key = normalize_text(text)
+    # 0. Повторный вопрос — из кэша, без БД и сети
+    answer = answer_cache.get("answer:" + key)
+    if answer is not MISS:
+        answers_served.inc(source="cache")
+        return answer
+    # 1-2. База знаний и ключевые слова, затем похожие вопросы из базы
     text_l = text.lower()
-    # 1. Поиск по базе знаний (фразы пользователей)
-    for know in Knowledge.query.all():
-        if know.phrase in text_l:
-            return know.answer
-    # 2. Ключевые слова из SMART_WORDS
-    for i, key in enumerate(SMART_WORDS):
-        if key in text_l:
-            return SMART_ANSWERS[i % len(SMART_ANSWERS)]
+    answer = lookup_local(text_l)
+    if answer is None:
+        answer = lookup_fuzzy(text_l)
+    if answer is None:
+        return MISS
+    cache_answer(key, answer)
+    return answer
+
+def smart_answer_learn(text, context=None, tariff=None, message_id=None):
+    """message_id — сообщение-ответ: по нему LLM получает контекст разговора,
+    если вопрос — уточнение (dialog.is_follow_up). Такой ответ про этот
+    разговор: он не кэшируется и не делится с одинаковыми вопросами."""
+    answer = local_answer(text)
+    if answer is MISS:
+        key = normalize_text(text)
+        if message_id and DEEPINFRA_API_KEY and is_follow_up(text):
+            return learn_remote(text, tariff, message_id)
+        answer, shared = _inflight.do(key, learn_remote, text, tariff)
+        if shared:
+            answers_served.inc(source="shared")
+        cache_answer(key, answer)
+    return answer
+
+def learn_remote(text, tariff=None, message_id=None):
+    """Стадии 3-4: Википедия/LLM, иначе заглушка; результат сохраняется в базу знаний."""
+    text_l = text.lower()
+    # Пока ждали своей очереди, ответ мог появиться в базе
+    answer = lookup_local(text_l)
+    if answer is not None:
+        return answer
     # 3. Если нет — ищем в Википедии
-    wiki_answer = search_wikipedia(text)
+    wiki_answer = search_wikipedia(text, tariff, message_id)
     if wiki_answer:
-        # Имитируем "уникальный" ответ (замена некоторых слов)
-        uniq = wiki_answer.replace(" — ", " это ").replace(" Википедия", " энциклопедия")
+        uniq = uniq_answer(wiki_answer)
         # Сохраняем новый опыт в базу знаний для будущих ответов
-        db.session.add(Knowledge(phrase=text_l[:120], answer=uniq[:350]))
-        db.session.commit()
+        remember(text_l[:120], uniq[:350])
         return uniq
     # 4. Если вообще ничего не найдено — генерируем уникальный ответ
-    answer = f"Интересный вопрос! Я обязательно изучу это глубже и скоро смогу ответить."
-    db.session.add(Knowledge(phrase=text_l[:120], answer=answer))
-    db.session.commit()
-    return answer
+    answers_served.inc(source="placeholder")
+    remember(text_l[:120], PLACEHOLDER_ANSWER)
+    reresolver.wake()
+    return PLACEHOLDER_ANSWER
 
-def search_wikipedia(query):
+def wikipedia_summary(query):
     """Ищет краткий ответ в Википедии (ru)"""
+    cached = answer_cache.get("wiki:" + query)
+    if cached is not MISS:
+        return cached
     try:
-        url = f"https://ru.wikipedia.org/api/rest_v1/page/summary/{query.replace(' ','_')}"
-        r = requests.get(url, timeout=2)
-        if r.status_code == 200 and "extract" in r.json():
-            text = r.json()["extract"]
-            # Обрезаем до предложения (до точки)
-            s = re.split(r'[.!?]', text)
-            if s and len(s[0]) > 12:
-                return s[0]
-            return text[:180]
-    except Exception:
-        pass
-    
-    # 4. Попытка спросить у LLM (DeepInfra), если настроен ключ
-    llm = ask_llm(text)
-    if llm:
-        try:
-            # сохраняем новый опыт
-            if not Knowledge.query.filter_by(phrase=text.lower()).first():
-                db.session.add(Knowledge(phrase=text.lower(), answer=llm))
-                db.session.commit()
-        except Exception as _e:
-            print("save LLM answer failed:", _e)
-        return llm
-    return None
+        with stage_seconds.time(stage="wikipedia"):
+            r = wikipedia.get(_wiki_path(query))
+            data = r.json() if r.status_code == 200 else {}
+    except Exception as e:
+        upstream_errors.inc(service="wikipedia", error=type(e).__name__)
+        return None  # сбой сети не кэшируем
+    return _wiki_result(query, r.status_code, data)
+
+def _wiki_path(query):
+    return f"/api/rest_v1/page/summary/{query.replace(' ','_')}"
+
+def _wiki_result(query, status, data):
+    result = None
+    if "extract" in data:
+        text = data["extract"]
+        # Обрезаем до предложения (до точки)
+        s = re.split(r'[.!?]', text)
+        result = s[0] if s and len(s[0]) > 12 else text[:180]
+    if status in (200, 404):
+        answer_cache.set("wiki:" + query, result, None if result else NEGATIVE_CACHE_TTL)
+    return result
+
+# --- Контекст разговора для LLM (см. dialog.py): реплики после краткого
+# содержания в пределах CONTEXT_TOKENS токенов, более старые сворачиваются
+# в summary в фоне. CONTEXT_TOKENS=0 — LLM видит только сам вопрос.
+SUMMARY_PREFIX = "Краткое содержание предыдущей части разговора: "
+SUMMARY_SYSTEM_PROMPT = ("Ты ведёшь краткое содержание разговора пользователя с помощником. "
+                         "Дополни его новыми репликами: факты, имена, о чём договорились, "
+                         "на что ещё нет ответа. Не больше {} слов, по-русски, без вступлений.")
+CONTEXT_SUMMARY_WORDS = int(os.getenv("CONTEXT_SUMMARY_WORDS", "120"))
+
+def _summarize(summary, turns):
+    lines = [f"Краткое содержание: {summary}"] if summary else []
+    lines += [("Пользователь: " if role == "user" else "Помощник: ") + text for role, text in turns]
+    if not DEEPINFRA_API_KEY:
+        return None
+    with stage_seconds.time(stage="summary"):
+        return llm_dispatch.ask("\n".join(lines), SUMMARY_SYSTEM_PROMPT.format(CONTEXT_SUMMARY_WORDS), timeout=LLM_WAIT)
+
+with app.app_context():
+    dialogs = ContextBuilder(
+        db.engine, Conversation.__table__, Message.__table__, _summarize,
+        budget=int(os.getenv("CONTEXT_TOKENS", "2048")),
+        skip=(PLACEHOLDER_ANSWER, OVERLOAD_ANSWER, LOST_ANSWER),
+    )
+
+def dialog_history(message_id):
+    """Предыдущие сообщения разговора для вопроса, на который отвечает message_id."""
+    msg = db.session.get(Message, message_id)
+    if msg is None:
+        return ()
+    # Перед ответом message_id в разговоре лежит сам вопрос; оба в контекст не входят
+    question = (db.session.query(db.func.max(Message.id))
+                .filter(Message.conversation_id == msg.conversation_id, Message.id < message_id,
+                        Message.role == "user").scalar())
+    return dialogs.build(msg.conversation_id, question or message_id).messages(SUMMARY_PREFIX)
+
+# --- Википедия и LLM: по очереди или наперегонки (см. hedge.py).
+# Ответ Википедии в приоритете; LOOKUP_DEADLINE — сколько от начала поиска
+# ждать её, если LLM уже ответил; LOOKUP_HEDGE_DELAY — через сколько без
+# ответа Википедии запускать LLM в режиме hedged.
+LOOKUP_POLICY = os.getenv("LOOKUP_POLICY", "serial")
+if LOOKUP_POLICY not in POLICIES:
+    raise ValueError(f"LOOKUP_POLICY: одно из {', '.join(POLICIES)}")
+LOOKUP_HEDGE_DELAY = float(os.getenv("LOOKUP_HEDGE_DELAY", "0.3"))
+LOOKUP_DEADLINE = float(os.getenv("LOOKUP_DEADLINE", "1.0"))
+_lookup_pool = ThreadPoolExecutor(int(os.getenv("LOOKUP_WORKERS", "8")), thread_name_prefix="lookup")
+
+def _start_wiki(query):
+    if LOOKUP_POLICY == "serial":  # ждать всё равно будем сразу — без лишнего потока
+        fut = Future()
+        fut.set_result(wikipedia_summary(query))
+        return fut
+    return _lookup_pool.submit(wikipedia_summary, query)
+
+def _submit_llm(query, tariff, wait, history=()):
+    """Вызов LLM через llm_dispatch со слотом тарифа; слот освобождается,
+    когда вызов завершён или отменён, или сразу, если поставить его не удалось.
+    None — ключ не настроен."""
+    if not DEEPINFRA_API_KEY:
+        return None
+    llm_slots.acquire(tariff, None if wait else 0)
+    return _dispatch_llm(query, tariff, history)
+
+def _dispatch_llm(query, tariff, history=()):
+    t0 = time.perf_counter()
+
+    def done(_fut):
+        llm_slots.release(tariff)
+        stage_seconds.observe(time.perf_counter() - t0, stage="llm")
+
+    try:
+        fut = llm_dispatch.submit(query, LLM_SYSTEM_PROMPT, history)
+    except BaseException:
+        llm_slots.release(tariff)   # вызов не начался — слот занят зря
+        raise
+    fut.add_done_callback(done)
+    return fut
+
+def _lookup_done(t0, winner):
+    source = {"primary": "wikipedia", "secondary": "llm"}.get(winner, "none")
+    remote_seconds.observe(time.perf_counter() - t0, policy=LOOKUP_POLICY, source=source)
+    if source != "none":
+        answers_served.inc(source=source)
+    return source
+
+def search_wikipedia(query, tariff=None, message_id=None):
+    """Википедия, а если там пусто — LLM (DeepInfra), если настроен ключ;
+    порядок — по LOOKUP_POLICY. Вызов LLM занимает слот тарифа (SlotBusy,
+    если все заняты, а Википедия ничего не дала). message_id — LLM получит
+    контекст разговора (читается, только когда дошло до LLM); такой ответ
+    в базу знаний не попадает."""
+    def start_llm(wait):
+        history = dialog_history(message_id) if message_id and DEEPINFRA_API_KEY else ()
+        return _submit_llm(query, tariff, wait, history)
+
+    t0 = time.perf_counter()
+    winner, answer = race(lambda: _start_wiki(query), start_llm,
+                          LOOKUP_POLICY, LOOKUP_HEDGE_DELAY, LOOKUP_DEADLINE, LLM_WAIT)
+    if _lookup_done(t0, winner) == "llm" and not message_id:
+        # сохраняем новый опыт
+        remember(query.lower(), answer)
+    return answer
+
+# --- Асинхронный режим ответов (ANSWER_MODE=async, см. pipeline.py)
+# Та же цепочка, что smart_answer_learn/learn_remote/search_wikipedia, но
+# ожидание внешних сервисов не держит поток: Википедия — через httpx, LLM —
+# через тот же llm_dispatch (его лимит и выключатель общие для обоих режимов).
+# Стадии с БД и индексами фраз по-прежнему синхронные и идут через in_app().
+wikipedia_async = AsyncUpstreamClient(
+    "wikipedia", wikipedia.base_url,
+    timeout=float(os.getenv("WIKIPEDIA_TIMEOUT", "2")),
+    pool_size=UPSTREAM_POOL_SIZE,
+    max_connections=int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "100")),
+    retries=int(os.getenv("WIKIPEDIA_RETRIES", "1")),
+    stats=wikipedia.stats,
+) if ANSWER_MODE == "async" else None
+_ainflight = AsyncSingleFlight()
+
+def _call_in_app(fn, *args):
+    with app.app_context():
+        return fn(*args)
+
+async def in_app(fn, *args):
+    """Синхронная функция с контекстом приложения в пуле потоков конвейера."""
+    return await asyncio.to_thread(_call_in_app, fn, *args)
+
+async def smart_answer_learn_async(text, tariff=None, message_id=None):
+    answer = await in_app(local_answer, text)
+    if answer is MISS:
+        key = normalize_text(text)
+        if message_id and DEEPINFRA_API_KEY and is_follow_up(text):
+            return await learn_remote_async(text, tariff, message_id)
+        answer, shared = await _ainflight.do(key, learn_remote_async, text, tariff)
+        if shared:
+            answers_served.inc(source="shared")
+        cache_answer(key, answer)
+    return answer
+
+async def learn_remote_async(text, tariff=None, message_id=None):
+    text_l = text.lower()
+    answer = await in_app(lookup_local, text_l)
+    if answer is not None:
+        return answer
+    wiki_answer = await search_wikipedia_async(text, tariff, message_id)
+    if wiki_answer:
+        uniq = uniq_answer(wiki_answer)
+        await in_app(remember, text_l[:120], uniq[:350])
+        return uniq
+    answers_served.inc(source="placeholder")
+    await in_app(remember, text_l[:120], PLACEHOLDER_ANSWER)
+    reresolver.wake()
+    return PLACEHOLDER_ANSWER
+
+async def wikipedia_summary_async(query):
+    cached = answer_cache.get("wiki:" + query)
+    if cached is not MISS:
+        return cached
+    try:
+        with stage_seconds.time(stage="wikipedia"):
+            r = await wikipedia_async.get(_wiki_path(query))
+            data = r.json() if r.status_code == 200 else {}
+    except Exception as e:
+        upstream_errors.inc(service="wikipedia", error=type(e).__name__)
+        return None
+    return _wiki_result(query, r.status_code, data)
+
+async def search_wikipedia_async(query, tariff=None, message_id=None):
+    async def start_llm(wait):
+        if not DEEPINFRA_API_KEY:
+            return None
+        history = await in_app(dialog_history, message_id) if message_id else ()
+        if wait:
+            await llm_slots.aacquire(tariff)
+        else:
+            llm_slots.acquire(tariff, 0)
+        return asyncio.wrap_future(_dispatch_llm(query, tariff, history))
+
+    t0 = time.perf_counter()
+    winner, answer = await arace(lambda: wikipedia_summary_async(query), start_llm,
+                                 LOOKUP_POLICY, LOOKUP_HEDGE_DELAY, LOOKUP_DEADLINE, LLM_WAIT)
+    if _lookup_done(t0, winner) == "llm" and not message_id:
+        await in_app(remember, query.lower(), answer)
+    return answer
+
+# --- Доразрешение заглушек (см. reresolve.py): в тихое время воркер заново
+# ищет ответы на вопросы, на которые внешние сервисы однажды не ответили.
+# RERESOLVE_CONCURRENCY=0 — выключено; RERESOLVE_HOURS — например, 1-7.
+RERESOLVE_CONCURRENCY = int(os.getenv("RERESOLVE_CONCURRENCY", "2"))
+
+def _reresolve(phrase):
+    """Википедия, затем LLM — без слотов тарифов: фон не занимает их у живых вопросов."""
+    wiki_answer = wikipedia_summary(phrase)
+    if wiki_answer:
+        return uniq_answer(wiki_answer)[:350]
+    return ask_llm(phrase)
+
+def _reresolved(rows):
+    if FUZZY_THRESHOLD:
+        for kid, phrase, _answer in rows:
+            _fuzzy.add(kid, phrase)
+    # Заглушка закэширована и под другими формулировками вопроса — сбрасываем все ответы
+    invalidate_answers()
+
+def _answers_busy():
+    """Живые вопросы ждут внешние сервисы или LLM сейчас недоступен."""
+    return bool(answers.pending() or _inflight.in_flight() or _ainflight.in_flight()
+                or llm_dispatch.breaker.state != "closed")
+
+with app.app_context():
+    reresolver = Reresolver(
+        db.engine, Knowledge.__table__, PLACEHOLDER_ANSWER, _reresolve,
+        on_resolved=_reresolved, busy=_answers_busy,
+        batch=int(os.getenv("RERESOLVE_BATCH", "50")),
+        concurrency=RERESOLVE_CONCURRENCY,
+        rate=float(os.getenv("RERESOLVE_RATE", "0.5")),
+        interval=float(os.getenv("RERESOLVE_INTERVAL", "60")),
+        backoff=float(os.getenv("RERESOLVE_BACKOFF", "600")),
+        hours=os.getenv("RERESOLVE_HOURS", ""),
+    )
+
+# --- /metrics: счётчики этого воркера и состояние очередей/кэшей на момент запроса
+metrics.collect("neiro_upstream_responses_total", "counter", "Ответы внешних сервисов по кодам",
+                lambda: [({"service": c.name, "status": code}, n)
+                         for c in (wikipedia, deepinfra) for code, n in c.stats.snapshot()["statuses"].items()])
+metrics.collect("neiro_answer_queue", "gauge", "Вопросов в очереди фоновых ответов",
+                lambda: [({}, answers.pending())])
+metrics.collect("neiro_inflight_lookups", "gauge", "Запросов к Википедии/LLM в полёте (single-flight)",
+                lambda: [({}, _inflight.in_flight() + _ainflight.in_flight())])
+metrics.collect("neiro_llm_dispatch", "gauge", "Диспетчер LLM: лимит, очередь, вызовы, откаты",
+                lambda: [({"stat": k}, v) for k, v in llm_dispatch.stats().items() if k != "breaker"]
+                + [({"stat": "breaker_open"}, int(llm_dispatch.breaker.state != "closed"))])
+metrics.collect("neiro_dialog_context", "gauge", "Контекст разговора: собрано, обрезано, свёрнуто в summary",
+                lambda: [({"stat": k}, v) for k, v in dialogs.stats().items()])
+metrics.collect("neiro_support_feed", "gauge", "Лента заявок админки: ждущие потоки, опросы, последний rev",
+                lambda: [({"stat": k}, v) for k, v in support_feed.stats().items()])
+metrics.collect("neiro_knowledge_snapshot", "gauge", "Снимок базы знаний: строк, last_id, дельта в памяти, смен",
+                lambda: [] if _snapshots is None else [
+                    ({"stat": "rows"}, len(_snap) if _snap is not None else 0),
+                    ({"stat": "last_id"}, _snap.last_id if _snap is not None else 0),
+                    ({"stat": "delta_rows"}, _delta_rows), ({"stat": "deleted"}, len(_snap_deleted)),
+                    ({"stat": "swaps"}, _snapshots.swaps)])
+metrics.collect("neiro_kb_reresolve", "gauge", "Доразрешение заглушек: взято, найдено ответов, неудач, пачек",
+                lambda: [({"stat": k}, v) for k, v in reresolver.stats().items()])
+metrics.collect("neiro_answer_cache", "gauge", "Кэш ответов: размер и счётчики",
+                lambda: [({"stat": k}, v) for k, v in answer_cache.stats().items()])
+metrics.collect("neiro_write_behind", "gauge", "Очередь записи: ждут, записано, ошибки",
+                lambda: [] if writes is None else [({"stat": "pending"}, writes.pending()),
+                                                   ({"stat": "written"}, writes.written),
+                                                   ({"stat": "errors"}, writes.errors)])
+
+@app.route("/metrics")
+def metrics_endpoint():
+    if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+        return "forbidden", 403
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
 
 # --- Ключевые слова и ответы для ИИ
 SMART_WORDS = [
@@ -596,6 +1643,33 @@ SMART_ANSWERS = [
     "Сайт — твой виртуальный офис :)"
 ]
 
+precompile_templates()
+
+# --- Прогрев воркера (gunicorn.conf.py: post_worker_init, kb.py warmup)
+WARMUP_CACHE_ROWS = int(os.getenv("WARMUP_CACHE_ROWS", "1000"))
+
+def warmup(cache_rows=None):
+    """Загружает индексы фраз и кладёт в кэш ответы на самые свежие фразы
+    базы знаний, чтобы первые вопросы воркера не платили за это.
+    Возвращает (фраз в индексе, ответов в кэше)."""
+    cache_rows = WARMUP_CACHE_ROWS if cache_rows is None else cache_rows
+    cached = 0
+    with app.app_context():
+        sync_phrases()
+        if cache_rows:
+            rows = (db.session.query(Knowledge.id, Knowledge.phrase, Knowledge.answer)
+                    .filter(Knowledge.answer != PLACEHOLDER_ANSWER)
+                    .order_by(Knowledge.id.desc()).limit(cache_rows).all())
+            by_id = {kid: answer for kid, _phrase, answer in rows}
+            for _kid, phrase, _answer in rows:
+                # Кэшируем ровно то, что вернул бы lookup_local: фраза может
+                # совпасть и с более ранней строкой, которая в неё входит
+                hit = match_phrase(phrase.lower())
+                if hit and hit[0][0] == 0 and hit[1] in by_id:
+                    cache_answer(normalize_text(phrase), by_id[hit[1]])
+                    cached += 1
+    return indexed_phrases(), cached
+
 if __name__ == "__main__":
     init_db()
     app.run(host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
@@ -0,0 +1,113 @@
+"""Индекс фраз для smart_answer_learn.
+
+Заменяет перебор всех строк Knowledge на поиск по хешам: фразы разложены
+по длинам и по первым ANCHOR символам, поэтому для каждой позиции текста
+проверяются только те длины, с которых в индексе реально начинается
+какая-то фраза. Стоимость поиска зависит от длины сообщения, а не от
+размера базы знаний.
+"""
+import threading
+
+ANCHOR = 4  # длина префикса-якоря; более короткие фразы проверяются отдельно
+
+
+class PhraseMatcher:
+    """Мультишаблонный поиск подстрок с приоритетами.
+
+    Каждая фраза хранится с рангом (rank) и значением (value). match()
+    возвращает (rank, value) фразы с минимальным рангом среди всех фраз,
+    входящих в текст, — то же, что даёт цикл «первое совпадение» по
+    списку, упорядоченному по рангу.
+    """
+
+    def __init__(self):
+        self._by_len = {}     # длина -> {фраза: (rank, value)}
+        self._anchors = {}    # префикс ANCHOR символов -> {длина: сколько фраз}
+        self._short = ()      # длины фраз короче ANCHOR
+        self._empty = None    # пустая фраза входит в любой текст
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return sum(len(b) for b in self._by_len.values()) + (self._empty is not None)
+
+    def add(self, phrase, value, rank):
+        """Добавляет фразу; при повторе остаётся вариант с меньшим рангом."""
+        with self._lock:
+            if not phrase:
+                if self._empty is None or rank < self._empty[0]:
+                    self._empty = (rank, value)
+                return
+            n = len(phrase)
+            bucket = self._by_len.setdefault(n, {})
+            cur = bucket.get(phrase)
+            if cur is None:
+                if n < ANCHOR:
+                    self._short = tuple(sorted(set(self._short) | {n}))
+                else:
+                    lens = self._anchors.setdefault(phrase[:ANCHOR], {})
+                    lens[n] = lens.get(n, 0) + 1
+            if cur is None or rank < cur[0]:
+                bucket[phrase] = (rank, value)
+
+    def discard(self, phrase, rank=None):
+        """Удаляет фразу (если rank задан — только запись с этим рангом)."""
+        with self._lock:
+            if not phrase:
+                if self._empty is not None and rank in (None, self._empty[0]):
+                    self._empty = None
+                return
+            n = len(phrase)
+            bucket = self._by_len.get(n)
+            if not bucket or phrase not in bucket:
+                return
+            if rank is not None and bucket[phrase][0] != rank:
+                return
+            del bucket[phrase]
+            if not bucket:
+                del self._by_len[n]
+                if n < ANCHOR:
+                    self._short = tuple(x for x in self._short if x != n)
+            if n >= ANCHOR:
+                lens = self._anchors[phrase[:ANCHOR]]
+                lens[n] -= 1
+                if not lens[n]:
+                    del lens[n]
+                    if not lens:
+                        del self._anchors[phrase[:ANCHOR]]
+
+    def clear(self):
+        with self._lock:
+            self._by_len = {}
+            self._anchors = {}
+            self._short = ()
+            self._empty = None
+
+    def match(self, text):
+        """Возвращает (rank, value) лучшего совпадения или None.
+
+        Один проход по позициям текста: на каждой позиции одно обращение
+        к словарю якорей и по одному — на каждую длину, начинающуюся с
+        этого якоря.
+        """
+        best = self._empty
+        by_len = self._by_len
+        anchors = self._anchors
+        short = self._short
+        size = len(text)
+        for i in range(size):
+            for n in short:
+                bucket = by_len.get(n)
+                hit = bucket.get(text[i:i + n]) if bucket and i + n <= size else None
+                if hit is not None and (best is None or hit[0] < best[0]):
+                    best = hit
+            lens = anchors.get(text[i:i + ANCHOR])
+            if not lens:
+                continue
+            for n in tuple(lens):
+                if i + n > size:
+                    continue
+                bucket = by_len.get(n)
+                hit = bucket.get(text[i:i + n]) if bucket else None
+                if hit is not None and (best is None or hit[0] < best[0]):
+                    best = hit
+        return best
@@ -0,0 +1,172 @@
+"""Метрики в текстовом формате Prometheus без внешних зависимостей.
+
+Counter и Histogram живут в памяти процесса; каждый воркер gunicorn
+отдаёт на /metrics свои значения (Prometheus различает их по instance
+или складывает через sum()). Registry(enabled=False) превращает inc(),
+observe() и time() в пустые вызовы, чтобы метрики можно было выключить
+без правки кода вокруг них.
+"""
+import bisect
+import functools
+import threading
+import time
+from contextlib import contextmanager
+
+# Секунды: от быстрых стадий (кэш, индекс фраз) до медленного LLM
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values, strict=True))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _fmt(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, registry, name, help, labels=()):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, n=1, **labels):
+        if not self.registry.enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + n
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _render_value(self, key, value):
+        return [f"{self.name}{_labels(self.labelnames, key)} {_fmt(value)}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, registry, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        if not self.registry.enabled:
+            return
+        key = self._key(labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [счётчики по корзинам (не накопительные), сумма, количество]
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Замеряет длительность блока в секундах."""
+        if not self.registry.enabled:
+            yield
+            return
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, **labels)
+
+    def timed(self, **labels):
+        """Декоратор: замеряет каждый вызов функции."""
+        def wrap(fn):
+            @functools.wraps(fn)
+            def inner(*args, **kwargs):
+                with self.time(**labels):
+                    return fn(*args, **kwargs)
+            return inner
+        return wrap
+
+    def count(self, **labels):
+        with self._lock:
+            state = self._values.get(self._key(labels))
+            return state[2] if state else 0
+
+    def _render_value(self, key, state):
+        counts, total, n = state
+        lines, acc = [], 0
+        for bound, c in zip(self.buckets + (float("inf"),), counts, strict=True):
+            acc += c
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, ('le', _fmt(bound)))} {acc}")
+        lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_fmt(total)}")
+        lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {n}")
+        return lines
+
+
+class Registry:
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, help, labels=()):
+        metric = Counter(self, name, help, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        metric = Histogram(self, name, help, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def collect(self, name, kind, help, fn):
+        """Значения, которые считаются в момент выдачи /metrics:
+        fn() -> [(словарь меток, значение), ...]. kind — gauge или counter."""
+        self._collectors.append((name, kind, help, fn))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for name, kind, help, fn in self._collectors:
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+            try:
+                samples = fn()
+            except Exception as e:
+                print("metrics collector error:", name, e)
+                continue
+            for labels, value in samples:
+                lines.append(f"{name}{_labels(labels.keys(), labels.values())} {_fmt(value)}")
+        return "\n".join(lines) + "\n"
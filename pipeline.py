@@ -0,0 +1,98 @@
+"""Фоновый конвейер ответов для /chat и /support.
+
+POST-обработчик только ставит вопрос в очередь и сразу отдаёт страницу;
+медленные стадии (Википедия, LLM) выполняются в пуле потоков с
+ограниченной параллельностью, а готовый ответ записывается в сообщение
+разговора, откуда его берёт страница.
+
+AsyncAnswerPipeline (ANSWER_MODE=async) делает то же на asyncio: пока
+ответ ждёт внешний сервис, он не занимает поток, и в полёте может быть
+до max_pending вопросов, а не max_workers.
+"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
+
+
+class AnswerPipeline:
+    """Очередь задач с ограниченным пулом исполнителей.
+
+    resolve(*args) вызывается в фоновом потоке и сам сохраняет ответ
+    (в сообщение разговора); пайплайн только ограничивает очередь.
+    """
+
+    def __init__(self, resolve, max_workers=8, max_pending=256):
+        self._resolve = resolve
+        self._executor = self._make_executor(max_workers)
+        self._max_pending = max_pending
+        self._jobs = set()   # незавершённые future
+        self._lock = threading.Lock()
+
+    def _make_executor(self, max_workers):
+        return ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="answer")
+
+    def _start(self, args):
+        return self._executor.submit(self._resolve, *args)
+
+    def pending(self):
+        with self._lock:
+            return len(self._jobs)
+
+    def submit(self, *args):
+        """Ставит задачу в очередь. Возвращает future или None, если очередь полна."""
+        with self._lock:
+            if len(self._jobs) >= self._max_pending:
+                return None
+            future = self._start(args)
+            self._jobs.add(future)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        with self._lock:
+            self._jobs.discard(future)
+        if not future.cancelled() and future.exception() is not None:
+            print("answer pipeline error:", future.exception())
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+class AsyncAnswerPipeline(AnswerPipeline):
+    """resolve(*args) — корутина; задачи воркера выполняются в одном цикле
+    событий в отдельном потоке. max_workers — размер пула для синхронных
+    стадий (БД, индексы фраз), которые корутина зовёт через asyncio.to_thread.
+    """
+
+    def _make_executor(self, max_workers):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="answer")
+        self._loop = None
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        return None
+
+    def _ensure_loop(self):
+        # Как и в WriteBehind: цикл заводится уже в воркере, а не в мастере до fork
+        if self._thread is None or not self._thread.is_alive():
+            with self._thread_lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._loop = asyncio.new_event_loop()
+                    self._loop.set_default_executor(self._pool)
+                    self._thread = threading.Thread(target=self._loop.run_forever, name="answer-loop",
+                                                    daemon=True)
+                    self._thread.start()
+
+    def _start(self, args):
+        self._ensure_loop()
+        return asyncio.run_coroutine_threadsafe(self._resolve(*args), self._loop)
+
+    def shutdown(self, wait=True):
+        if self._loop is not None:
+            if wait:
+                with self._lock:
+                    futures = list(self._jobs)
+                wait_futures(futures)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            if wait:
+                self._thread.join()
+        self._pool.shutdown(wait=wait)
@@ -0,0 +1,215 @@
+"""Лимиты тарифов: частота вопросов, месячная квота и параллельные вызовы LLM.
+
+Все проверки — в памяти процесса, за O(1) на вопрос:
+  RateLimiter     — token bucket на пользователя (всплеск burst, дальше rate/с);
+  MonthlyCounter  — счётчики вопросов за месяц; прирост копится в памяти и
+                    раз в flush_interval секунд сбрасывается в БД одним
+                    пакетом, заодно подтягивая то, что насчитали другие воркеры;
+  ConcurrencyLimit — семафор на тариф вокруг вызовов LLM.
+Между сбросами воркеры gunicorn не видят счётчики друг друга, так что
+месячная квота может быть превышена на (воркеры - 1) x вопросов за интервал.
+"""
+import asyncio
+import atexit
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+
+class RateLimiter:
+    """Token bucket по ключу: rate токенов в секунду, не больше burst."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.window = burst / rate   # за столько секунд пустое ведро наполняется
+        self._buckets = {}   # key -> [токены, время последнего пополнения]
+        self._swept = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def take(self, key, now=None):
+        """Забирает токен. Возвращает 0, если можно, иначе сколько секунд ждать."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            if self._swept is None:
+                self._swept = now
+            elif now - self._swept >= self.window:
+                self._sweep(now)
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.burst, now]
+            tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if tokens >= 1:
+                bucket[0] = tokens - 1
+                return 0.0
+            bucket[0] = tokens
+            return (1 - tokens) / self.rate
+
+    def _sweep(self, now):
+        # Ведро, которое не трогали дольше window, уже полное — такое же, как
+        # новое, так что его можно забыть. Обход всех вёдер — не чаще раза в window.
+        self._swept = now
+        for key in [k for k, b in self._buckets.items() if now - b[1] >= self.window]:
+            del self._buckets[key]
+
+
+class MonthlyCounter:
+    """Счётчики использования по ключу (user_id, "ГГГГ-ММ").
+
+    load(key) -> int читает сохранённое значение при первом обращении;
+    store({key: прирост}) -> {key: новое значение в БД} записывает пачку.
+    Обе функции вызываются без внутренней блокировки. Когда приходит
+    новый месяц, счётчики прошлых забываются после записи их прироста.
+    """
+
+    def __init__(self, load, store, flush_interval=5.0):
+        self._load = load
+        self._store = store
+        self.flush_interval = flush_interval
+        self._base = {}    # key -> значение в БД на момент последней синхронизации
+        self._delta = {}   # key -> ещё не записанный прирост
+        self._period = None   # самый поздний месяц среди ключей
+        self._stale = False   # в _base есть ключи более ранних месяцев
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._thread_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        atexit.register(self.close)
+
+    def __len__(self):
+        return len(self._base)
+
+    def _ensure_thread(self):
+        # Как и в WriteBehind: поток заводится уже в воркере, а не в мастере до fork
+        if self._thread is None or not self._thread.is_alive():
+            with self._thread_lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name="quota-flush", daemon=True)
+                    self._thread.start()
+
+    def used(self, key):
+        with self._lock:
+            base = self._base.get(key)
+        if base is None:
+            base = self._load(key)
+            with self._lock:
+                base = self._base.setdefault(key, base)
+                if self._period is None or key[1] > self._period:
+                    self._stale = self._period is not None
+                    self._period = key[1]
+        with self._lock:
+            return base + self._delta.get(key, 0)
+
+    def hit(self, key, limit=None):
+        """Засчитывает одно использование, если не превышен limit (None — без лимита).
+        Возвращает True, если засчитано."""
+        if key not in self._base:
+            self.used(key)
+        self._ensure_thread()
+        with self._lock:
+            if limit is not None and self._base[key] + self._delta.get(key, 0) >= limit:
+                return False
+            self._delta[key] = self._delta.get(key, 0) + 1
+            return True
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                pending = {k: v for k, v in self._delta.items() if v}
+            if not pending:
+                return
+            try:
+                totals = self._store(pending)
+            except Exception as e:
+                print("quota flush error:", e)
+                return
+            with self._lock:
+                for key, written in pending.items():
+                    left = self._delta.get(key, 0) - written
+                    if left:
+                        self._delta[key] = left
+                    else:
+                        self._delta.pop(key, None)
+                    if key in totals:
+                        self._base[key] = totals[key]
+
+    def evict(self):
+        """Забывает счётчики прошлых месяцев, прирост которых уже записан."""
+        with self._lock:
+            if not self._stale:
+                return
+            stale = [k for k in self._base if k[1] < self._period]
+            for key in stale:
+                if not self._delta.get(key):
+                    del self._base[key]
+            self._stale = any(self._delta.get(k) for k in stale)
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+            self.evict()
+
+    def close(self):
+        self._stop.set()
+        self.flush()
+
+
+class SlotBusy(Exception):
+    """Все слоты LLM тарифа заняты дольше допустимого ожидания."""
+
+
+class ConcurrencyLimit:
+    """Не больше limits[name] одновременных вызовов на имя (тариф)."""
+
+    def __init__(self, limits, timeout=10.0):
+        self.timeout = timeout
+        self._slots = {name: threading.BoundedSemaphore(n) for name, n in limits.items() if n}
+
+    def acquire(self, name, timeout=None):
+        """Занимает слот без контекстного менеджера: SlotBusy, если не дождались
+        за timeout секунд (None — self.timeout, 0 — без ожидания). Освобождать — release()."""
+        sem = self._slots.get(name)
+        if sem is None:
+            return
+        timeout = self.timeout if timeout is None else timeout
+        if not (sem.acquire(timeout=timeout) if timeout > 0 else sem.acquire(blocking=False)):
+            raise SlotBusy(name)
+
+    def release(self, name):
+        sem = self._slots.get(name)
+        if sem is not None:
+            sem.release()
+
+    @contextmanager
+    def slot(self, name):
+        """Занимает слот на время блока; SlotBusy, если не дождались. Имя без лимита — без ожидания."""
+        self.acquire(name)
+        try:
+            yield
+        finally:
+            self.release(name)
+
+    async def aacquire(self, name, timeout=None):
+        """acquire() для корутин: свободный слот ждётся опросом, не занимая поток."""
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                return self.acquire(name, 0)
+            except SlotBusy:
+                if time.monotonic() >= deadline:
+                    raise
+            await asyncio.sleep(0.05)
+
+    @asynccontextmanager
+    async def aslot(self, name):
+        await self.aacquire(name)
+        try:
+            yield
+        finally:
+            self.release(name)
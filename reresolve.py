@@ -0,0 +1,191 @@
+"""Фоновое доразрешение заглушек базы знаний.
+
+Когда ни Википедия, ни LLM не ответили (таймаут, сбой, выключатель LLM
+открыт), learn_remote() сохраняет в knowledge заглушку, и дальше этот
+вопрос получает её из базы — сбой на минуту превращается в плохой ответ
+навсегда. Reresolver в тихое время берёт такие строки, самые
+спрашиваемые первыми (hits, см. compaction.HitTracker), и заново ищет
+ответ через resolve(phrase): не больше concurrency запросов сразу и не
+чаще rate в секунду на воркер. Результаты пишутся в БД пачкой: ответ —
+условным UPDATE (только если в строке всё ещё заглушка, правку админа
+не затираем), неудача — паузой до следующей попытки, которая растёт
+вдвое с каждой (resolve_attempts, resolve_after). Живые вопросы дальше
+получают найденный ответ из базы, не ходя во внешние сервисы.
+
+Тихое время — busy() ложно (у воркера нет своих вопросов к внешним
+сервисам) и текущий час входит в hours. Строки берутся в работу одним
+UPDATE ... RETURNING, который сдвигает resolve_after на lease секунд,
+так что воркеры gunicorn не делят одну строку, а строки упавшего
+воркера вернутся в очередь сами.
+"""
+import atexit
+import heapq
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import bindparam, or_, select, text, update
+
+from quota import RateLimiter
+
+
+def parse_hours(spec):
+    """«1-7» -> часы 1..6 (конец не входит), «22-6» — через полночь; пусто — все."""
+    if not spec:
+        return frozenset(range(24))
+    start, end = (int(x) % 24 for x in spec.split("-"))
+    hours, h = set(), start
+    while True:
+        hours.add(h)
+        h = (h + 1) % 24
+        if h == end:
+            return frozenset(hours)
+
+
+class Reresolver:
+    """resolve(phrase) -> ответ или None; on_resolved([(id, фраза, ответ), ...])
+    вызывается после записи пачки (сбросить кэш, обновить индексы).
+    concurrency=0 — фоновый поток не запускается, run_once() работает
+    (вызванный вручную, он разрешает строки по одной)."""
+
+    def __init__(self, engine, table, placeholder, resolve, *, on_resolved=None, busy=None, batch=50,
+                 concurrency=2, rate=0.5, interval=60.0, lease=600.0, backoff=600.0, max_backoff=7 * 86400,
+                 hours=""):
+        self.engine = engine
+        self.table = table
+        self.placeholder = placeholder
+        self.resolve = resolve
+        self.on_resolved = on_resolved
+        self.busy = busy or (lambda: False)
+        self.batch = batch
+        self.concurrency = concurrency
+        self.interval = interval
+        self.lease = lease
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hours = parse_hours(hours)
+        self._limiter = RateLimiter(rate, max(1, concurrency))
+        # Условие пишется литералом: иначе SQLite не возьмёт частичный индекс по заглушкам
+        self._is_placeholder = text("answer = '{}'".format(placeholder.replace("'", "''")))
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread_lock = threading.Lock()
+        self._thread = None
+        self.claimed = self.resolved = self.failed = self.rounds = 0
+        atexit.register(self.close)
+
+    def _ensure_thread(self):
+        # Как и в WriteBehind: поток заводится уже в воркере, а не в мастере до fork
+        if self._thread is None or not self._thread.is_alive():
+            with self._thread_lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name="kb-reresolve", daemon=True)
+                    self._thread.start()
+
+    def wake(self):
+        """Появилась или отдана заглушка: очередь не пуста, пора посмотреть."""
+        if self.concurrency <= 0:
+            return
+        self._ensure_thread()
+        self._wake.set()
+
+    def quiet(self):
+        return datetime.now().hour in self.hours and not self.busy()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            done = 0
+            if self.quiet():
+                try:
+                    done = self.run_once()
+                except Exception as e:
+                    print("kb reresolve error:", e)
+            if not done:
+                # Очередь пуста или время не тихое — ждём interval или новую заглушку
+                self._wake.wait(self.interval)
+                self._stop.wait(1.0)   # не чаще раза в секунду, даже если будят постоянно
+
+    def claim(self, now=None):
+        """Берёт в работу до batch самых спрашиваемых заглушек, чья пауза истекла:
+        [(id, фраза, попыток, hits), ...] по убыванию hits."""
+        now = now or datetime.utcnow()
+        k = self.table.c
+        due = or_(k.resolve_after.is_(None), k.resolve_after <= now)
+        ids = (select(k.id).where(self._is_placeholder, due)
+               .order_by(k.hits.desc()).limit(self.batch).scalar_subquery())
+        with self.engine.begin() as conn:
+            rows = conn.execute(
+                update(self.table).where(k.id.in_(ids), due)
+                .values(resolve_after=now + timedelta(seconds=self.lease))
+                .returning(k.id, k.phrase, k.resolve_attempts, k.hits)
+            ).all()
+        self.claimed += len(rows)
+        return sorted((tuple(r) for r in rows), key=lambda r: -r[3])
+
+    def run_once(self, now=None):
+        """Одна пачка: взять, доразрешить (по приоритету, с лимитами), записать.
+        Возвращает, сколько строк обработано."""
+        rows = self.claim(now)
+        if not rows:
+            return 0
+        self.rounds += 1
+        queue = [(-hits, kid, phrase, attempts) for kid, phrase, attempts, hits in rows]
+        heapq.heapify(queue)
+        lock = threading.Lock()
+        results = []
+
+        def worker():
+            while not self._stop.is_set():
+                with lock:
+                    if not queue:
+                        return
+                    _, kid, phrase, attempts = heapq.heappop(queue)
+                delay = self._limiter.take("reresolve")
+                while delay and not self._stop.wait(delay):
+                    delay = self._limiter.take("reresolve")
+                if self._stop.is_set() or self.busy():
+                    return   # живые вопросы важнее; аренда остальных строк истечёт сама
+                try:
+                    answer = self.resolve(phrase)
+                except Exception as e:
+                    print("kb reresolve lookup error:", e)
+                    answer = None
+                with lock:
+                    results.append((kid, phrase, attempts, answer))
+
+        threads = [threading.Thread(target=worker, name="kb-reresolve-lookup", daemon=True)
+                   for _ in range(min(max(1, self.concurrency), len(rows)))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.write(results, now)
+        return len(results)
+
+    def write(self, results, now=None):
+        """Пачка результатов одной транзакцией: [(id, фраза, попыток, ответ или None), ...]."""
+        now = now or datetime.utcnow()
+        k = self.table.c
+        found = [{"kid": kid, "new_answer": answer} for kid, _p, _a, answer in results if answer]
+        missed = [{"kid": kid, "attempts": attempts + 1,
+                   "after": now + timedelta(seconds=min(self.max_backoff, self.backoff * 2 ** attempts))}
+                  for kid, _p, attempts, answer in results if not answer]
+        with self.engine.begin() as conn:
+            if found:
+                conn.execute(update(self.table).where(k.id == bindparam("kid"), self._is_placeholder)
+                             .values(answer=bindparam("new_answer"), resolve_attempts=0, resolve_after=None), found)
+            if missed:
+                conn.execute(update(self.table).where(k.id == bindparam("kid"), self._is_placeholder)
+                             .values(resolve_attempts=bindparam("attempts"), resolve_after=bindparam("after")),
+                             missed)
+        self.resolved += len(found)
+        self.failed += len(missed)
+        if found and self.on_resolved is not None:
+            self.on_resolved([(kid, phrase, answer) for kid, phrase, _a, answer in results if answer])
+
+    def close(self):
+        self._stop.set()
+        self._wake.set()
+
+    def stats(self):
+        return {"claimed": self.claimed, "resolved": self.resolved, "failed": self.failed, "rounds": self.rounds}
@@ -0,0 +1,155 @@
+"""Нечёткий поиск по базе знаний: TF-IDF по символьным триграммам + косинус.
+
+Перефразированный вопрос («сколько весит мозг человека» против «какой вес
+у человеческого мозга») не содержит сохранённую фразу как подстроку, но
+делит с ней большую часть триграмм. Индекс обратный: триграмма ->
+документы, так что поиск трогает только документы с общими триграммами,
+а очень частые триграммы (как стоп-слова) пропускаются.
+
+Всё на чистом Python и только на CPU; добавление документа инкрементально.
+"""
+import heapq
+import math
+import re
+import threading
+
+_WORD = re.compile(r"\w+")
+
+
+def ngrams(text, n=3):
+    """Триграммы слов с границами: «кот» -> « ко», «кот», «от »."""
+    grams = {}
+    for word in _WORD.findall(text.lower().replace("ё", "е")):
+        w = f" {word} "
+        for i in range(max(1, len(w) - n + 1)):
+            g = w[i:i + n]
+            grams[g] = grams.get(g, 0) + 1
+    return grams
+
+
+class FuzzyIndex:
+    """Обратный индекс триграмм с косинусной близостью TF-IDF.
+
+    Вес документа считается по idf на момент добавления; rebuild()
+    пересчитывает все веса с актуальной статистикой. Пока индекс растёт,
+    ранние документы взвешены по idf почти пустого корпуса — после
+    начальной загрузки нужен rebuild(), а дальше rebuild_if_stale()
+    пересчитывает веса, когда добавлено больше stale доли документов.
+    """
+
+    def __init__(self, n=3, max_df=0.05, min_df_cap=50, candidates=50, stale=0.1):
+        self.n = n
+        self.max_df = max_df          # доля документов, выше которой триграмма — «стоп»
+        self.min_df_cap = min_df_cap  # ...но не меньше стольки документов
+        self.candidates = candidates  # сколько лучших кандидатов досчитывать точно
+        self.stale = stale            # доля новых документов, после которой пора rebuild()
+        self._added = 0               # добавлено с последнего rebuild()
+        self._postings = {}           # триграмма -> {doc_id: вес}
+        self._docs = {}               # doc_id -> (триграммы с tf, норма вектора)
+        self._df = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._docs)
+
+    def _idf(self, g):
+        return math.log((1 + len(self._docs)) / (1 + self._df.get(g, 0))) + 1.0
+
+    def _weights(self, grams):
+        w = {g: (1 + math.log(tf)) * self._idf(g) for g, tf in grams.items()}
+        norm = math.sqrt(sum(x * x for x in w.values())) or 1.0
+        return w, norm
+
+    def add(self, doc_id, text):
+        grams = ngrams(text, self.n)
+        if not grams:
+            return
+        with self._lock:
+            if doc_id in self._docs:
+                self._remove(doc_id)
+            for g in grams:
+                self._df[g] = self._df.get(g, 0) + 1
+            w, norm = self._weights(grams)
+            for g, x in w.items():
+                self._postings.setdefault(g, {})[doc_id] = x / norm
+            self._docs[doc_id] = grams
+            self._added += 1
+
+    def remove(self, doc_id):
+        with self._lock:
+            self._remove(doc_id)
+
+    def _remove(self, doc_id):
+        grams = self._docs.pop(doc_id, None)
+        if grams is None:
+            return
+        for g in grams:
+            posting = self._postings.get(g)
+            if posting is not None:
+                posting.pop(doc_id, None)
+                if not posting:
+                    del self._postings[g]
+            self._df[g] -= 1
+            if not self._df[g]:
+                del self._df[g]
+
+    def rebuild(self):
+        """Пересчитывает веса всех документов по текущей статистике df."""
+        with self._lock:
+            docs = self._docs
+            self._postings = {}
+            self._added = 0
+            for doc_id, grams in docs.items():
+                w, norm = self._weights(grams)
+                for g, x in w.items():
+                    self._postings.setdefault(g, {})[doc_id] = x / norm
+
+    def rebuild_if_stale(self):
+        """rebuild(), если с прошлого пересчёта добавлено больше stale доли документов.
+        True — веса пересчитаны."""
+        if self._added <= self.stale * len(self._docs):
+            return False
+        self.rebuild()
+        return True
+
+    def clear(self):
+        with self._lock:
+            self._postings, self._docs, self._df = {}, {}, {}
+            self._added = 0
+
+    def search(self, text, k=5):
+        """До k пар (doc_id, косинус) по убыванию близости."""
+        grams = ngrams(text, self.n)
+        if not grams:
+            return []
+        with self._lock:
+            q, qnorm = self._weights(grams)
+            cap = max(self.min_df_cap, self.max_df * len(self._docs))
+            scores = {}
+            for g, x in q.items():
+                posting = self._postings.get(g)
+                if not posting or len(posting) > cap:
+                    continue
+                x /= qnorm
+                for doc_id, y in posting.items():
+                    scores[doc_id] = scores.get(doc_id, 0.0) + x * y
+            if not scores:
+                return []
+            top = heapq.nlargest(self.candidates, scores.items(), key=lambda kv: kv[1])
+            # Точный косинус для лучших кандидатов — с учётом и «стоп»-триграмм
+            exact = []
+            for doc_id, _ in top:
+                dot = 0.0
+                for g in self._docs[doc_id]:
+                    x = q.get(g)
+                    if x is not None:
+                        dot += x / qnorm * self._postings[g][doc_id]
+                exact.append((doc_id, dot))
+        return heapq.nlargest(k, exact, key=lambda kv: kv[1])
+
+    def best(self, text, threshold):
+        """(doc_id, близость) лучшего документа, если близость >= threshold, иначе None."""
+        hits = self.search(text, k=1)
+        if hits and hits[0][1] >= threshold:
+            return hits[0]
+        return None
@@ -0,0 +1,131 @@
+"""Полнотекстовый поиск для админки: SQLite FTS5 по заявкам и базе знаний.
+
+Индексы support_fts (text, answer) и knowledge_fts (phrase, answer) —
+contentless-таблицы FTS5 (content=''), rowid совпадает с id строки.
+Их держат в актуальном состоянии триггеры на INSERT/DELETE/UPDATE
+исходных таблиц; у knowledge триггер обновления срабатывает только на
+phrase и answer, так что запись попаданий (compaction.HitTracker) индекс
+не трогает.
+
+Токенизатор unicode61 приводит кириллицу к нижнему регистру, но ё не
+сводит к е — это делают сами триггеры (в индекс пишется текст с ё -> е)
+и fts_query(). Русская морфология — лёгким стеммингом: у слова
+отрезается типичное окончание, и ищется префикс основы ("кошками" ->
+"кошк*"). Все слова запроса обязательны, порядок — по bm25 с большим
+весом у первой колонки.
+"""
+import re
+
+from markupsafe import Markup, escape
+from sqlalchemy import text
+
+TOKENIZE = "unicode61 remove_diacritics 2"
+
+# область -> (таблица, индекс, колонки, веса bm25, дополнительные поля результата)
+SCOPES = {
+    "support": ("support", "support_fts", ("text", "answer"), (1.0, 0.5),
+                'src.is_tariff, src.user_id, (SELECT login FROM "user" WHERE "user".id = src.user_id) AS login'),
+    "knowledge": ("knowledge", "knowledge_fts", ("phrase", "answer"), (2.0, 1.0), "src.hits"),
+}
+
+_WORD = re.compile(r"\w+")
+_ENDINGS = sorted((
+    "иями", "ями", "ами", "ого", "его", "ому", "ему", "ыми", "ими", "иях", "ией",
+    "ой", "ей", "ий", "ый", "ая", "яя", "ое", "ее", "ые", "ие", "ую", "юю", "ов", "ев", "ам", "ям",
+    "ах", "ях", "ом", "ем", "ию", "ия", "ье", "ья", "ью", "а", "я", "о", "е", "и", "ы", "у", "ю", "ь", "й",
+), key=len, reverse=True)
+
+
+def _norm_sql(expr):
+    return f"replace(replace(coalesce({expr}, ''), 'ё', 'е'), 'Ё', 'Е')"
+
+
+def stem(word):
+    """Основа слова для поиска по префиксу; короче трёх букв не режется."""
+    for ending in _ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            return word[:-len(ending)]
+    return word
+
+
+def terms(query):
+    """Основы слов запроса в том виде, в каком они лежат в индексе."""
+    return [stem(w) for w in _WORD.findall(query.lower().replace("ё", "е"))]
+
+
+def fts_query(query):
+    """Строка для MATCH: каждое слово — в кавычках, основы от трёх букв — префиксом."""
+    parts = [f'"{t}"*' if len(t) >= 3 else f'"{t}"' for t in terms(query)]
+    return " ".join(parts) or None
+
+
+def _ddl(scope):
+    table, fts, cols, _w, _extra = SCOPES[scope]
+    names = ", ".join(cols)
+    new = ", ".join(_norm_sql(f"new.{c}") for c in cols)
+    old = ", ".join(_norm_sql(f"old.{c}") for c in cols)
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({names}, content='', tokenize='{TOKENIZE}')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {fts}(rowid, {names}) VALUES (new.id, {new}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {names}) VALUES ('delete', old.id, {old}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {names} ON {table} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {names}) VALUES ('delete', old.id, {old}); "
+        f"INSERT INTO {fts}(rowid, {names}) VALUES (new.id, {new}); END",
+    ]
+
+
+def ensure_fts(engine):
+    """Создаёт индексы и триггеры. Если триггеров не было (новая база, или
+    таблицы пересозданы через drop_all/create_all), индекс перестраивается
+    из исходной таблицы. Возвращает перестроенные области."""
+    if engine.dialect.name != "sqlite":
+        return []
+    rebuilt = []
+    with engine.begin() as conn:
+        for scope, (table, fts, cols, _w, _extra) in SCOPES.items():
+            have = conn.execute(text("SELECT count(*) FROM sqlite_master WHERE type = 'trigger' AND name = :n"),
+                                {"n": f"{fts}_ai"}).scalar()
+            for ddl in _ddl(scope):
+                conn.exec_driver_sql(ddl)
+            if not have:
+                names = ", ".join(cols)
+                conn.exec_driver_sql(f"INSERT INTO {fts}({fts}) VALUES ('delete-all')")
+                conn.exec_driver_sql(f"INSERT INTO {fts}(rowid, {names}) SELECT id, "
+                                     f"{', '.join(_norm_sql(c) for c in cols)} FROM {table}")
+                rebuilt.append(scope)
+    return rebuilt
+
+
+def search(conn, scope, query, page=1, per_page=50):
+    """Страница результатов по убыванию релевантности: (строки, есть ли следующая).
+    Строка — id, колонки области и её дополнительные поля."""
+    match = fts_query(query)
+    if not match or scope not in SCOPES:
+        return [], False
+    table, fts, cols, weights, extra = SCOPES[scope]
+    sql = (f"WITH hits AS (SELECT rowid, bm25({fts}, {', '.join(map(str, weights))}) AS score FROM {fts} "
+           f"WHERE {fts} MATCH :q ORDER BY score LIMIT :n OFFSET :o) "
+           f"SELECT src.id, {', '.join('src.' + c for c in cols)}, {extra}, hits.score FROM hits "
+           f"JOIN {table} src ON src.id = hits.rowid ORDER BY hits.score")
+    rows = conn.execute(text(sql), {"q": match, "n": per_page + 1, "o": (max(1, page) - 1) * per_page}).mappings().all()
+    return [dict(r) for r in rows[:per_page]], len(rows) > per_page
+
+
+def highlight(value, query):
+    """Текст с найденными словами в <mark> (остальное экранировано)."""
+    if not value:
+        return Markup("")
+    stems = sorted({t for t in terms(query) if t}, key=len, reverse=True)
+    if not stems:
+        return escape(value)
+    pattern = re.compile(r"(?<!\w)(?:" + "|".join(re.escape(t).replace("е", "[её]") for t in stems) + r")\w*",
+                         re.IGNORECASE)
+    out, pos = [], 0
+    for m in pattern.finditer(value):
+        out.append(escape(value[pos:m.start()]))
+        out.append(Markup("<mark>") + escape(m.group(0)) + Markup("</mark>"))
+        pos = m.end()
+    out.append(escape(value[pos:]))
+    return Markup("").join(out)
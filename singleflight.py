@@ -0,0 +1,84 @@
+"""Склейка одинаковых одновременных запросов (single-flight).
+
+Если несколько потоков одновременно просят результат по одному ключу,
+функция выполняется один раз, а остальные ждут и получают тот же
+результат (или то же исключение). AsyncSingleFlight — то же для корутин
+одного цикла событий.
+"""
+import asyncio
+import threading
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "waiters")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args, **kwargs):
+        """Выполняет fn(*args, **kwargs) не более одного раза на ключ одновременно.
+
+        Возвращает (результат, shared): shared=True у тех, кто дождался чужого вызова.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                leader = True
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+
+class AsyncSingleFlight:
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key, fn, *args, **kwargs):
+        """Как SingleFlight.do, но fn — корутина; ждущие не занимают потоков."""
+        fut = self._calls.get(key)
+        if fut is not None:
+            return await asyncio.shield(fut), True
+        fut = self._calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await fn(*args, **kwargs)
+        except BaseException as e:
+            fut.set_exception(e)
+            fut.exception()  # без ждущих исключение иначе попадёт в лог как «не полученное»
+            raise
+        else:
+            fut.set_result(result)
+        finally:
+            del self._calls[key]
+        return result, False
+
+    def in_flight(self):
+        return len(self._calls)
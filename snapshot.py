@@ -0,0 +1,439 @@
+"""Снимок базы знаний на диске, общий для всех воркеров через mmap.
+
+Индекс фраз (matcher.py) и нечёткий индекс (retrieval.py) у каждого
+воркера свои: при миллионе строк это сотни мегабайт на процесс и долгая
+загрузка при старте. Снимок — один файл только для чтения: фразы и
+оба индекса в виде плоских массивов. Воркеры открывают его
+через mmap, так что страницы лежат в page cache один раз на машину, а
+открытие не читает файл целиком.
+
+Формат (little-endian): заголовок с версией формата, id последней
+строки (last_id) и надгробия (tombstone_id), на которых снимок собран,
+и таблица секций (смещение, длина). Секции — колоночные массивы:
+  ids, phrase_off/phrase_len, norm — по строкам;
+  strings — UTF-8 фраз;
+  phrases — хеш-таблица (crc32 фразы, номер строки + 1), открытая адресация;
+  anchors/lengths/short — как в PhraseMatcher: по crc32 первых ANCHOR
+  байт — длины фраз, которые с них начинаются, и длины коротких фраз;
+  grams/gram_text/postings_* — триграммы с df и постинги (строка, вес
+  TF-IDF, нормированный по idf всего снимка, как после FuzzyIndex.rebuild()).
+Фразы сравниваются в байтах UTF-8: подстрока, начатая на границе
+символа, совпадает с фразой тогда же, когда и в символах.
+
+Версии: файл knowledge-<last_id>-<tombstone_id>.snap пишется рядом и
+переименовывается, затем так же атомарно подменяется указатель CURRENT.
+Воркер замечает новый CURRENT и открывает новый файл; старое отображение
+остаётся валидным, пока его не закроют, даже если файл уже удалён.
+Строки новее last_id и надгробия новее tombstone_id — дельта, которую
+воркер держит в памяти, как раньше весь индекс.
+
+Ответов в снимке нет: админ правит их на месте (тот же id), поэтому
+ответ по найденному id по-прежнему читается из базы по первичному ключу.
+"""
+import fcntl
+import heapq
+import math
+import mmap
+import os
+import struct
+import time
+import zlib
+from array import array
+from contextlib import suppress
+
+from retrieval import ngrams
+
+MAGIC = b"NKB1"
+FORMAT = 1
+ANCHOR = 8          # байт: 4 кириллических символа, как ANCHOR в matcher.py
+GRAM_BYTES = 12     # триграмма в UTF-8 — не длиннее 12 байт
+POINTER = "CURRENT"
+
+# имя секции -> тип элемента array/memoryview
+SECTIONS = (
+    ("ids", "q"), ("phrase_off", "Q"), ("phrase_len", "I"), ("norm", "f"), ("strings", "B"),
+    ("phrases", "I"), ("anchors", "I"), ("lengths", "H"), ("short", "H"), ("grams", "I"),
+    ("gram_text", "B"), ("postings_doc", "I"), ("postings_weight", "f"),
+)
+HEADER = struct.Struct("<4sIIIqqqII" + "QQ" * len(SECTIONS))
+
+
+def _crc(data):
+    return zlib.crc32(data) or 1   # 0 — пустой слот
+
+
+def _capacity(n):
+    cap = 8
+    while cap < 2 * n:
+        cap *= 2
+    return cap
+
+
+def _idf(n_docs, df):
+    return math.log((1 + n_docs) / (1 + df)) + 1.0
+
+
+def _weights(grams, idf):
+    w = {g: (1 + math.log(tf)) * idf(g) for g, tf in grams.items()}
+    return w, math.sqrt(sum(x * x for x in w.values())) or 1.0
+
+
+def build(directory, rows, last_id, tombstone_id, keep=2, ngram=3):
+    """Собирает снимок из rows — (id, фраза, заглушка ли) по возрастанию id —
+    и делает его текущим. Возвращает путь к файлу."""
+    os.makedirs(directory, exist_ok=True)
+    ids, p_off, p_len = array("q"), array("Q"), array("I")
+    placeholder = bytearray()
+    anchors, short, df = {}, set(), {}
+    empty = -1
+    strings = bytearray()
+    # Проход 1: фразы, якоря, df триграмм
+    for kid, phrase, is_placeholder in rows:
+        pb = phrase.encode()
+        ids.append(kid)
+        p_off.append(len(strings))
+        p_len.append(len(pb))
+        strings += pb
+        placeholder.append(bool(is_placeholder))
+        if not pb:
+            empty = len(ids) - 1 if empty < 0 else empty
+        elif len(pb) < ANCHOR:
+            short.add(len(pb))
+        else:
+            anchors.setdefault(_crc(pb[:ANCHOR]), set()).add(len(pb))
+        if not is_placeholder:
+            for g in ngrams(phrase, ngram):
+                df[g] = df.get(g, 0) + 1
+    count = len(ids)
+
+    # Хеш-таблица фраз (фразы в knowledge уникальны)
+    cap = _capacity(count)
+    phrases = array("I", bytes(8 * cap))
+    for i in range(count):
+        pb = strings[p_off[i]:p_off[i] + p_len[i]]
+        if not pb:
+            continue
+        h = _crc(pb)
+        slot = h & (cap - 1)
+        while phrases[2 * slot]:
+            slot = (slot + 1) & (cap - 1)
+        phrases[2 * slot], phrases[2 * slot + 1] = h, i + 1
+
+    acap = _capacity(len(anchors))
+    anchor_table, lengths = array("I", bytes(8 * acap)), array("H")
+    for h, lens in anchors.items():
+        slot = h & (acap - 1)
+        while anchor_table[2 * slot]:
+            slot = (slot + 1) & (acap - 1)
+        anchor_table[2 * slot], anchor_table[2 * slot + 1] = h, len(lengths) + 1
+        lengths.append(len(lens))
+        lengths.extend(sorted(lens))
+    del anchors
+
+    # Триграммы: слот (crc, df, начало постингов) + текст триграммы
+    n_docs = count - sum(placeholder)
+    gcap = _capacity(len(df))
+    grams, gram_text = array("I", bytes(12 * gcap)), bytearray(GRAM_BYTES * gcap)
+    start, total = {}, 0
+    for g, n in df.items():
+        gb = g.encode()
+        h = _crc(gb)
+        slot = h & (gcap - 1)
+        while grams[3 * slot]:
+            slot = (slot + 1) & (gcap - 1)
+        grams[3 * slot:3 * slot + 3] = array("I", (h, n, total))
+        gram_text[GRAM_BYTES * slot:GRAM_BYTES * slot + len(gb)] = gb
+        start[g] = total
+        total += n
+
+    # Проход 2: постинги с весами по idf всего снимка
+    postings_doc, postings_weight = array("I", bytes(4 * total)), array("f", bytes(4 * total))
+    norm = array("f", bytes(4 * count))
+
+    def idf(g):
+        return _idf(n_docs, df.get(g, 0))
+
+    for i in range(count):
+        if placeholder[i]:
+            continue
+        w, nrm = _weights(ngrams(strings[p_off[i]:p_off[i] + p_len[i]].decode(), ngram), idf)
+        norm[i] = nrm
+        for g, x in w.items():
+            k = start[g]
+            postings_doc[k], postings_weight[k] = i, x / nrm
+            start[g] = k + 1
+    del start
+
+    data = {"ids": ids, "phrase_off": p_off, "phrase_len": p_len, "norm": norm, "strings": strings, "phrases": phrases, "anchors": anchor_table, "lengths": lengths,
+            "short": array("H", sorted(short)), "grams": grams, "gram_text": gram_text,
+            "postings_doc": postings_doc, "postings_weight": postings_weight}
+    name = f"knowledge-{last_id}-{tombstone_id}.snap"
+    path = os.path.join(directory, name)
+    with open(path + ".tmp", "wb") as f:
+        f.write(bytes(HEADER.size))
+        table = []
+        for section, _typ in SECTIONS:
+            f.write(bytes(-f.tell() % 8))   # выравнивание
+            offset = f.tell()
+            f.write(data[section])
+            table += [offset, f.tell() - offset]
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, FORMAT, count, n_docs, last_id, tombstone_id, empty, ngram, ANCHOR, *table))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+    _publish(directory, name)
+    _cleanup(directory, keep)
+    return path
+
+
+def _publish(directory, name):
+    tmp = os.path.join(directory, POINTER + ".tmp")
+    with open(tmp, "w") as f:
+        f.write(name)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, os.path.join(directory, POINTER))
+
+
+def _cleanup(directory, keep):
+    snaps = sorted((e for e in os.scandir(directory) if e.name.endswith(".snap")),
+                   key=lambda e: e.stat().st_mtime, reverse=True)
+    for e in snaps[keep:]:
+        os.unlink(e.path)   # у воркеров отображение остаётся, пока они его не закроют
+
+
+def readable(path):
+    """Открывается ли снимок: есть, той же версии формата и не обрезан."""
+    try:
+        Snapshot(path).close()
+    except (OSError, ValueError):
+        return False
+    return True
+
+
+def current_name(directory):
+    try:
+        with open(os.path.join(directory, POINTER)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+class building:
+    """Блокировка сборки на каталог: одну версию собирает один процесс.
+    acquired — False, если сборка уже идёт."""
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self._f = open(os.path.join(directory, ".build.lock"), "w")  # noqa: SIM115
+        self.acquired = False
+
+    def __enter__(self):
+        try:
+            fcntl.flock(self._f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            self.acquired = True
+        except BlockingIOError:
+            pass
+        return self
+
+    def __exit__(self, *exc):
+        if self.acquired:
+            fcntl.flock(self._f, fcntl.LOCK_UN)
+        self._f.close()
+
+
+class Snapshot:
+    """Открытый снимок: match() как у PhraseMatcher, best() как у FuzzyIndex.
+    Номер строки (idx) — позиция в снимке; id базы знаний — ids[idx]."""
+
+    def __init__(self, path, max_df=0.05, min_df_cap=50, candidates=50):
+        self.path = path
+        self.max_df = max_df
+        self.min_df_cap = min_df_cap
+        self.candidates = candidates
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        size = len(self._mm)
+        head = HEADER.unpack_from(self._mm, 0) if size >= HEADER.size else None
+        if head is None or head[0] != MAGIC or head[1] != FORMAT:
+            self._mm.close()
+            raise ValueError(f"{path}: не снимок базы знаний или другая версия формата")
+        for k, (section, typ) in enumerate(SECTIONS):
+            offset, length = head[9 + 2 * k], head[10 + 2 * k]
+            if offset + length > size or length % array(typ).itemsize:
+                self._mm.close()
+                raise ValueError(f"{path}: снимок обрезан или повреждён (секция {section})")
+        (_magic, _fmt, self.count, self.n_docs, self.last_id, self.tombstone_id, self._empty,
+         self.ngram, self.anchor) = head[:9]
+        mv = memoryview(self._mm)
+        for k, (section, typ) in enumerate(SECTIONS):
+            offset, size = head[9 + 2 * k], head[10 + 2 * k]
+            setattr(self, "_" + section, mv[offset:offset + size].cast(typ))
+        self._cap = len(self._phrases) // 2
+        self._acap = len(self._anchors) // 2
+        self._gcap = len(self._grams) // 3
+        self._short_lens = tuple(self._short)
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        for section, _typ in SECTIONS:
+            getattr(self, "_" + section).release()
+        # на память ещё ссылается чей-то срез — закроется сборщиком мусора
+        with suppress(BufferError):
+            self._mm.close()
+
+    def phrase(self, idx):
+        off = self._phrase_off[idx]
+        return bytes(self._strings[off:off + self._phrase_len[idx]]).decode()
+
+    def _find(self, data):
+        """Номер строки с фразой data (bytes/memoryview) или None."""
+        h = _crc(data)
+        mask = self._cap - 1
+        slot = h & mask
+        table, strings, p_off, p_len = self._phrases, self._strings, self._phrase_off, self._phrase_len
+        while True:
+            sh = table[2 * slot]
+            if not sh:
+                return None
+            if sh == h:
+                idx = table[2 * slot + 1] - 1
+                off = p_off[idx]
+                if p_len[idx] == len(data) and strings[off:off + len(data)] == data:
+                    return idx
+            slot = (slot + 1) & mask
+
+    def _anchor_lengths(self, data):
+        h = _crc(data)
+        mask = self._acap - 1
+        slot = h & mask
+        table = self._anchors
+        while True:
+            sh = table[2 * slot]
+            if not sh:
+                return ()
+            if sh == h:
+                off = table[2 * slot + 1] - 1
+                return self._lengths[off + 1:off + 1 + self._lengths[off]]
+            slot = (slot + 1) & mask
+
+    def match(self, text, deleted=()):
+        """id строки с наименьшим id среди фраз, входящих в text, или None.
+        deleted — id, удалённые после сборки снимка."""
+        best = None
+        if self._empty >= 0 and self._ids[self._empty] not in deleted:
+            best = self._ids[self._empty]
+        data = text.encode()
+        mv = memoryview(data)
+        size = len(data)
+        ids, anchor = self._ids, self.anchor
+        for i in range(size):
+            if data[i] & 0xC0 == 0x80:
+                continue   # середина символа
+            lens = self._short_lens
+            if i + anchor <= size:
+                lens = lens + tuple(self._anchor_lengths(mv[i:i + anchor]))
+            for n in lens:
+                if i + n > size:
+                    continue
+                idx = self._find(mv[i:i + n])
+                if idx is not None:
+                    kid = ids[idx]
+                    if (best is None or kid < best) and kid not in deleted:
+                        best = kid
+        return best
+
+    def _gram(self, gram):
+        """(df, начало постингов) триграммы или (0, 0)."""
+        gb = gram.encode()
+        h = _crc(gb)
+        mask = self._gcap - 1
+        slot = h & mask
+        table, text = self._grams, self._gram_text
+        while True:
+            sh = table[3 * slot]
+            if not sh:
+                return 0, 0
+            if sh == h and text[GRAM_BYTES * slot:GRAM_BYTES * slot + len(gb)] == gb \
+                    and (len(gb) == GRAM_BYTES or text[GRAM_BYTES * slot + len(gb)] == 0):
+                return table[3 * slot + 1], table[3 * slot + 2]
+            slot = (slot + 1) & mask
+
+    def search(self, text, k=5, deleted=()):
+        """До k пар (id, косинус) по убыванию близости — как FuzzyIndex.search()."""
+        grams = ngrams(text, self.ngram)
+        if not grams or not self.n_docs:
+            return []
+        stats = {g: self._gram(g) for g in grams}
+        idf = {g: _idf(self.n_docs, stats[g][0]) for g in grams}
+        q, qnorm = _weights(grams, idf.__getitem__)
+        cap = max(self.min_df_cap, self.max_df * self.n_docs)
+        scores = {}
+        docs, weights = self._postings_doc, self._postings_weight
+        for g, x in q.items():
+            df, start = stats[g]
+            if not df or df > cap:
+                continue
+            x /= qnorm
+            for doc, y in zip(docs[start:start + df], weights[start:start + df], strict=True):
+                scores[doc] = scores.get(doc, 0.0) + x * y
+        if not scores:
+            return []
+        top = heapq.nlargest(self.candidates, scores.items(), key=lambda kv: kv[1])
+        # Точный косинус с учётом «стоп»-триграмм: триграммы строки — из её фразы
+        exact = []
+        for doc, _ in top:
+            kid = self._ids[doc]
+            if kid in deleted:
+                continue
+            dgrams = ngrams(self.phrase(doc), self.ngram)
+            norm = self._norm[doc]
+            dot = sum(q[g] / qnorm * (1 + math.log(tf)) * idf[g] / norm for g, tf in dgrams.items() if g in q)
+            exact.append((kid, dot))
+        return heapq.nlargest(k, exact, key=lambda kv: kv[1])
+
+    def best(self, text, threshold, deleted=()):
+        hits = self.search(text, k=1, deleted=deleted)
+        if hits and hits[0][1] >= threshold:
+            return hits[0]
+        return None
+
+
+class SnapshotStore:
+    """Текущий снимок каталога; CURRENT проверяется не чаще раза в check секунд.
+    broken — имя текущего снимка, который не открылся (его нужно пересобрать)."""
+
+    def __init__(self, directory, check=1.0):
+        self.directory = directory
+        self.check = check
+        self.snapshot = None
+        self._name = None
+        self._checked = 0.0
+        self.broken = None
+        self.swaps = 0
+
+    def refresh(self):
+        """Открывает новый снимок, если CURRENT сменился. True — снимок сменился."""
+        now = time.monotonic()
+        if now - self._checked < self.check:
+            return False
+        self._checked = now
+        name = current_name(self.directory)
+        if name is None or name == self._name:
+            return False
+        try:
+            snap = Snapshot(os.path.join(self.directory, name))
+        except (OSError, ValueError) as e:
+            if self.broken != name:
+                print("knowledge snapshot error:", e)
+            self.broken = name
+            return False
+        self.broken = None
+        # Старый снимок не закрываем: им ещё могут пользоваться другие потоки,
+        # отображение освободится вместе с последней ссылкой
+        self.snapshot, self._name = snap, name
+        self.swaps += 1
+        return True
@@ -0,0 +1,162 @@
+"""Настройка SQLite под несколько воркеров gunicorn и пакетная запись.
+
+configure_sqlite() включает WAL и остальные PRAGMA на каждом новом
+соединении пула. WriteBehind копит вставки (Knowledge) в очереди и
+пишет их фоновым потоком пачками, одной транзакцией на пачку, вместо
+отдельного commit на каждую строку. Пачка не выбрасывается: при ошибке
+запись повторяется, пока не пройдёт.
+"""
+import atexit
+import queue
+import threading
+import time
+
+from sqlalchemy import event, insert
+
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",        # читатели не блокируют писателя и наоборот
+    "synchronous": "NORMAL",      # в WAL этого достаточно для целостности
+    "busy_timeout": 5000,         # мс ожидания блокировки вместо «database is locked»
+    "temp_store": "MEMORY",
+    "cache_size": -20000,         # ~20 МБ страничного кэша на соединение
+    "mmap_size": 134217728,       # 128 МБ читаются через mmap
+}
+
+
+def engine_options(uri, pool_size=10, max_overflow=20, busy_timeout=5.0):
+    """SQLALCHEMY_ENGINE_OPTIONS для файла SQLite: пул соединений и таймаут блокировки."""
+    if not uri.startswith("sqlite") or ":memory:" in uri or uri in ("sqlite://", "sqlite:///"):
+        return {}
+    return {
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_pre_ping": False,
+        "connect_args": {"timeout": busy_timeout, "check_same_thread": False},
+    }
+
+
+def configure_sqlite(engine, pragmas=None):
+    """Вешает на движок обработчик connect, выставляющий PRAGMA."""
+    if engine.dialect.name != "sqlite":
+        return
+    pragmas = dict(SQLITE_PRAGMAS, **(pragmas or {}))
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_conn, _record):
+        cur = dbapi_conn.cursor()
+        for name, value in pragmas.items():
+            cur.execute(f"PRAGMA {name}={value}")
+        cur.close()
+
+
+class WriteBehind:
+    """Очередь вставок с фоновой записью пачками.
+
+    put(table, row) не ждёт БД. Поток-писатель забирает до batch_size
+    строк или ждёт не дольше interval секунд и пишет всё одной
+    транзакцией: по одному executemany на таблицу, с INSERT OR IGNORE,
+    чтобы повтор уникальной фразы не ронял всю пачку. Ошибка записи
+    повторяется с паузой, растущей до max_backoff секунд.
+    """
+
+    def __init__(self, engine, batch_size=100, interval=0.5, max_queue=10000, max_backoff=5.0):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self.written = self.batches = self.errors = 0
+        self._thread = None
+        atexit.register(self.close)
+
+    def _ensure_thread(self):
+        # Поток заводится при первой записи — уже в воркере, а не в мастере до fork
+        if self._thread is None or not self._thread.is_alive():
+            with self._flush_lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+                    self._thread.start()
+
+    def put(self, table, row):
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait((table, row))
+        except queue.Full:
+            # Писатель не успевает — пишем сами, синхронно
+            self._write([(table, row)], from_queue=False)
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def _drain(self):
+        items = []
+        while len(items) < self.batch_size:
+            try:
+                items.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return items
+
+    def _write(self, items, from_queue=True):
+        if not items:
+            return
+        try:
+            self._write_batch(items)
+        finally:
+            if from_queue:
+                for _ in items:
+                    self._queue.task_done()
+
+    def _write_batch(self, items):
+        by_table = {}
+        for table, row in items:
+            by_table.setdefault(table, []).append(row)
+        attempt = 0
+        while True:
+            try:
+                with self._flush_lock, self.engine.begin() as conn:
+                    for table, rows in by_table.items():
+                        conn.execute(insert(table).prefix_with("OR IGNORE"), rows)
+                self.written += len(items)
+                self.batches += 1
+                return
+            except Exception as e:
+                # Строки не выбрасываем и поток не роняем: пишем ту же пачку, пока не выйдет
+                self.errors += 1
+                print("write-behind error:", e)
+                time.sleep(min(self.max_backoff, 0.1 * 2 ** attempt))
+                attempt += 1
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                items = [self._queue.get(timeout=self.interval)]
+            except queue.Empty:
+                continue
+            # Даём пачке набраться, но не дольше interval
+            deadline = time.monotonic() + self.interval
+            while len(items) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    items.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._write(items)
+
+    def flush(self):
+        """Синхронно записывает всё, что накопилось, и дожидается пачки,
+        которую уже пишет фоновый поток (тесты, остановка воркера)."""
+        while True:
+            items = self._drain()
+            if not items:
+                break
+            self._write(items)
+        self._queue.join()
+
+    def close(self):
+        self._stop.set()
+        self.flush()
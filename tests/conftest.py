@@ -0,0 +1,111 @@
+"""Общее для тестов: локальный фейковый сервер вместо Википедии и DeepInfra.
+
+main читает адреса сервисов и базу из окружения при импорте, поэтому
+сервер поднимается и окружение задаётся здесь, до первого import main.
+Потоковый ответ LLM задаёт FakeUpstream.sse — список строк потока; без
+"data: [DONE]" в конце соединение просто закрывается, как при обрыве сети.
+Обычный ответ LLM — FakeUpstream.answer, статьи Википедии — FakeUpstream.wiki
+(запрос -> extract). FakeUpstream.status, отличный от 200, LLM отдаёт вместо
+ответа (с Retry-After из FakeUpstream.retry_after, если он задан). Тела
+запросов к LLM копятся в FakeUpstream.requests.
+"""
+import json
+import os
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+class FakeUpstream(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    sse = []
+    answer = "Ответ модели."
+    status = 200
+    retry_after = None
+    wiki = {}
+    requests = []
+
+    def log_message(self, *args):
+        pass
+
+    def _json(self, status, data, headers=()):
+        body = json.dumps(data, ensure_ascii=False).encode()
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):  # Википедия: знает только то, что в FakeUpstream.wiki
+        FakeUpstream.requests.append(("GET", self.path))
+        query = unquote(self.path.rsplit("/", 1)[-1]).replace("_", " ")
+        if query in self.wiki:
+            self._json(200, {"extract": self.wiki[query]})
+        else:
+            self._json(404, {})
+
+    def do_POST(self):  # LLM: JSON с FakeUpstream.answer или поток SSE из FakeUpstream.sse
+        req = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        FakeUpstream.requests.append(("POST", req))
+        if self.status != 200:
+            headers = [("Retry-After", self.retry_after)] if self.retry_after is not None else []
+            self._json(self.status, {"error": "fake"}, headers)
+            return
+        if not req.get("stream"):
+            self._json(200, {"choices": [{"message": {"content": self.answer}}]})
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        for line in self.sse:
+            self.wfile.write(f"{line}\n\n".encode())
+            self.wfile.flush()
+        self.close_connection = True
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+
+_server = Server(("127.0.0.1", 0), FakeUpstream)
+threading.Thread(target=_server.serve_forever, daemon=True).start()
+_base = f"http://127.0.0.1:{_server.server_address[1]}"
+_tmp = tempfile.mkdtemp(prefix="neiro-tests-")
+os.environ.update({
+    "SQLALCHEMY_DATABASE_URI": f"sqlite:///{_tmp}/test.sqlite3",
+    "WRITE_BEHIND": "0",
+    "QUOTA": "0",
+    "WIKIPEDIA_URL": _base,
+    "WIKIPEDIA_RETRIES": "0",
+    "DEEPINFRA_URL": _base,
+    "DEEPINFRA_API_KEY": "fake",
+    "LLM_BREAKER_FAILURES": "1000000",
+    "FUZZY_THRESHOLD": "0",
+    "RERESOLVE_CONCURRENCY": "0",
+})
+os.environ.pop("SNAPSHOT_DIR", None)
+
+
+@pytest.fixture(scope="session")
+def main():
+    import main as app_main
+    app_main.init_db()
+    yield app_main
+    app_main.answers.shutdown()
+
+
+@pytest.fixture
+def upstream():
+    FakeUpstream.sse, FakeUpstream.wiki, FakeUpstream.requests = [], {}, []
+    FakeUpstream.answer, FakeUpstream.status, FakeUpstream.retry_after = "Ответ модели.", 200, None
+    return FakeUpstream
@@ -0,0 +1,144 @@
+"""ASGI-мост: ответ идёт клиенту с ограниченным буфером, exc_info по PEP 3333."""
+import asyncio
+import os
+import sys
+import threading
+
+import pytest
+
+
+@pytest.fixture(scope="module")
+def WSGIBridge(main):
+    # asgi ставит ANSWER_MODE=async по умолчанию — вернём как было
+    mode = os.environ.get("ANSWER_MODE")
+    import asgi
+
+    if mode is None:
+        os.environ.pop("ANSWER_MODE", None)
+    assert asgi.main is main
+    return asgi.WSGIBridge
+
+
+def scope(path="/"):
+    return {"type": "http", "method": "GET", "path": path, "headers": []}
+
+
+async def call(bridge, on_send=None):
+    """Гоняет запрос через мост; возвращает отправленные сообщения."""
+    sent, done = [], asyncio.Event()
+    requested = False
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+        if on_send is not None:
+            await on_send(message)
+
+    try:
+        await bridge(scope(), receive, send)
+    finally:
+        done.set()
+    return sent
+
+
+def test_slow_client_holds_back_producer(WSGIBridge):
+    produced = []
+
+    def app(_environ, start_response):
+        start_response("200 OK", [("Content-Type", "text/plain")])
+        for i in range(100):
+            produced.append(i)
+            yield b"x" * 10
+
+    async def scenario():
+        bridge = WSGIBridge(app, threads=2, buffer=4)
+        gate = asyncio.Event()
+
+        async def on_send(message):
+            if message["type"] == "http.response.body":
+                await gate.wait()   # клиент «не читает»
+
+        task = asyncio.create_task(call(bridge, on_send))
+        await asyncio.sleep(0.2)
+        held = len(produced)
+        gate.set()
+        sent = await task
+        bridge.executor.shutdown()
+        return held, sent
+
+    held, sent = asyncio.run(scenario())
+    assert held <= 4 + 2           # буфер плюс кусок в руках у send и у потока
+    body = b"".join(m["body"] for m in sent if m["type"] == "http.response.body")
+    assert len(body) == 1000 and len(produced) == 100
+    assert sent[-1] == {"type": "http.response.body", "body": b"", "more_body": False}
+
+
+def test_client_gone_releases_producer(WSGIBridge):
+    stopped = threading.Event()
+
+    def app(_environ, start_response):
+        start_response("200 OK", [])
+        try:
+            while True:
+                yield b"ping"
+        finally:
+            stopped.set()
+
+    async def scenario():
+        bridge = WSGIBridge(app, threads=1, buffer=2)
+
+        async def on_send(message):
+            if message["type"] == "http.response.body":
+                raise OSError("reset")
+
+        with pytest.raises(OSError):
+            await call(bridge, on_send)
+        bridge.executor.shutdown()
+
+    asyncio.run(asyncio.wait_for(scenario(), 5))
+    assert stopped.is_set()
+
+
+def test_exc_info_before_headers_sent_replaces_response(WSGIBridge):
+    def app(_environ, start_response):
+        start_response("200 OK", [("Content-Type", "text/plain")])
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            headers = [("Content-Type", "text/plain")]
+            start_response("500 INTERNAL SERVER ERROR", headers, sys.exc_info())
+        return [b"error page"]
+
+    sent = asyncio.run(call(WSGIBridge(app, threads=1)))
+    assert sent[0]["status"] == 500
+    assert sent[1]["body"] == b"error page"
+
+
+def test_exc_info_after_headers_sent_reraises(WSGIBridge):
+    seen = []
+
+    def app(_environ, start_response):
+        write = start_response("200 OK", [("Content-Type", "text/plain")])
+        write(b"part")
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            try:
+                start_response("500 INTERNAL SERVER ERROR", [], sys.exc_info())
+            except ValueError as e:
+                seen.append(e)
+                raise
+        return []
+
+    sent = asyncio.run(call(WSGIBridge(app, threads=1)))
+    assert len(seen) == 1 and str(seen[0]) == "boom"
+    assert sent[0]["status"] == 200      # ответ не подменён: заголовки уже ушли
+    assert sent[1]["body"] == b"part"
+    assert sent[-1]["more_body"] is False
@@ -0,0 +1,77 @@
+"""Пароли: PBKDF2 с солью, перехэширование старых записей, кэш проверок."""
+import auth
+from auth import AuthCache, check_password, hash_password, needs_rehash
+
+
+def test_pbkdf2_hash():
+    a, b = hash_password("секрет", 1000), hash_password("секрет", 1000)
+    assert a.startswith("pbkdf2:sha256:1000$")
+    assert a != b                                  # соль у каждой записи своя
+    assert "секрет" not in a
+    assert check_password(a, "секрет") and check_password(b, "секрет")
+    assert not check_password(a, "Секрет")
+    assert not needs_rehash(a, 1000)
+    assert needs_rehash(a, 2000)                   # сменилась стоимость
+
+
+def test_legacy_plaintext():
+    assert check_password("qwerty", "qwerty")
+    assert not check_password("qwerty", "qwerty ")
+    assert not check_password("", "")
+    assert not check_password(None, "x")
+    assert needs_rehash("qwerty", 1000)
+
+
+def test_auth_cache(monkeypatch):
+    calls = []
+
+    def counted(stored, password):
+        calls.append(password)
+        return check_password(stored, password)
+
+    monkeypatch.setattr(auth, "check_password", counted)
+    cache = AuthCache("secret")
+    stored = hash_password("p", 1000)
+    assert cache.verify("u", "p", stored)
+    assert cache.verify("u", "p", stored)
+    assert not cache.verify("u", "bad", stored)
+    assert not cache.verify("u", "bad", stored)    # неудачи тоже кэшируются
+    assert len(calls) == 2
+    # пароль сменили — запись в кэше больше не годится
+    assert not cache.verify("u", "p", hash_password("new", 1000))
+    assert len(calls) == 3
+
+
+def test_login_rehashes_plaintext_password(main, monkeypatch):
+    monkeypatch.setattr(main, "PASSWORD_HASH_ITERATIONS", 1000)
+    with main.app.app_context():
+        main.db.session.add(main.User(login="legacy", password="old-secret"))
+        main.db.session.commit()
+
+    c = main.app.test_client()
+    r = c.post("/login", data={"login": "legacy", "password": "wrong"})
+    assert r.status_code == 200
+    assert "Неверный логин или пароль" in r.get_data(as_text=True)
+    with main.app.app_context():
+        assert main.User.query.filter_by(login="legacy").one().password == "old-secret"
+
+    r = c.post("/login", data={"login": "legacy", "password": "old-secret"})
+    assert r.status_code == 302 and r.headers["Location"].endswith("/chat")
+    with main.app.app_context():
+        stored = main.User.query.filter_by(login="legacy").one().password
+    assert stored.startswith("pbkdf2:sha256:1000$")
+    assert check_password(stored, "old-secret")
+
+    # после перехэширования вход работает по новой записи
+    c = main.app.test_client()
+    r = c.post("/login", data={"login": "legacy", "password": "old-secret"})
+    assert r.status_code == 302
+
+
+def test_register_stores_hash(main):
+    c = main.app.test_client()
+    r = c.post("/register", data={"login": "fresh", "password": "pw"})
+    assert r.status_code == 302
+    with main.app.app_context():
+        stored = main.User.query.filter_by(login="fresh").one().password
+    assert stored != "pw" and not needs_rehash(stored, main.PASSWORD_HASH_ITERATIONS)
@@ -0,0 +1,115 @@
+"""Кэш ответов: вытеснение LRU, TTL и общее хранилище для воркеров."""
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+import cache
+from cache import MISS, LayeredCache, LRUCache, SharedStore
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Clock:
+    """Подменяет cache.time: время двигает тест."""
+
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    c = Clock()
+    monkeypatch.setattr(cache, "time", c)
+    return c
+
+
+@pytest.mark.usefixtures("clock")
+def test_lru_evicts_least_recently_used():
+    c = LRUCache(maxsize=3, ttl=60)
+    for key in "abc":
+        c.set(key, key.upper())
+    assert c.get("a") == "A"          # a теперь свежее b
+    c.set("d", "D")
+    assert c.get("b") is MISS
+    assert [c.get(k) for k in "acd"] == ["A", "C", "D"]
+    c.set("c", "C2")                  # перезапись тоже освежает ключ
+    c.set("e", "E")
+    assert c.get("a") is MISS and c.get("c") == "C2"
+    assert len(c) == 3
+    assert c.stats()["evictions"] == 2
+
+
+def test_lru_ttl(clock):
+    c = LRUCache(maxsize=10, ttl=60)
+    c.set("a", 1)
+    c.set("b", None, ttl=5)           # отрицательный ответ живёт меньше
+    assert c.get("b") is None
+    clock.now += 5
+    assert c.get("b") is MISS and c.get("a") == 1
+    clock.now += 55
+    assert c.get("a") is MISS
+    assert len(c) == 0
+    assert c.stats()["expired"] == 2
+
+
+@pytest.mark.usefixtures("clock")
+def test_lru_clear_prefix():
+    c = LRUCache()
+    c.set("answer:x", 1)
+    c.set("wiki:x", 2)
+    c.clear("answer:")
+    assert c.get("answer:x") is MISS and c.get("wiki:x") == 2
+
+
+def test_shared_store_between_processes(tmp_path):
+    path = str(tmp_path / "shared.sqlite3")
+    store = SharedStore(path)
+    store.set("answer:привет", {"text": "Привет!"}, ttl=60)
+    script = ("import sys; from cache import SharedStore; "
+              "s = SharedStore(sys.argv[1]); print(s.get('answer:привет')['text']); "
+              "s.set('answer:пока', 'Пока!', 60); s.set('answer:старое', 'x', -1)")
+    out = subprocess.run([sys.executable, "-c", script, path], cwd=ROOT,
+                         capture_output=True, text=True, check=True).stdout
+    assert out.strip() == "Привет!"
+    assert store.get("answer:пока") == "Пока!"
+    assert store.get("answer:старое") is MISS
+    store.purge_expired()
+    assert store._conn().execute("SELECT count(*) FROM kv").fetchone()[0] == 2
+
+
+def test_layered_cache_shares_values_and_invalidation(tmp_path):
+    path = str(tmp_path / "shared.sqlite3")
+    a = LayeredCache(LRUCache(ttl=60), SharedStore(path), sync_interval=0)
+    b = LayeredCache(LRUCache(ttl=60), SharedStore(path), sync_interval=0)
+    assert b.get("answer:q") is MISS
+    a.set("answer:q", "ответ", ttl=30)
+    a.set("wiki:q", "статья")
+    assert b.get("answer:q") == "ответ"
+    # локальная копия во втором воркере живёт не дольше общей
+    assert 0 < b.local._data["answer:q"][0] - time.monotonic() <= 30
+
+    a.clear("answer:")
+    assert b.get("answer:q") is MISS
+    assert len(b.local) == 0          # новое поколение сбросило весь LRU воркера
+    assert b.get("wiki:q") == "статья"
+
+
+def test_layered_cache_notices_clear_after_sync_interval(tmp_path, clock):
+    path = str(tmp_path / "shared.sqlite3")
+    a = LayeredCache(LRUCache(ttl=60), SharedStore(path), sync_interval=1.0)
+    b = LayeredCache(LRUCache(ttl=60), SharedStore(path), sync_interval=1.0)
+    b.set("answer:q", "старый")
+    assert b.get("answer:q") == "старый"
+    a.clear("answer:")
+    assert b.get("answer:q") == "старый"   # поколение ещё не перечитано
+    clock.now += 1.0
+    assert b.get("answer:q") is MISS
@@ -0,0 +1,84 @@
+"""Сжатие базы знаний: из дубликатов остаётся правильная строка."""
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, insert, select
+
+from compaction import compact, dedup_key
+
+NOW = datetime.utcnow()
+OLD = NOW - timedelta(days=400)
+
+
+@pytest.fixture
+def kb(main, tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'kb.sqlite3'}")
+    k, tb = main.Knowledge.__table__, main.KnowledgeTombstone.__table__
+    k.metadata.create_all(engine, tables=[k, tb])
+
+    def run(rows, **kwargs):
+        with engine.begin() as conn:
+            defaults = {"hits": 0, "last_used": None, "created_at": NOW}
+            conn.execute(insert(k), [{**defaults, **r} for r in rows])
+        report = compact(engine, k, tb, main.PLACEHOLDER_ANSWER, main.normalize_text,
+                         batch=2, **kwargs)
+        with engine.connect() as conn:
+            kept = {r.phrase: r for r in conn.execute(select(k))}
+            tombs = conn.execute(select(tb.c.knowledge_id, tb.c.phrase)).all()
+        return report, kept, tombs
+
+    yield run
+    engine.dispose()
+
+
+def test_dedup_key():
+    assert dedup_key("Ёлка, ёлка!") == dedup_key("елка елка") == "елка елка"
+
+
+def test_duplicate_group_keeps_real_answer_then_hits_then_oldest(kb, main):
+    placeholder = main.PLACEHOLDER_ANSWER
+    report, kept, tombs = kb([
+        {"id": 1, "phrase": "привет!", "answer": placeholder, "hits": 50},
+        {"id": 2, "phrase": "привет", "answer": "Здравствуйте", "hits": 1},
+        {"id": 3, "phrase": "привет?", "answer": "Привет!", "hits": 7},
+        {"id": 4, "phrase": "погода ёж", "answer": "Солнечно", "hits": 2},
+        {"id": 5, "phrase": "погода еж", "answer": "Дождь", "hits": 2},
+        {"id": 6, "phrase": "погода, ёж", "answer": "Снег", "hits": 2},
+    ], idle_days=0)
+    # с настоящим ответом важнее попаданий; среди равных — больше попаданий
+    assert kept["привет?"].answer == "Привет!"
+    assert kept["привет?"].hits == 7 + 50 + 1       # попадания слитых прибавлены
+    # при равенстве остаётся самая старая строка
+    assert kept["погода ёж"].answer == "Солнечно"
+    assert kept["погода ёж"].hits == 6
+    assert len(kept) == 2
+    assert report["removed"]["duplicate"] == 4
+    assert sorted(kid for kid, _phrase in tombs) == [1, 2, 5, 6]
+
+
+def test_short_placeholder_idle_and_renamed(kb, main):
+    placeholder = main.PLACEHOLDER_ANSWER
+    report, kept, tombs = kb([
+        {"id": 1, "phrase": "ок", "answer": "Ок"},
+        {"id": 2, "phrase": "старый вопрос", "answer": placeholder, "created_at": OLD},
+        {"id": 3, "phrase": "свежая заглушка", "answer": placeholder},
+        {"id": 4, "phrase": "забытый вопрос", "answer": "ответ", "created_at": OLD},
+        {"id": 5, "phrase": "спрашивали", "answer": "да", "hits": 3, "created_at": OLD},
+        {"id": 6, "phrase": "Лишние   Пробелы", "answer": "ответ", "hits": 4},
+    ], placeholder_days=7, idle_days=180)
+    removed = {"placeholder": 1, "short": 1, "duplicate": 0, "idle": 1}
+    assert report["removed"] == removed
+    assert report["renamed"] == 1
+    assert set(kept) == {"свежая заглушка", "спрашивали", "лишние пробелы"}
+    assert kept["лишние пробелы"].id > 6 and kept["лишние пробелы"].hits == 4
+    assert sorted(tombs) == [(1, "ок"), (2, "старый вопрос"),
+                             (4, "забытый вопрос"), (6, "Лишние   Пробелы")]
+
+
+def test_dry_run_only_reports(kb):
+    report, kept, tombs = kb([
+        {"id": 1, "phrase": "дубль", "answer": "а"},
+        {"id": 2, "phrase": "дубль!", "answer": "б"},
+    ], dry_run=True)
+    assert report["removed"]["duplicate"] == 1
+    assert len(kept) == 2 and not tombs
@@ -0,0 +1,115 @@
+"""Контекст разговора: только для уточнений и только когда дошло до LLM."""
+import pytest
+
+from dialog import is_follow_up
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("Что такое квазар", False),
+    ("Кто написал «Войну и мир»?", False),
+    ("Москва", False),
+    ("а он где живёт?", True),
+    ("сколько там жителей", True),
+    ("почему?", True),
+    ("Подробнее", True),
+    ("и сколько это стоит", True),
+])
+def test_is_follow_up(text, expected):
+    assert is_follow_up(text) is expected
+
+
+@pytest.fixture
+def conversation(main):
+    """Разговор с одной парой реплик; возвращает функцию «задать вопрос» -> id ответа."""
+    with main.app.app_context():
+        user = main.User(login=f"dialog{main.User.query.count()}", password="p")
+        main.db.session.add(user)
+        main.db.session.commit()
+        conv = main.get_conversation(user)
+        ai = main.add_question(conv, "Расскажи про квазары")
+        ai.text = "Квазары — очень яркие ядра далёких галактик."
+        main.db.session.commit()
+        conv_id = conv.id
+
+    def ask(text):
+        with main.app.app_context():
+            return main.add_question(main.db.session.get(main.Conversation, conv_id), text).id
+    return ask
+
+
+@pytest.fixture
+def history_calls(main, monkeypatch):
+    calls = []
+    real = main.dialog_history
+
+    def spy(message_id):
+        calls.append(message_id)
+        return real(message_id)
+    monkeypatch.setattr(main, "dialog_history", spy)
+    return calls
+
+
+def llm_messages(upstream):
+    return [req["messages"] for method, req in upstream.requests if method == "POST"]
+
+
+def test_standalone_question_is_cached_without_context(main, upstream, conversation, history_calls):
+    upstream.answer = "Пульсар: нейтронная звезда."
+    with main.app.app_context():
+        answer = main.smart_answer_learn("Пульсар это звезда или нет", message_id=conversation("Пульсар"))
+        assert answer == "Пульсар: нейтронная звезда."
+    # «это» делает вопрос уточнением; без местоимений контекст не читается
+    upstream.requests.clear()
+    upstream.answer = "Блазар: активное ядро галактики."
+    with main.app.app_context():
+        answer = main.smart_answer_learn("Блазар в созвездии Ящерицы", message_id=conversation("Блазар в созвездии Ящерицы"))
+    assert answer == "Блазар: активное ядро галактики."
+    assert len(history_calls) == 1
+    assert [len(m) for m in llm_messages(upstream)] == [2]   # системный промпт и вопрос
+    assert main.answer_cache.get("answer:" + main.normalize_text("Блазар в созвездии Ящерицы")) == answer
+
+
+def test_follow_up_gets_context_and_is_not_cached(main, upstream, conversation, history_calls):
+    upstream.answer = "Самый близкий примерно в 600 млн световых лет."
+    with main.app.app_context():
+        answer = main.smart_answer_learn("а они далеко от нас", message_id=conversation("а они далеко от нас"))
+    assert answer == "Самый близкий примерно в 600 млн световых лет."
+    assert len(history_calls) == 1
+    (messages,) = llm_messages(upstream)
+    assert "Квазары — очень яркие ядра далёких галактик." in [m["content"] for m in messages]
+    assert main.answer_cache.get("answer:" + main.normalize_text("а они далеко от нас")) is main.MISS
+
+
+def test_wikipedia_answer_skips_context(main, upstream, conversation, history_calls):
+    upstream.wiki["а тот магнетар"] = "Магнетар — нейтронная звезда с очень сильным магнитным полем."
+    with main.app.app_context():
+        answer = main.smart_answer_learn("а тот магнетар", message_id=conversation("а тот магнетар"))
+    assert "магнитным полем" in answer
+    assert history_calls == []
+    assert llm_messages(upstream) == []
+
+
+def test_concurrent_first_conversation(main, monkeypatch):
+    """Второй из одновременных первых запросов не падает на уникальном ключе,
+    а берёт разговор, созданный первым."""
+    with main.app.app_context():
+        user = main.User(login="dialog-race", password="p")
+        main.db.session.add(user)
+        main.db.session.commit()
+        first = main.get_conversation(user)
+
+        real = main.Conversation.query
+        missed = []
+
+        class Racing:
+            # первый SELECT не видит разговор: его ещё не закоммитил соседний запрос
+            def filter_by(self, **kwargs):
+                if not missed:
+                    missed.append(kwargs)
+                    return real.filter_by(id=-1)
+                return real.filter_by(**kwargs)
+
+        monkeypatch.setattr(main.Conversation, "query", Racing())
+        conv = main.get_conversation(user)
+        assert missed and conv.id == first.id
+        assert main.Conversation.query.filter_by(user_id=user.id).count() == 1
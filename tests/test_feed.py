@@ -0,0 +1,146 @@
+"""Лента заявок админки: rev из триггеров, ожидание изменений и SSE."""
+import json
+import threading
+import time
+
+import pytest
+
+from feed import FeedWatcher, changes, latest
+
+ADMIN = {"login": "Artem2013", "password": "Art2013Ar"}
+
+
+def add_tickets(main, *texts):
+    with main.app.app_context():
+        rows = [main.Support(text=t) for t in texts]
+        main.db.session.add_all(rows)
+        main.db.session.commit()
+        return [r.id for r in rows]
+
+
+def rev_of(main, sid):
+    with main.app.app_context():
+        return main.db.session.get(main.Support, sid).rev
+
+
+def events(body):
+    """[(id, event, data)] из текста потока SSE."""
+    out = []
+    for block in body.split("\n\n"):
+        lines = [line for line in block.splitlines() if ": " in line]
+        fields = dict(line.split(": ", 1) for line in lines)
+        if "event" in fields:
+            out.append((int(fields["id"]), fields["event"], json.loads(fields["data"])))
+    return out
+
+
+def test_rev_triggers(main):
+    a, b = add_tickets(main, "первая", "вторая")
+    assert 0 < rev_of(main, a) < rev_of(main, b)
+    with main.app.app_context():
+        main.db.session.get(main.Support, a).answer = "ответ"
+        main.db.session.commit()
+        top = latest(main.db.session, main.Support.__table__)
+    assert rev_of(main, a) == top > rev_of(main, b)
+    with main.app.app_context():
+        main.db.session.get(main.Support, b).user_id = 1   # не отслеживаемая колонка
+        main.db.session.commit()
+        assert latest(main.db.session, main.Support.__table__) == top
+        rows = changes(main.db.session, rev_of(main, b) - 1)
+    assert [r["id"] for r in rows] == [b, a]               # по возрастанию rev
+    assert rows[1]["answer"] == "ответ" and rows[1]["is_tariff"] is False
+
+
+def test_watcher_wakes_on_notify(main):
+    with main.app.app_context():
+        engine = main.db.engine
+        cursor = latest(main.db.session, main.Support.__table__)
+    watcher = FeedWatcher(engine, main.Support.__table__, interval=3600)
+    try:
+        assert not watcher.wait(cursor, 0.1)
+        woke = []
+        t = threading.Thread(target=lambda: woke.append(watcher.wait(cursor, 5)))
+        t.start()
+        while not watcher.waiting:
+            time.sleep(0.01)
+        add_tickets(main, "из этого воркера")
+        watcher.notify()
+        t.join(5)
+        assert woke == [True]
+        assert watcher.waiting == 0
+    finally:
+        watcher.close()
+
+
+def test_watcher_polls_for_other_workers(main):
+    with main.app.app_context():
+        engine = main.db.engine
+        cursor = latest(main.db.session, main.Support.__table__)
+    watcher = FeedWatcher(engine, main.Support.__table__, interval=0.05)
+    try:
+        assert not watcher.wait(cursor, 0.1)
+        polls = watcher.polls
+        add_tickets(main, "из другого воркера")   # без notify()
+        assert watcher.wait(cursor, 5)
+        assert watcher.polls > polls
+        time.sleep(0.15)
+        polls = watcher.polls
+        time.sleep(0.2)
+        assert watcher.polls == polls             # никто не ждёт — в БД не ходит
+    finally:
+        watcher.close()
+
+
+@pytest.fixture
+def admin(main, monkeypatch):
+    monkeypatch.setattr(main, "FEED_STREAM_SECONDS", 0.5)
+    c = main.app.test_client()
+    c.post("/login", data=ADMIN)
+    return c
+
+
+def test_feed_stream_from_cursor(main, admin):
+    with main.app.app_context():
+        cursor = latest(main.db.session, main.Support.__table__)
+    a, b = add_tickets(main, "поток один", "поток два")
+    r = admin.get(f"/admin/feed?cursor={cursor}")
+    assert r.mimetype == "text/event-stream"
+    body = r.get_data(as_text=True)
+    assert body.startswith("retry: 3000\n\n")
+    got = events(body)
+    assert [(e, d["id"]) for _rev, e, d in got] == [("ticket", a), ("ticket", b)]
+    assert [rev for rev, _e, _d in got] == [rev_of(main, a), rev_of(main, b)]
+
+    # переподключение продолжает с Last-Event-ID
+    body = admin.get("/admin/feed", headers={"Last-Event-ID": str(rev_of(main, a))})
+    assert [d["id"] for _rev, _e, d in events(body.get_data(as_text=True))] == [b]
+
+
+def test_feed_stream_delivers_answer(main, admin, monkeypatch):
+    monkeypatch.setattr(main, "FEED_STREAM_SECONDS", 5)
+    (sid,) = add_tickets(main, "ждёт ответа")
+    got, ready = [], threading.Event()
+
+    def reader():
+        resp = admin.get("/admin/feed", buffered=False)
+        ready.set()
+        for chunk in resp.response:
+            got.extend(events(chunk.decode() if isinstance(chunk, bytes) else chunk))
+            if got:
+                resp.close()
+                return
+
+    t = threading.Thread(target=reader)
+    t.start()
+    ready.wait(5)
+    time.sleep(0.2)
+    other = main.app.test_client()
+    other.post("/login", data=ADMIN)
+    r = other.post(f"/admin/support/{sid}/answer", data={"answer": "готово"})
+    assert r.get_json()["answer"] == "готово"
+    t.join(5)
+    assert [(d["id"], d["answer"]) for _rev, _e, d in got] == [(sid, "готово")]
+
+
+def test_feed_requires_admin(main):
+    assert main.app.test_client().get("/admin/feed").status_code == 403
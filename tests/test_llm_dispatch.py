@@ -0,0 +1,93 @@
+"""LLMDispatcher и CircuitBreaker."""
+import time
+
+from llm_dispatch import CircuitBreaker, LLMDispatcher
+
+
+def recorder(status=200):
+    calls = []
+
+    def call(prompt, *_context):
+        calls.append(prompt)
+        return status, "ответ на " + prompt, None
+    return call, calls
+
+
+def half_open(reset_timeout=0.05):
+    breaker = CircuitBreaker(failures=1, reset_timeout=reset_timeout)
+    breaker.failure()
+    time.sleep(reset_timeout * 1.5)
+    assert breaker.state == "half-open"
+    return breaker
+
+
+def test_cancelled_probe_is_released():
+    call, calls = recorder()
+    d = LLMDispatcher(call, window=0.1, breaker=half_open())
+    probe = d.submit("проба", "system")
+    assert probe.cancel()            # проигравший в гонке снят, пока ждал окна
+    assert d.submit("второй", "system").result(2) is None   # проба ещё не решена
+    time.sleep(0.2)
+    assert d.submit("третий", "system").result(2) == "ответ на третий"
+    assert calls == ["третий"]
+    assert d.breaker.state == "closed"
+
+
+def test_probe_outcome_closes_or_reopens():
+    call, _calls = recorder(status=503)
+    d = LLMDispatcher(call, window=0, retries=0, breaker=half_open())
+    assert d.submit("проба", "system").result(2) is None
+    assert d.breaker.state == "open"
+    assert d.breaker.opened == 1
+
+
+# --- Против фейкового OpenAI-совместимого сервера (conftest.upstream)
+
+def posts(upstream):
+    return [req for method, req in upstream.requests if method == "POST"]
+
+
+def test_identical_prompts_are_coalesced(main, upstream):
+    d = LLMDispatcher(main._llm_call, window=0.1)
+    futs = [d.submit("один", "system"), d.submit("один", "system"), d.submit("другой", "system")]
+    assert [f.result(5) for f in futs] == ["Ответ модели."] * 3
+    assert sorted(req["messages"][-1]["content"] for req in posts(upstream)) == ["другой", "один"]
+    assert d.coalesced == 1
+
+
+def test_429_halves_the_limit_and_success_raises_it(main, upstream):
+    upstream.status, upstream.retry_after = 429, "0"
+    d = LLMDispatcher(main._llm_call, max_concurrency=8, window=0, retries=1)
+    assert d.submit("вопрос", "system").result(5) is None
+    assert len(posts(upstream)) == 2          # один повтор
+    assert d.throttled == 2 and d.limit == 2.0
+    assert d.breaker.state == "closed"        # 429 — не авария сервиса
+    upstream.status = 200
+    assert d.submit("вопрос", "system").result(5) == "Ответ модели."
+    assert d.limit == 2.5
+
+
+def test_breaker_opens_on_5xx_and_recovers(main, upstream):
+    upstream.status = 503
+    d = LLMDispatcher(main._llm_call, window=0, retries=0,
+                      breaker=CircuitBreaker(failures=2, reset_timeout=0.2))
+    d.backoff = d._penalty = 0.01
+    assert [d.submit(q, "system").result(5) for q in ("а", "б")] == [None, None]
+    assert d.breaker.state == "open"
+    assert d.submit("в", "system").result(5) is None
+    assert len(posts(upstream)) == 2          # при разомкнутом выключателе запрос не ушёл
+    time.sleep(0.25)
+    upstream.status = 200
+    assert d.submit("г", "system").result(5) == "Ответ модели."
+    assert d.breaker.state == "closed"
+
+
+def test_stream_resolves_the_probe_on_http_errors(main, upstream, monkeypatch):
+    d = LLMDispatcher(main._llm_call, breaker=half_open())
+    monkeypatch.setattr(main, "llm_dispatch", d)
+    upstream.status = 400                     # запрос отклонён, сервис жив: проба снимается
+    assert list(main.ask_llm_stream("вопрос")) == []
+    assert d.breaker.state == "half-open"
+    upstream.status, upstream.retry_after = 429, "0"
+    assert list(main.ask_llm_stream("вопрос")) == []   # проба прошла и провалилась
+    assert d.breaker.state == "open" and d.throttled == 1
@@ -0,0 +1,17 @@
+"""Слоты тарифов на вызовы LLM не теряются, если вызов не удалось поставить."""
+import pytest
+
+
+def test_slot_released_when_submit_fails(main, monkeypatch):
+    def broken(*_args, **_kwargs):
+        raise RuntimeError("queue closed")
+    monkeypatch.setattr(main.llm_dispatch, "submit", broken)
+    slots = main.TARIFF_LIMITS["demo"][2]
+    for _ in range(slots + 1):
+        with pytest.raises(RuntimeError):
+            main._submit_llm("вопрос", "demo", wait=False)
+    # Все слоты свободны: занять их без ожидания можно
+    for _ in range(slots):
+        main.llm_slots.acquire("demo", 0)
+    for _ in range(slots):
+        main.llm_slots.release("demo")
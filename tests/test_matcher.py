@@ -0,0 +1,77 @@
+"""PhraseMatcher против прежнего перебора «первое совпадение по рангу»."""
+import random
+
+import pytest
+
+from matcher import ANCHOR, PhraseMatcher
+
+
+def linear(rows, text):
+    """Прежний поиск: строки по порядку ранга, первая входящая в текст."""
+    for rank, phrase, value in sorted(rows.values()):
+        if phrase in text:
+            return rank, value
+    return None
+
+
+def random_text(rng, alphabet, n):
+    return "".join(rng.choice(alphabet) for _ in range(n))
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_matches_linear_scan(seed):
+    rng = random.Random(seed)
+    alphabet = "абв г"   # маленький алфавит — много пересечений и общих якорей
+    m, rows = PhraseMatcher(), {}
+    for step in range(3000):
+        op = rng.random()
+        if op < 0.5 or not rows:
+            # длины по обе стороны от ANCHOR, включая пустую фразу
+            phrase = random_text(rng, alphabet, rng.randint(0, ANCHOR + 4))
+            # ранги уникальны, как (0, id) и (1, i) в main.py, но идут вразброс
+            rank = (rng.randint(0, 1), rng.randint(0, 50), step)
+            value = f"v{step}"
+            m.add(phrase, value, rank)
+            cur = rows.get(phrase)
+            if cur is None or rank < cur[0]:
+                rows[phrase] = (rank, phrase, value)
+        elif op < 0.7:
+            phrase = rng.choice(list(rows))
+            rank = rows[phrase][0] if rng.random() < 0.5 else None
+            m.discard(phrase, rank)
+            del rows[phrase]
+        elif op < 0.75:
+            # чужой ранг — запись остаётся
+            phrase = rng.choice(list(rows))
+            m.discard(phrase, (2, 0, 0))
+        else:
+            if rng.random() < 0.3:
+                text = rng.choice(list(rows))   # текст ровно совпадает с фразой
+            else:
+                text = random_text(rng, alphabet, rng.randint(0, 20))
+            assert m.match(text) == linear(rows, text), (text, step)
+        assert len(m) == len(rows)
+
+
+def test_priority_and_substring():
+    m = PhraseMatcher()
+    m.add("погода", "smart", (1, 0))
+    m.add("какая погода", "kb-2", (0, 2))
+    m.add("погода в москве", "kb-1", (0, 1))
+    assert m.match("погода") == ((1, 0), "smart")
+    assert m.match("какая погода") == ((0, 2), "kb-2")
+    assert m.match("скажи, какая погода в москве?") == ((0, 1), "kb-1")
+    assert m.match("погод") is None
+
+    # повтор с большим рангом не вытесняет запись, с меньшим — заменяет
+    m.add("погода", "smart-2", (1, 5))
+    assert m.match("погода") == ((1, 0), "smart")
+    m.add("погода", "kb-0", (0, 0))
+    assert m.match("погода") == ((0, 0), "kb-0")
+
+    m.discard("погода в москве", (0, 1))
+    assert m.match("какая погода в москве") == ((0, 0), "kb-0")
+    m.discard("погода")
+    assert m.match("погода в москве") is None
+    m.clear()
+    assert len(m) == 0 and m.match("какая погода") is None
@@ -0,0 +1,101 @@
+"""/metrics: текстовый формат Prometheus 0.0.4."""
+import re
+
+import pytest
+
+from metrics import Registry
+
+NAME = r"[a-zA-Z_:][a-zA-Z0-9_:]*"
+LABEL = r'[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\\n]|\\.)*"'
+SAMPLE = re.compile(rf"^({NAME})(\{{{LABEL}(?:,{LABEL})*\}})? (\S+)$")
+
+
+def parse(text):
+    """Проверяет синтаксис; возвращает {метрика: тип} и [(имя, метки, значение)]."""
+    assert text.endswith("\n")
+    types, samples = {}, []
+    for line in text.splitlines():
+        if line.startswith("# HELP "):
+            continue
+        if line.startswith("# TYPE "):
+            _, _, name, kind = line.split(" ")
+            assert name not in types
+            types[name] = kind
+            continue
+        m = SAMPLE.match(line)
+        assert m, line
+        name, labels, value = m.groups()
+        base = re.sub(r"_(bucket|sum|count)$", "", name) if name not in types else name
+        assert base in types, f"{name} без # TYPE"
+        samples.append((name, labels or "", float(value.replace("+Inf", "inf"))))
+    return types, samples
+
+
+def test_counter_format_and_escaping():
+    reg = Registry()
+    c = reg.counter("app_requests_total", "Запросы", ["endpoint", "status"])
+    c.inc(endpoint="/chat", status=200)
+    c.inc(2, endpoint="/chat", status=200)
+    c.inc(endpoint='say "hi"\\\n', status=500)
+    assert c.value(endpoint="/chat", status=200) == 3
+    text = reg.render()
+    assert ("# HELP app_requests_total Запросы\n"
+            "# TYPE app_requests_total counter\n") in text
+    assert 'app_requests_total{endpoint="/chat",status="200"} 3\n' in text
+    escaped = 'endpoint="say \\"hi\\"\\\\\\n",status="500"'
+    assert "app_requests_total{" + escaped + "} 1\n" in text
+    parse(text)
+
+
+def test_histogram_buckets_are_cumulative():
+    reg = Registry()
+    h = reg.histogram("app_seconds", "Время", ["stage"], buckets=(0.1, 1))
+    for v in (0.05, 0.1, 0.5, 3):
+        h.observe(v, stage="llm")
+    types, samples = parse(reg.render())
+    assert types == {"app_seconds": "histogram"}
+    assert samples == [
+        ("app_seconds_bucket", '{stage="llm",le="0.1"}', 2),
+        ("app_seconds_bucket", '{stage="llm",le="1"}', 3),
+        ("app_seconds_bucket", '{stage="llm",le="+Inf"}', 4),
+        ("app_seconds_sum", '{stage="llm"}', pytest.approx(3.65)),
+        ("app_seconds_count", '{stage="llm"}', 4),
+    ]
+    with h.time(stage="db"):
+        pass
+    assert h.count(stage="db") == 1
+
+
+def test_collectors_and_disabled_registry():
+    reg = Registry()
+    reg.collect("app_queue", "gauge", "Очередь",
+                lambda: [({"name": "llm"}, 3), ({}, 1.5)])
+
+    def broken():
+        raise RuntimeError("boom")
+    reg.collect("app_broken", "gauge", "Сломанный сборщик", broken)
+    text = reg.render()
+    assert 'app_queue{name="llm"} 3\napp_queue 1.5\n' in text
+    types, _ = parse(text)
+    assert types["app_broken"] == "gauge"   # заголовок есть, сэмплов нет
+
+    off = Registry(enabled=False)
+    c = off.counter("x_total", "x")
+    c.inc()
+    with off.histogram("y", "y").time():
+        pass
+    assert c.value() == 0
+    parse(off.render())
+
+
+def test_metrics_endpoint(main):
+    client = main.app.test_client()
+    client.get("/")
+    r = client.get("/metrics")
+    assert r.status_code == 200
+    assert r.mimetype == "text/plain"
+    assert "version=0.0.4" in r.headers["Content-Type"]
+    types, samples = parse(r.get_data(as_text=True))
+    assert types["neiro_requests_total"] == "counter"
+    assert types["neiro_request_seconds"] == "histogram"
+    assert any(name == "neiro_requests_total" for name, _labels, _v in samples)
@@ -0,0 +1,29 @@
+"""Страницы с общим каркасом: navbar из кэша и логин в нём."""
+
+
+def login(main, name):
+    with main.app.app_context():
+        if main.User.query.filter_by(login=name).first() is None:
+            main.db.session.add(main.User(login=name, password=main.make_password("p")))
+            main.db.session.commit()
+    c = main.app.test_client()
+    c.post("/login", data={"login": name, "password": "p"})
+    return c
+
+
+def test_navbar_anonymous(main):
+    html = main.app.test_client().get("/").get_data(as_text=True)
+    assert "<nav" in html and "&lt;nav" not in html
+
+
+def test_navbar_logged_in(main):
+    c = login(main, "navbar")
+    for _ in range(2):   # второй раз — из кэша
+        html = c.get("/chat").get_data(as_text=True)
+        assert "<nav" in html and "&lt;nav" not in html
+
+
+def test_navbar_escapes_login(main):
+    html = login(main, "<b>x</b>").get("/chat").get_data(as_text=True)
+    assert "<nav" in html
+    assert "&lt;b&gt;x&lt;/b&gt;" in html and "<b>x</b>" not in html
@@ -0,0 +1,132 @@
+"""Лимиты тарифов: token bucket, месячные счётчики, слоты LLM."""
+import asyncio
+import threading
+
+import pytest
+
+from quota import ConcurrencyLimit, MonthlyCounter, RateLimiter, SlotBusy
+
+
+def test_token_bucket_burst_and_refill():
+    rl = RateLimiter(rate=0.5, burst=3)      # 30 в минуту, всплеск 3
+    assert [rl.take("u", now=0) for _ in range(3)] == [0, 0, 0]
+    assert rl.take("u", now=0) == pytest.approx(2.0)
+    assert rl.take("u", now=1) == pytest.approx(1.0)
+    assert rl.take("u", now=2) == 0
+    assert rl.take("other", now=2) == 0      # у каждого ключа своё ведро
+    # пополнение не выше burst
+    assert [rl.take("u", now=100) for _ in range(4)][-1] > 0
+
+
+def test_idle_buckets_are_evicted():
+    rl = RateLimiter(rate=1, burst=5)        # window = 5 с
+    for user in range(100):
+        rl.take(user, now=0)
+    rl.take("active", now=0)
+    rl.take("active", now=4)
+    assert len(rl) == 101
+    rl.take("active", now=6)                 # прошло window — чистка
+    assert len(rl) == 1
+    # забытое ведро ведёт себя как полное
+    assert [rl.take(1, now=6) for _ in range(5)] == [0] * 5
+    assert rl.take(1, now=6) > 0
+
+
+class Db:
+    """Таблица usage, общая для нескольких «воркеров»."""
+
+    def __init__(self):
+        self.rows = {}
+        self.loads = 0
+
+    def load(self, key):
+        self.loads += 1
+        return self.rows.get(key, 0)
+
+    def store(self, deltas):
+        for key, n in deltas.items():
+            self.rows[key] = self.rows.get(key, 0) + n
+        return {key: self.rows[key] for key in deltas}
+
+
+def counter(db):
+    c = MonthlyCounter(db.load, db.store, flush_interval=3600)
+    c._ensure_thread = lambda: None          # сбрасываем вручную
+    return c
+
+
+def test_monthly_limit_and_flush():
+    db = Db()
+    a, b = counter(db), counter(db)
+    assert all(a.hit((1, "2026-01"), 3) for _ in range(3))
+    assert not a.hit((1, "2026-01"), 3)
+    assert db.rows == {}                     # прирост копится в памяти
+    a.flush()
+    assert db.rows == {(1, "2026-01"): 3}
+    assert b.used((1, "2026-01")) == 3       # другой воркер видит записанное
+    assert not b.hit((1, "2026-01"), 3)
+
+
+def test_month_rollover_forgets_old_counters():
+    db = Db()
+    c = counter(db)
+    for user in range(10):
+        c.hit((user, "2026-01"))
+    c.evict()
+    assert len(c) == 10                      # нового месяца ещё не было
+    assert c.hit((0, "2026-02"), 1)
+    assert not c.hit((0, "2026-02"), 1)      # новый месяц считается с нуля
+    c.evict()
+    assert len(c) == 11                      # прирост января ещё не записан
+    c.flush()
+    c.evict()
+    assert len(c) == 1
+    assert db.rows[(0, "2026-01")] == 1 and db.rows[(0, "2026-02")] == 1
+    c.hit((5, "2026-02"))
+    assert len(c) == 2
+
+
+def test_slot_busy_and_release():
+    limit = ConcurrencyLimit({"demo": 2, "premium": 0}, timeout=0.05)
+    limit.acquire("demo")
+    with limit.slot("demo"), pytest.raises(SlotBusy), limit.slot("demo"):
+        pass                                 # оба слота заняты
+    # слот освобождён и после исключения внутри блока
+    with pytest.raises(ValueError), limit.slot("demo"):
+        raise ValueError
+    limit.acquire("demo", 0)
+    with pytest.raises(SlotBusy):
+        limit.acquire("demo", 0)
+    limit.release("demo")
+    limit.release("demo")
+    with limit.slot("premium"), limit.slot("premium"):
+        pass                                 # 0 — без лимита
+
+
+def test_waiter_gets_released_slot():
+    limit = ConcurrencyLimit({"demo": 1}, timeout=5)
+    limit.acquire("demo")
+    got = threading.Event()
+
+    def waiter():
+        with limit.slot("demo"):
+            got.set()
+
+    t = threading.Thread(target=waiter)
+    t.start()
+    assert not got.wait(0.05)
+    limit.release("demo")
+    assert got.wait(5)
+    t.join(5)
+
+
+def test_async_slots():
+    async def scenario():
+        limit = ConcurrencyLimit({"demo": 1}, timeout=0.1)
+        async with limit.aslot("demo"):
+            with pytest.raises(SlotBusy):
+                await limit.aacquire("demo")
+        async with limit.aslot("demo"):
+            pass
+
+    asyncio.run(scenario())
@@ -0,0 +1,15 @@
+"""Reresolver: разовый прогон (kb.py reresolve) при RERESOLVE_CONCURRENCY=0."""
+
+
+def test_run_once_without_background_workers(main, monkeypatch):
+    rr = main.reresolver
+    assert rr.concurrency == 0
+    with main.app.app_context():
+        main.db.session.add(main.Knowledge(phrase="плюмбус это", answer=main.PLACEHOLDER_ANSWER, hits=3))
+        main.db.session.commit()
+    monkeypatch.setattr(rr, "resolve", lambda phrase: "Ответ про " + phrase)
+    assert rr.run_once() == 1
+    with main.app.app_context():
+        row = main.Knowledge.query.filter_by(phrase="плюмбус это").one()
+        assert row.answer == "Ответ про плюмбус это"
+        assert row.resolve_after is None
@@ -0,0 +1,75 @@
+"""FuzzyIndex: ранжирование после инкрементальной загрузки и rebuild()."""
+import math
+import random
+
+import pytest
+
+from retrieval import FuzzyIndex, ngrams
+
+WORDS = ("кошка собака рыба ест спит бежит дом река лес молоко быстро утром вечером большой "
+         "маленький красный кот пёс мышь сыр").split()
+
+
+def corpus(seed=3, n=300):
+    rng = random.Random(seed)
+    docs = [" ".join(rng.sample(WORDS, 3)) + " " + rng.choice(("что", "как", "почему")) for _ in range(n)]
+    queries = [" ".join(rng.sample(WORDS, 2)) for _ in range(50)]
+    return docs, queries
+
+
+def exact_top(query, docs, k):
+    """Косинус TF-IDF по idf всего корпуса, перебором."""
+    grams = [ngrams(d) for d in docs]
+    df = {}
+    for g in grams:
+        for t in g:
+            df[t] = df.get(t, 0) + 1
+
+    def vec(gr):
+        w = {t: (1 + math.log(tf)) * (math.log((1 + len(docs)) / (1 + df.get(t, 0))) + 1) for t, tf in gr.items()}
+        norm = math.sqrt(sum(x * x for x in w.values())) or 1.0
+        return {t: x / norm for t, x in w.items()}
+    q = vec(ngrams(query))
+    scores = [sum(q.get(t, 0.0) * x for t, x in vec(g).items()) for g in grams]
+    return sorted(scores, reverse=True)[:k]
+
+
+def top_scores(index, query, k):
+    return [score for _id, score in index.search(query, k)]
+
+
+def test_rebuild_ranks_like_a_fresh_index():
+    docs, queries = corpus()
+    index = FuzzyIndex(max_df=1.0, candidates=len(docs))   # без отсечения: сравниваем веса
+    for i, doc in enumerate(docs):
+        index.add(i, doc)
+    # Ранние документы взвешены по idf почти пустого корпуса
+    assert any(top_scores(index, q, 3) != pytest.approx(exact_top(q, docs, 3)) for q in queries)
+    index.rebuild()
+    for q in queries:
+        assert top_scores(index, q, 3) == pytest.approx(exact_top(q, docs, 3))
+
+
+def test_rebuild_if_stale():
+    index = FuzzyIndex(stale=0.1)
+    for i in range(100):
+        index.add(i, f"вопрос номер {i}")
+    assert index.rebuild_if_stale()
+    assert not index.rebuild_if_stale()
+    for i in range(100, 105):
+        index.add(i, f"вопрос номер {i}")
+    assert not index.rebuild_if_stale()    # 5 из 105 — меньше доли stale
+    for i in range(105, 120):
+        index.add(i, f"вопрос номер {i}")
+    assert index.rebuild_if_stale()
+
+
+def test_sync_phrases_rebuilds_after_full_load(main, monkeypatch):
+    monkeypatch.setattr(main, "FUZZY_THRESHOLD", 0.4)
+    with main.app.app_context():
+        main.db.session.add_all(main.Knowledge(phrase=f"редкий вопрос {i}", answer="ответ") for i in range(30))
+        main.db.session.commit()
+        main._phrases_last_id = None   # как при старте воркера
+        main.sync_phrases()
+    assert len(main._fuzzy) >= 30
+    assert not main._fuzzy.rebuild_if_stale()
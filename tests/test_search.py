@@ -0,0 +1,84 @@
+"""Полнотекстовый поиск админки: триггеры держат FTS5 в согласии с таблицами."""
+from sqlalchemy import text
+
+from search import ensure_fts, fts_query, highlight, search, stem
+
+
+def ids(main, scope, query):
+    with main.app.app_context():
+        rows, _next = search(main.db.session, scope, query)
+    return [r["id"] for r in rows]
+
+
+def test_stemming_and_query():
+    assert stem("кошками") == "кошк"
+    assert stem("кот") == "кот"
+    assert fts_query("Ёжики, в тумане!") == '"ежик"* "в" "туман"*'
+    assert fts_query("?!") is None
+
+
+def test_knowledge_index_follows_update_and_delete(main):
+    with main.app.app_context():
+        row = main.Knowledge(phrase="где живут зюзюки", answer="в норках")
+        main.db.session.add(row)
+        main.db.session.commit()
+        kid = row.id
+    assert ids(main, "knowledge", "зюзюками") == [kid]     # по основе
+    assert ids(main, "knowledge", "норка") == [kid]        # и по ответу
+
+    with main.app.app_context():
+        row = main.db.session.get(main.Knowledge, kid)
+        row.phrase = "где живут бубуки"
+        row.answer = "в ёлках"
+        main.db.session.commit()
+    assert ids(main, "knowledge", "зюзюки") == []
+    assert ids(main, "knowledge", "норках") == []
+    assert ids(main, "knowledge", "бубуки елки") == [kid]  # ё в индексе сведено к е
+
+    with main.app.app_context():
+        # попадания не трогают индекс (триггер только на phrase и answer)
+        main.db.session.get(main.Knowledge, kid).hits = 5
+        main.db.session.commit()
+    assert ids(main, "knowledge", "бубуки") == [kid]
+
+    with main.app.app_context():
+        main.db.session.delete(main.db.session.get(main.Knowledge, kid))
+        main.db.session.commit()
+    assert ids(main, "knowledge", "бубуки") == []
+
+
+def test_support_index_and_ranking(main):
+    with main.app.app_context():
+        a = main.Support(text="не работает хрумхрум", answer=None)
+        b = main.Support(text="вопрос", answer="хрумхрум перезапущен")
+        main.db.session.add_all([a, b])
+        main.db.session.commit()
+        sid_a, sid_b = a.id, b.id
+    # совпадение в тексте заявки весит больше, чем в ответе
+    assert ids(main, "support", "хрумхрум") == [sid_a, sid_b]
+
+    with main.app.app_context():
+        main.db.session.get(main.Support, sid_b).answer = "шмыгоход"
+        main.db.session.commit()
+    assert ids(main, "support", "хрумхрум") == [sid_a]
+    assert ids(main, "support", "шмыгоход") == [sid_b]
+
+
+def test_ensure_fts_rebuilds_missing_triggers(main):
+    with main.app.app_context():
+        main.db.session.add(main.Knowledge(phrase="тыгыдык до сброса", answer="ответ"))
+        main.db.session.commit()
+        engine = main.db.engine
+        with engine.begin() as conn:
+            conn.execute(text("DROP TRIGGER knowledge_fts_ai"))
+            conn.execute(text(
+                "INSERT INTO knowledge (phrase, answer, hits, resolve_attempts)"
+                " VALUES ('тыгыдык без триггера', 'ответ', 0, 0)"))
+        assert ensure_fts(engine) == ["knowledge"]
+        assert ensure_fts(engine) == []
+    assert len(ids(main, "knowledge", "тыгыдык")) == 2
+
+
+def test_highlight_escapes():
+    html = str(highlight("<b>Ёжик</b> и ежи", "ежики"))
+    assert html == "&lt;b&gt;<mark>Ёжик</mark>&lt;/b&gt; и ежи"
@@ -0,0 +1,108 @@
+"""Склейка одинаковых запросов: один вызов, общий результат и общее исключение."""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from singleflight import AsyncSingleFlight, SingleFlight
+
+WAITERS = 8
+
+
+def run_concurrently(sf, key, fn):
+    """Лидер и WAITERS ждущих; fn отпускается, когда все ждущие встали в очередь."""
+    results, errors = [], []
+
+    def worker():
+        try:
+            results.append(sf.do(key, fn))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(WAITERS + 1)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(10)
+    return results, errors
+
+
+def gated(sf, key, calls, outcome):
+    def fn():
+        calls.append(1)
+        deadline = time.monotonic() + 5
+        while sf._calls[key].waiters < WAITERS and time.monotonic() < deadline:
+            time.sleep(0.001)
+        return outcome()
+    return fn
+
+
+def test_concurrent_calls_share_one_execution():
+    sf, calls = SingleFlight(), []
+    results, errors = run_concurrently(sf, "q", gated(sf, "q", calls, lambda: "ответ"))
+    assert not errors
+    assert len(calls) == 1
+    assert results.count(("ответ", False)) == 1
+    assert results.count(("ответ", True)) == WAITERS
+    assert sf.in_flight() == 0
+
+
+def test_exception_reaches_every_waiter():
+    sf, calls = SingleFlight(), []
+    boom = RuntimeError("upstream down")
+
+    def fail():
+        raise boom
+
+    results, errors = run_concurrently(sf, "q", gated(sf, "q", calls, fail))
+    assert len(calls) == 1
+    assert not results
+    assert len(errors) == WAITERS + 1 and all(e is boom for e in errors)
+    # ошибка не кэшируется: следующий вызов выполняется заново
+    assert sf.do("q", lambda: "снова") == ("снова", False)
+    assert sf.in_flight() == 0
+
+
+def test_different_keys_run_separately():
+    sf = SingleFlight()
+    assert sf.do("a", lambda: 1) == (1, False)
+    assert sf.do("b", lambda: 2) == (2, False)
+
+
+def test_async_single_flight():
+    async def scenario():
+        sf, calls = AsyncSingleFlight(), []
+        gate = asyncio.Event()
+
+        async def fetch(value):
+            calls.append(value)
+            await gate.wait()
+            return value
+
+        tasks = [asyncio.create_task(sf.do("q", fetch, i)) for i in range(WAITERS + 1)]
+        await asyncio.sleep(0)
+        assert sf.in_flight() == 1
+        gate.set()
+        results = await asyncio.gather(*tasks)
+        assert calls == [0]
+        assert results == [(0, False)] + [(0, True)] * WAITERS
+
+        async def fail():
+            await asyncio.sleep(0)
+            raise ValueError("bad")
+
+        tasks = [asyncio.create_task(sf.do("q", fail)) for _ in range(3)]
+        outcomes = await asyncio.gather(*tasks, return_exceptions=True)
+        assert all(isinstance(o, ValueError) for o in outcomes)
+        assert sf.in_flight() == 0
+
+    asyncio.run(scenario())
+
+
+def test_async_leader_error_without_waiters():
+    async def fail():
+        raise KeyError("x")
+
+    with pytest.raises(KeyError):
+        asyncio.run(AsyncSingleFlight().do("q", fail))
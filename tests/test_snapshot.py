@@ -0,0 +1,121 @@
+"""Снимок базы знаний: те же ответы, что у индексов в памяти;
+битый файл не открывается и пересобирается."""
+import os
+import random
+import struct
+
+import pytest
+
+from matcher import PhraseMatcher
+from retrieval import FuzzyIndex
+from snapshot import HEADER, Snapshot, SnapshotStore, build, current_name, readable
+
+WORDS = ["кот", "пёс", "мяч", "дом", "лес", "река", "гора", "снег",
+         "чай", "сок", "суп", "хлеб", "сыр", "лук", "мир", "год"]
+
+
+def make_rows(seed=7, n=400):
+    rng = random.Random(seed)
+    phrases = set()
+    while len(phrases) < n:
+        phrases.add(" ".join(rng.choices(WORDS, k=rng.randint(1, 4))))
+    phrases = sorted(phrases)
+    rng.shuffle(phrases)
+    # (id, фраза, заглушка ли) по возрастанию id, как их отдаёт build_snapshot()
+    return [(i * 3 + 1, p, i % 10 == 0) for i, p in enumerate(phrases)]
+
+
+def memory_indexes(rows, deleted=()):
+    matcher, fuzzy = PhraseMatcher(), FuzzyIndex()
+    for kid, phrase, is_placeholder in rows:
+        if kid not in deleted:
+            matcher.add(phrase, kid, (0, kid))
+        # idf у снимка считается по всем строкам, удалённые только отфильтрованы
+        if not is_placeholder:
+            fuzzy.add(kid, phrase)
+    fuzzy.rebuild()
+    return matcher, fuzzy
+
+
+def queries(seed=8, n=200):
+    rng = random.Random(seed)
+    words = WORDS + ["что", "где", "как"]
+    return [" ".join(rng.choices(words, k=rng.randint(1, 6))) for _ in range(n)]
+
+
+@pytest.fixture
+def snap(tmp_path):
+    rows = make_rows()
+    path = build(str(tmp_path), rows, last_id=rows[-1][0], tombstone_id=0)
+    s = Snapshot(path)
+    yield rows, s
+    s.close()
+
+
+@pytest.mark.parametrize("deleted", [frozenset(), frozenset({1, 4, 31, 301})])
+def test_snapshot_matches_memory_indexes(snap, deleted):
+    rows, s = snap
+    matcher, fuzzy = memory_indexes(rows, deleted)
+    assert len(s) == len(rows)
+    for q in queries():
+        hit = matcher.match(q)
+        assert s.match(q, deleted) == (hit[1] if hit else None), q
+        mem = fuzzy.search(q, k=3 + len(deleted))
+        mem = [(kid, score) for kid, score in mem if kid not in deleted][:3]
+        got = s.search(q, k=3, deleted=deleted)
+        expected = pytest.approx([score for _kid, score in mem], rel=1e-5)
+        assert [score for _kid, score in got] == expected, q
+        if len(mem) > 1 and mem[0][1] - mem[1][1] > 1e-4:
+            assert got[0][0] == mem[0][0], q
+
+
+def test_truncated_snapshot_is_rejected(snap):
+    _rows, s = snap
+    with open(s.path, "rb") as f:
+        data = f.read()
+    for size in (10, HEADER.size, len(data) // 2, len(data) - 1):
+        with open(s.path + ".cut", "wb") as f:
+            f.write(data[:size])
+        with pytest.raises(ValueError):
+            Snapshot(s.path + ".cut")
+        assert not readable(s.path + ".cut")
+
+
+def test_other_format_version_is_rejected(snap):
+    _rows, s = snap
+    with open(s.path, "rb") as f:
+        data = bytearray(f.read())
+    struct.pack_into("<I", data, 4, 999)   # поле FORMAT сразу после MAGIC
+    with open(s.path + ".old", "wb") as f:
+        f.write(data)
+    with pytest.raises(ValueError):
+        Snapshot(s.path + ".old")
+
+
+def test_broken_snapshot_is_rebuilt(main, monkeypatch, tmp_path):
+    directory = str(tmp_path / "snap")
+    monkeypatch.setattr(main, "SNAPSHOT_DIR", directory)
+    with main.app.app_context():
+        row = main.Knowledge(phrase="снимок для проверки", answer="ответ")
+        main.db.session.add(row)
+        main.db.session.commit()
+    path = main.build_snapshot()
+    assert readable(path)
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) // 2)
+
+    # Воркер: снимок не открылся — просит пересборку
+    store = SnapshotStore(directory, check=0)
+    assert not store.refresh()
+    assert store.broken == current_name(directory)
+    rebuilds = []
+    monkeypatch.setattr(main, "_snapshots", store)
+    monkeypatch.setattr(main, "_rebuild_snapshot", lambda: rebuilds.append(1))
+    with main.app.app_context():
+        main.sync_phrases()
+    assert rebuilds
+
+    # Сборщик (kb.py snapshot --if-missing) не считает битый снимок готовым
+    rebuilt = main.build_snapshot(if_missing=True)
+    assert rebuilt is not None and readable(rebuilt)
+    assert store.refresh() and store.broken is None
@@ -0,0 +1,67 @@
+"""WriteBehind: пачки не теряются при ошибках записи; заявки пишутся сразу."""
+import time
+
+from sqlalchemy import Column, Integer, MetaData, String, Table, create_engine, select
+
+from storage import WriteBehind
+
+
+def make_table():
+    return Table("kb", MetaData(), Column("id", Integer, primary_key=True), Column("phrase", String, unique=True))
+
+
+def wait_for(cond, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not cond() and time.monotonic() < deadline:
+        time.sleep(0.02)
+    return cond()
+
+
+def test_rows_survive_write_errors(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/wb.sqlite3")
+    table = make_table()
+    wb = WriteBehind(engine, batch_size=10, interval=0.01, max_backoff=0.05)
+    for i in range(5):
+        wb.put(table, {"phrase": f"фраза {i}"})   # таблицы ещё нет — запись падает
+    assert wait_for(lambda: wb.errors >= 3)
+    assert wb._thread.is_alive()
+    table.metadata.create_all(engine)
+    assert wait_for(lambda: wb.written == 5)
+    with engine.connect() as conn:
+        assert len(conn.execute(select(table)).all()) == 5
+    wb.close()
+
+
+def test_writer_thread_survives_unexpected_errors(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path}/wb.sqlite3")
+    table = make_table()
+    table.metadata.create_all(engine)
+    wb = WriteBehind(engine, batch_size=10, interval=0.01, max_backoff=0.05)
+    real_begin, failures = engine.begin, []
+
+    def flaky_begin():
+        if not failures:
+            failures.append(1)
+            raise RuntimeError("сбой")
+        return real_begin()
+    monkeypatch.setattr(engine, "begin", flaky_begin)
+    wb.put(table, {"phrase": "а"})
+    assert wait_for(lambda: wb.written == 1)
+    wb.put(table, {"phrase": "б"})
+    assert wait_for(lambda: wb.written == 2)
+    assert wb.errors == 1
+    wb.close()
+
+
+def test_support_ticket_is_written_at_once(main, monkeypatch):
+    notified = []
+    monkeypatch.setattr(main.support_feed, "notify", lambda: notified.append(1))
+    with main.app.app_context():
+        wb = WriteBehind(main.db.engine, interval=10)
+        monkeypatch.setattr(main, "writes", wb)
+        before = main.Support.query.count()
+        main.save_support(1, "Не приходит письмо")
+        assert main.Support.query.count() == before + 1
+    assert notified == [1]
+    assert wb.pending() == 0
+    wb.close()
@@ -0,0 +1,67 @@
+"""/chat/stream против фейкового SSE-сервера: полный поток и обрыв до [DONE]."""
+import json
+
+import pytest
+
+
+def chunk(text):
+    return "data: " + json.dumps({"choices": [{"delta": {"content": text}}]}, ensure_ascii=False)
+
+
+def events(body):
+    out = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.split("\n"))
+        out.append((lines["event"], json.loads(lines["data"])))
+    return out
+
+
+@pytest.fixture
+def client(main):
+    with main.app.app_context():
+        user = main.User.query.filter_by(login="stream").first()
+        if user is None:
+            main.db.session.add(main.User(login="stream", password="p"))
+            main.db.session.commit()
+    c = main.app.test_client()
+    c.post("/login", data={"login": "stream", "password": "p"})
+    return c
+
+
+def knowledge(main, phrase):
+    with main.app.app_context():
+        return main.Knowledge.query.filter_by(phrase=phrase).first()
+
+
+def last_answer(main):
+    with main.app.app_context():
+        return main.Message.query.order_by(main.Message.id.desc()).first().text
+
+
+def test_stream_complete(main, client, upstream):
+    upstream.sse = [chunk("Квазиблорп — "), chunk("выдуманное слово."), "data: [DONE]"]
+    r = client.post("/chat/stream", data={"text": "Квазиблорп"})
+    got = events(r.get_data(as_text=True))
+    assert [e for e, _ in got] == ["token", "token", "done"]
+    assert got[-1][1]["text"] == "Квазиблорп — выдуманное слово."
+    assert last_answer(main) == "Квазиблорп — выдуманное слово."
+    assert knowledge(main, "квазиблорп").answer == "Квазиблорп — выдуманное слово."
+    assert main.answer_cache.get("answer:" + main.normalize_text("Квазиблорп")) \
+        == "Квазиблорп — выдуманное слово."
+
+
+def test_stream_truncated(main, client, upstream):
+    # Соединение закрылось после первого куска, [DONE] не пришёл
+    upstream.sse = [chunk("Начало отве")]
+    r = client.post("/chat/stream", data={"text": "Зюзюбра"})
+    got = events(r.get_data(as_text=True))
+    assert got[0] == ("token", {"t": "Начало отве"})
+    assert got[-1] == ("done", {"text": main.LOST_ANSWER})
+    assert last_answer(main) == main.LOST_ANSWER
+    assert knowledge(main, "зюзюбра") is None
+    assert main.answer_cache.get("answer:" + main.normalize_text("Зюзюбра")) is main.MISS
+
+
+def test_stream_get_not_allowed(client, upstream):
+    assert client.get("/chat/stream?text=привет").status_code == 405
+    assert upstream.requests == []
@@ -0,0 +1,58 @@
+"""UpstreamClient против локального сервера-заглушки: keep-alive и повторы."""
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from upstream import UpstreamClient
+
+
+class Stub(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive
+    status = 200
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.server.requests.append((self.command, self.client_address))
+        self.send_response(self.status)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    do_GET = do_POST = _reply
+
+
+@pytest.fixture
+def stub():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Stub)
+    server.daemon_threads = True
+    server.requests = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    Stub.status = 200
+    server.shutdown()
+    server.server_close()
+
+
+def test_calls_reuse_one_connection(stub):
+    client = UpstreamClient("stub", f"http://127.0.0.1:{stub.server_address[1]}", timeout=5)
+    for i in range(20):
+        resp = client.get(f"/page/{i}") if i % 2 else client.post("/llm", json={"i": i})
+        assert resp.status_code == 200
+    assert len(stub.requests) == 20
+    assert len({addr for _method, addr in stub.requests}) == 1
+    assert client.connections_opened() == 1
+    assert client.stats.snapshot()["calls"] == 20
+    client.close()
+
+
+def test_only_idempotent_methods_are_retried(stub):
+    Stub.status = 503
+    client = UpstreamClient("stub", f"http://127.0.0.1:{stub.server_address[1]}", timeout=5, retries=2, backoff=0)
+    assert client.get("/page").status_code == 503
+    assert client.post("/llm", json={}).status_code == 503
+    assert [method for method, _addr in stub.requests] == ["GET", "GET", "GET", "POST"]
+    client.close()
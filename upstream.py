@@ -0,0 +1,175 @@
+"""Общий HTTP-клиент для внешних сервисов (Википедия, DeepInfra).
+
+Один requests.Session на сервис: пул соединений на хост с keep-alive,
+таймауты по умолчанию, повтор с экспоненциальной задержкой только для
+идемпотентных методов и счётчики задержек/ошибок по каждому сервису.
+Базовый адрес задаётся в конструкторе, поэтому клиента можно направить
+на локальный тестовый сервер.
+
+AsyncUpstreamClient — то же на httpx.AsyncClient для асинхронного
+конвейера ответов (ANSWER_MODE=async); httpx нужен только ему.
+"""
+import asyncio
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+IDEMPOTENT = frozenset({"GET", "HEAD", "OPTIONS"})
+
+
+class UpstreamStats:
+    """Счётчики одного сервиса: вызовы, ошибки, коды ответа, задержки."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.statuses = {}
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def record(self, elapsed, status=None, error=False):
+        with self._lock:
+            self.calls += 1
+            self.latency_total += elapsed
+            self.latency_max = max(self.latency_max, elapsed)
+            if status is not None:
+                self.statuses[status] = self.statuses.get(status, 0) + 1
+            if error:
+                self.errors += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "errors": self.errors,
+                "statuses": dict(self.statuses),
+                "latency_avg": self.latency_total / self.calls if self.calls else 0.0,
+                "latency_max": self.latency_max,
+            }
+
+
+class UpstreamClient:
+    """Клиент к одному внешнему сервису с пулом keep-alive соединений.
+
+    timeout — как в requests: число или пара (connect, read).
+    retries/backoff применяются только к методам из IDEMPOTENT: POST к LLM
+    не повторяется, чтобы не платить за генерацию дважды.
+    """
+
+    def __init__(self, name, base_url, timeout=10, pool_size=10, retries=2, backoff=0.3,
+                 retry_statuses=(429, 500, 502, 503, 504)):
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.stats = UpstreamStats()
+        self.session = requests.Session()
+        retry = Retry(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=retry_statuses,
+            allowed_methods=IDEMPOTENT,
+            raise_on_status=False,
+            respect_retry_after_header=True,
+        )
+        self._adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size,
+                                    max_retries=retry, pool_block=False)
+        self.session.mount("http://", self._adapter)
+        self.session.mount("https://", self._adapter)
+
+    def url(self, path):
+        return path if path.startswith(("http://", "https://")) else self.base_url + path
+
+    def request(self, method, path, **kwargs):
+        """Выполняет запрос и учитывает его в stats. Исключения requests пробрасываются."""
+        kwargs.setdefault("timeout", self.timeout)
+        t0 = time.perf_counter()
+        try:
+            resp = self.session.request(method, self.url(path), **kwargs)
+        except requests.RequestException:
+            self.stats.record(time.perf_counter() - t0, error=True)
+            raise
+        self.stats.record(time.perf_counter() - t0, resp.status_code, error=resp.status_code >= 500)
+        return resp
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    def connections_opened(self):
+        """Сколько TCP-соединений открыто к базовому хосту за всё время
+        (для проверки, что соединения переиспользуются)."""
+        host = urlsplit(self.base_url).hostname
+        pools = self._adapter.poolmanager.pools
+        keys = pools.keys()   # копия ключей: сам RecentlyUsedContainer не перебирается
+        return sum(pools[key].num_connections for key in keys if key.key_host == host)
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncUpstreamClient:
+    """Асинхронный клиент к одному сервису. Повторы — как у UpstreamClient:
+    только для IDEMPOTENT, на retry_statuses и сетевые ошибки, с учётом
+    Retry-After. stats можно передать от синхронного клиента того же
+    сервиса, чтобы счётчики были общими.
+
+    Пользоваться клиентом можно только из одного цикла событий.
+    """
+
+    def __init__(self, name, base_url, timeout=10, pool_size=10, max_connections=100, retries=2,
+                 backoff=0.3, retry_statuses=(429, 500, 502, 503, 504), stats=None):
+        if httpx is None:
+            raise RuntimeError("для асинхронного клиента нужен httpx (pip install httpx)")
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.retries = retries
+        self.backoff = backoff
+        self.retry_statuses = frozenset(retry_statuses)
+        self.stats = stats or UpstreamStats()
+        self.client = httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=pool_size),
+        )
+
+    def url(self, path):
+        return path if path.startswith(("http://", "https://")) else self.base_url + path
+
+    async def request(self, method, path, **kwargs):
+        """Выполняет запрос и учитывает его в stats. Исключения httpx пробрасываются."""
+        retries = self.retries if method in IDEMPOTENT else 0
+        for attempt in range(retries + 1):
+            t0 = time.perf_counter()
+            try:
+                resp = await self.client.request(method, self.url(path), **kwargs)
+            except httpx.HTTPError:
+                self.stats.record(time.perf_counter() - t0, error=True)
+                if attempt == retries:
+                    raise
+                await asyncio.sleep(self.backoff * 2 ** attempt)
+                continue
+            self.stats.record(time.perf_counter() - t0, resp.status_code, error=resp.status_code >= 500)
+            if resp.status_code not in self.retry_statuses or attempt == retries:
+                return resp
+            retry_after = resp.headers.get("Retry-After", "")
+            await asyncio.sleep(float(retry_after) if retry_after.isdigit() else self.backoff * 2 ** attempt)
+
+    async def get(self, path, **kwargs):
+        return await self.request("GET", path, **kwargs)
+
+    async def post(self, path, **kwargs):
+        return await self.request("POST", path, **kwargs)
+
+    async def close(self):
+        await self.client.aclose()